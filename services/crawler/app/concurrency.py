@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Literal, Optional
+from urllib.parse import urlparse
+
+Outcome = Literal["ok", "throttled", "error"]
+
+# Latency is treated as congestion once the smoothed value exceeds the best
+# one among the last _LATENCY_WINDOW responses by this factor.
+_LATENCY_TOLERANCE = 2.0
+_LATENCY_WINDOW = 32
+_EWMA_ALPHA = 0.2
+_MAX_BACKOFF_S = 30.0
+
+
+class AdaptiveLimiter:
+    # AIMD limit on in-flight requests to a single host. Starts in slow start
+    # (+1 per success, doubling each round trip) until the first decrease, then
+    # +1 per window of successful, non-degraded responses; x0.5 on 429/503, x0.75 on errors and
+    # x0.9 when latency climbs; retries after throttling or errors back off
+    # exponentially. At most one decrease is applied per round trip so a burst
+    # of failures from the same window only counts once. `stats` is kept equal
+    # to snapshot() after every response, so job metrics stay live.
+    def __init__(
+        self, initial: int, min_limit: int, max_limit: int, stats: Optional[Dict[str, Any]] = None
+    ) -> None:
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.peak = self.limit
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._samples: Deque[float] = deque(maxlen=_LATENCY_WINDOW)
+        self._latency: Optional[float] = None
+        self._last_decrease = 0.0
+        self._consecutive_throttles = 0
+        self._consecutive_errors = 0
+        self._slow_start = True
+        self.stats = stats if stats is not None else {}
+        self.stats.update(self.snapshot())
+
+    @property
+    def current(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    async def acquire(self) -> float:
+        if not self._waiters and self.in_flight < self.current:
+            self.in_flight += 1
+            return time.perf_counter()
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.in_flight -= 1
+                self._wake()
+            raise
+        return time.perf_counter()
+
+    def release(self, started: float, outcome: Outcome, retry_after: Optional[float] = None) -> float:
+        # Returns how long the caller should wait before retrying (0 on success).
+        now = time.perf_counter()
+        elapsed = now - started
+        self.in_flight -= 1
+        self.requests += 1
+        delay = 0.0
+
+        if outcome == "ok":
+            self._consecutive_throttles = 0
+            self._consecutive_errors = 0
+            if self._latency is None:
+                self._latency = elapsed
+            else:
+                self._latency += _EWMA_ALPHA * (elapsed - self._latency)
+            self._samples.append(elapsed)
+            if len(self._samples) >= 8 and self._latency > min(self._samples) * _LATENCY_TOLERANCE:
+                self._decrease(now, 0.9)
+            elif self.in_flight + 1 >= self.current:
+                # Only grow when the current limit is actually being used.
+                step = 1.0 if self._slow_start else 1.0 / self.limit
+                self.limit = min(float(self.max_limit), self.limit + step)
+                self.peak = max(self.peak, self.limit)
+        elif outcome == "throttled":
+            self.throttled += 1
+            self._consecutive_throttles += 1
+            self._decrease(now, 0.5)
+            backoff = 0.5 * (2 ** min(self._consecutive_throttles, 6))
+            delay = min(_MAX_BACKOFF_S, retry_after if retry_after is not None else backoff)
+        else:
+            self.errors += 1
+            self._consecutive_errors += 1
+            self._decrease(now, 0.75)
+            delay = min(_MAX_BACKOFF_S, 0.25 * (2 ** min(self._consecutive_errors, 6)))
+
+        self._wake()
+        self.stats.update(self.snapshot())
+        return delay
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "limit": self.current,
+            "peak_limit": int(self.peak),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "requests": self.requests,
+            "throttled": self.throttled,
+            "errors": self.errors,
+            "latency_ms": round(self._latency * 1000.0, 1) if self._latency is not None else None,
+            "min_latency_ms": round(min(self._samples) * 1000.0, 1) if self._samples else None,
+        }
+
+    def _decrease(self, now: float, factor: float) -> None:
+        window = self._latency if self._latency is not None else 0.0
+        if now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        self._slow_start = False
+        self.limit = max(float(self.min_limit), self.limit * factor)
+
+    def _wake(self) -> None:
+        while self._waiters and self.in_flight < self.current:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.in_flight += 1
+                fut.set_result(None)
+
+
+class HostLimiters:
+    # `stats` receives one live snapshot dict per host (see AdaptiveLimiter).
+    def __init__(
+        self, initial: int, min_limit: int, max_limit: int, stats: Optional[Dict[str, Dict[str, Any]]] = None
+    ) -> None:
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.stats = stats if stats is not None else {}
+        self._hosts: Dict[str, AdaptiveLimiter] = {}
+
+    def for_url(self, url: str) -> AdaptiveLimiter:
+        host = urlparse(url).netloc.lower()
+        limiter = self._hosts.get(host)
+        if limiter is None:
+            limiter = AdaptiveLimiter(self.initial, self.min_limit, self.max_limit, self.stats.setdefault(host, {}))
+            self._hosts[host] = limiter
+        return limiter
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {host: limiter.snapshot() for host, limiter in self._hosts.items()}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
@@ -1,15 +1,22 @@
 from __future__ import annotations
 
 import asyncio
+import codecs
 import re
+import time
+from html.parser import HTMLParser
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Dict, List, Optional, Set
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set
 from urllib.parse import urljoin, urlparse
 
 import httpx
 from bs4 import BeautifulSoup
 
-from .types import CrawlRequest, ScrapedProduct, SourceConfig
+from .concurrency import HostLimiters, Outcome, parse_retry_after
+from .structured import PRODUCT_FIELDS, extract_structured
+from .types import CrawlRequest, ProductRecord, SourceConfig
+from .urls import Frontier, canonicalize_url, find_rel_canonical
 
 
 def _now_iso() -> str:
@@ -37,20 +44,18 @@ def _parse_price(text: Optional[str]) -> Optional[float]:
     return value
 
 
-def _extract_text(html: str, selector: Optional[str]) -> Optional[str]:
+def _extract_text(soup: BeautifulSoup, selector: Optional[str]) -> Optional[str]:
     if not selector:
         return None
-    soup = BeautifulSoup(html, "html.parser")
     node = soup.select_one(selector)
     if node is None:
         return None
     return _normalize_text(node.get_text())
 
 
-def _extract_attr(html: str, selector: Optional[str], attribute: str, base_url: str) -> Optional[str]:
+def _extract_attr(soup: BeautifulSoup, selector: Optional[str], attribute: str, base_url: str) -> Optional[str]:
     if not selector:
         return None
-    soup = BeautifulSoup(html, "html.parser")
     node = soup.select_one(selector)
     if node is None:
         return None
@@ -71,8 +76,7 @@ def _extract_links(html: str, base_url: str, selector: str, attribute: str) -> L
     return list(urls)
 
 
-def _build_page_info(html: str, url: str) -> Dict[str, object]:
-    soup = BeautifulSoup(html, "html.parser")
+def _build_page_info(soup: BeautifulSoup, url: str) -> Dict[str, object]:
     title = _normalize_text(soup.title.string) if soup.title and soup.title.string else None
 
     description = None
@@ -115,6 +119,53 @@ def _build_page_info(html: str, url: str) -> Dict[str, object]:
     }
 
 
+_HEAD_END_RE = re.compile(r"</head\s*>|<body\b", re.IGNORECASE)
+
+
+class _HeadScanner(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.title: Optional[str] = None
+        self.description: Optional[str] = None
+        self._in_title = False
+        self._title_parts: List[str] = []
+
+    def handle_starttag(self, tag: str, attrs: List[tuple]) -> None:
+        if tag == "title" and self.title is None:
+            self._in_title = True
+        elif tag == "meta" and self.description is None:
+            attr = dict(attrs)
+            if (attr.get("name") or "").lower() == "description" and attr.get("content"):
+                self.description = _normalize_text(attr["content"])
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "title" and self._in_title:
+            self._in_title = False
+            self.title = _normalize_text("".join(self._title_parts))
+
+    def handle_data(self, data: str) -> None:
+        if self._in_title:
+            self._title_parts.append(data)
+
+
+def _build_head_page_info(html: str, url: str, values: Dict[str, Any]) -> Dict[str, object]:
+    # Same shape as _build_page_info, from the <head> alone: no DOM is built
+    # for pages whose product fields all came from structured data.
+    end = _HEAD_END_RE.search(html)
+    scanner = _HeadScanner()
+    scanner.feed(html[: end.start()] if end else html)
+    scanner.close()
+    return {
+        "url": url,
+        "domain": urlparse(url).netloc,
+        "title": scanner.title or values.get("title"),
+        "description": scanner.description,
+        "headings": [],
+        "paragraphs": [],
+        "links": [],
+    }
+
+
 def _build_page_markdown(info: Dict[str, object]) -> str:
     lines: List[str] = []
     title = info.get("title") or info.get("url")
@@ -152,51 +203,187 @@ def _build_page_markdown(info: Dict[str, object]) -> str:
     return "\n".join(lines)
 
 
-async def _fetch_text(client: httpx.AsyncClient, url: str) -> str:
-    resp = await client.get(url)
-    resp.raise_for_status()
-    return resp.text
+_THROTTLE_STATUSES = (429, 503)
+_MAX_ATTEMPTS = 4
+# Per-URL progress is published at most this often; state changes go out at once.
+_PROGRESS_INTERVAL_S = 0.25
+_SNIFF_BYTES = 1024
+_META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([A-Za-z0-9_.:-]+)""", re.IGNORECASE)
+_BOMS = ((codecs.BOM_UTF8, "utf-8-sig"), (codecs.BOM_UTF16_LE, "utf-16"), (codecs.BOM_UTF16_BE, "utf-16"))
+
+
+@dataclass(frozen=True)
+class FetchLimits:
+    max_bytes: int
+    content_types: Sequence[str]
+
+
+class SkippedResponse(Exception):
+    def __init__(self, url: str, reason: str) -> None:
+        super().__init__(f"{reason}: {url}")
+        self.url = url
+        self.reason = reason
+
+
+def _sniff_charset(head: bytes) -> str:
+    for bom, encoding in _BOMS:
+        if head.startswith(bom):
+            return encoding
+    match = _META_CHARSET_RE.search(head)
+    if match:
+        return match.group(1).decode("ascii")
+    return "utf-8"
+
+
+def _incremental_decoder(encoding: str) -> codecs.IncrementalDecoder:
+    try:
+        return codecs.getincrementaldecoder(encoding)(errors="replace")
+    except LookupError:
+        return codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+
+async def _read_text(resp: httpx.Response, url: str, limits: FetchLimits) -> str:
+    # Checks headers before any body is read, then decodes chunk by chunk so an
+    # oversized body is abandoned as soon as it crosses the limit.
+    mime = resp.headers.get("content-type", "").split(";", 1)[0].strip().lower()
+    if mime and limits.content_types and mime not in limits.content_types:
+        raise SkippedResponse(url, "content_type")
+    declared = resp.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > limits.max_bytes:
+        raise SkippedResponse(url, "too_large")
+
+    decoder: Optional[codecs.IncrementalDecoder] = None
+    head = b""
+    parts: List[str] = []
+    size = 0
+    async for chunk in resp.aiter_bytes():
+        size += len(chunk)
+        if size > limits.max_bytes:
+            raise SkippedResponse(url, "too_large")
+        if decoder is None:
+            head += chunk
+            if len(head) < _SNIFF_BYTES:
+                continue
+            decoder = _incremental_decoder(resp.charset_encoding or _sniff_charset(head))
+            chunk = head
+        parts.append(decoder.decode(chunk))
+    if decoder is None:
+        decoder = _incremental_decoder(resp.charset_encoding or _sniff_charset(head))
+        parts.append(decoder.decode(head))
+    parts.append(decoder.decode(b"", final=True))
+    return "".join(parts)
+
+
+async def _fetch_text(
+    client: httpx.AsyncClient, url: str, limits: FetchLimits, limiters: Optional[HostLimiters] = None
+) -> str:
+    if limiters is None:
+        resp = await client.send(client.build_request("GET", url), stream=True)
+        try:
+            resp.raise_for_status()
+            return await _read_text(resp, url, limits)
+        finally:
+            await resp.aclose()
+
+    limiter = limiters.for_url(url)
+    attempt = 0
+    while True:
+        attempt += 1
+        started = await limiter.acquire()
+        try:
+            resp = await client.send(client.build_request("GET", url), stream=True)
+        except httpx.TransportError:
+            delay = limiter.release(started, "error")
+            if attempt == _MAX_ATTEMPTS:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            limiter.release(started, "error")
+            raise
+
+        if resp.status_code in _THROTTLE_STATUSES:
+            await resp.aclose()
+            delay = limiter.release(started, "throttled", parse_retry_after(resp.headers.get("retry-after")))
+            if attempt == _MAX_ATTEMPTS:
+                resp.raise_for_status()
+            await asyncio.sleep(delay)
+            continue
+
+        # A connection dropped mid-body is retried like one that failed to open.
+        outcome: Outcome = "error" if resp.status_code >= 500 else "ok"
+        try:
+            resp.raise_for_status()
+            return await _read_text(resp, url, limits)
+        except httpx.TransportError:
+            outcome = "error"
+            if attempt == _MAX_ATTEMPTS:
+                raise
+        finally:
+            await resp.aclose()
+            delay = limiter.release(started, outcome)
+        await asyncio.sleep(delay)
 
 
 async def _resolve_product_urls(
-    client: httpx.AsyncClient, source: SourceConfig
+    client: httpx.AsyncClient,
+    source: SourceConfig,
+    limits: FetchLimits,
+    skipped: Dict[str, int],
+    limiters: Optional[HostLimiters] = None,
 ) -> List[str]:
-    urls: Set[str] = set([str(x) for x in source.product_pages])
+    # Returns every discovered URL as found, duplicates included; the job
+    # frontier decides which ones get fetched.
+    urls: List[str] = [str(x) for x in source.product_pages]
     for list_url in source.list_pages:
-        html = await _fetch_text(client, str(list_url))
+        try:
+            html = await _fetch_text(client, str(list_url), limits, limiters)
+        except SkippedResponse as exc:
+            skipped[exc.reason] = skipped.get(exc.reason, 0) + 1
+            continue
         links = _extract_links(
             html=html,
             base_url=str(list_url),
             selector=source.item_link_selector,
             attribute=source.item_link_attribute,
         )
-        urls.update(links)
-    return list(urls)
-
-
-async def _scrape_product(
-    client: httpx.AsyncClient, source_name: str, url: str, selectors: SourceConfig
-) -> ScrapedProduct:
-    html = await _fetch_text(client, url)
-    title = _extract_text(html, selectors.product.title)
-    price_text = _extract_text(html, selectors.product.price)
-    currency = _extract_text(html, selectors.product.currency)
-    image_url = _extract_attr(html, selectors.product.image, "src", url)
-    sku = _extract_text(html, selectors.product.sku)
-    availability = _extract_text(html, selectors.product.availability)
-
-    page_info = _build_page_info(html, url)
-    page_markdown = _build_page_markdown(page_info)
-
-    return ScrapedProduct(
-        source=source_name,
+        urls.extend(links)
+    return urls
+
+
+def _extract_product(html: str, url: str, source: SourceConfig) -> ProductRecord:
+    selectors = source.product
+    values: Dict[str, Any] = {}
+    if source.extraction == "auto":
+        values = extract_structured(html, url)
+
+    # The DOM is only parsed when a configured selector still has work to do
+    # or full page info was asked for, and then only once.
+    missing = [f for f in PRODUCT_FIELDS if values.get(f) is None and getattr(selectors, f)]
+    soup = BeautifulSoup(html, "html.parser") if missing or source.page_info is True else None
+    for field in missing:
+        if field == "image":
+            values[field] = _extract_attr(soup, selectors.image, "src", url)
+        elif field == "price":
+            values[field] = _parse_price(_extract_text(soup, selectors.price))
+        else:
+            values[field] = _extract_text(soup, getattr(selectors, field))
+
+    page_info: Dict[str, Any] = {}
+    page_markdown = None
+    if source.page_info:
+        page_info = _build_page_info(soup, url) if soup is not None else _build_head_page_info(html, url, values)
+        page_markdown = _build_page_markdown(page_info)
+
+    return ProductRecord(
+        source=source.name,
         url=url,
-        title=title,
-        price=_parse_price(price_text),
-        currency=currency,
-        image_url=image_url,
-        sku=sku,
-        availability=availability,
+        title=values.get("title"),
+        price=values.get("price"),
+        currency=values.get("currency"),
+        image_url=values.get("image"),
+        sku=values.get("sku"),
+        availability=values.get("availability"),
         scraped_at=_now_iso(),
         raw_html=html,
         page_info=page_info,
@@ -204,23 +391,140 @@ async def _scrape_product(
     )
 
 
-async def crawl(request: CrawlRequest) -> List[ScrapedProduct]:
+async def _scrape_product(
+    client: httpx.AsyncClient,
+    url: str,
+    source: SourceConfig,
+    limits: FetchLimits,
+    frontier: Frontier,
+    limiters: Optional[HostLimiters] = None,
+    sem: Optional[asyncio.Semaphore] = None,
+) -> ProductRecord:
+    # `url` is fetched as found; its canonical form is only the frontier key.
+    # `sem` only covers the fetch: an alias waiting on another fetch below
+    # must not hold a slot that fetch needs.
+    keys = [canonicalize_url(url, source.urls)]
+    covered = False
+    try:
+        if sem is not None:
+            async with sem:
+                html = await _fetch_text(client, url, limits)
+        else:
+            html = await _fetch_text(client, url, limits, limiters)
+        if source.urls.use_rel_canonical:
+            canonical = find_rel_canonical(html, url)
+            if canonical:
+                canonical = canonicalize_url(canonical, source.urls)
+                # Site-wide canonicals (home page, other hosts) are misconfigurations, not aliases.
+                parts = urlparse(canonical)
+                same_site = parts.netloc == urlparse(keys[0]).netloc and parts.path != "/"
+                if same_site and frontier.claim_alias(keys[0], canonical):
+                    keys.append(canonical)
+                elif same_site and await frontier.covered(keys[0], canonical):
+                    covered = True
+                    raise SkippedResponse(url, "duplicate")
+        item = _extract_product(html, url, source)
+        covered = True
+        return item
+    finally:
+        for key in keys:
+            frontier.resolve(key, covered)
+
+
+async def crawl(
+    request: CrawlRequest,
+    metrics: Optional[Dict[str, Any]] = None,
+    on_progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> List[ProductRecord]:
     concurrency = max(1, int(request.concurrency))
     timeout = httpx.Timeout(request.request_timeout_ms / 1000.0)
     headers = {"user-agent": "shopping-system-crawler/1.0", "accept": "text/html,application/xhtml+xml"}
+    limits = FetchLimits(
+        max_bytes=request.max_response_bytes,
+        content_types=[x.strip().lower() for x in request.content_types if x.strip()],
+    )
+    metrics = metrics if metrics is not None else {}
+    skipped: Dict[str, int] = {}
+    metrics["skipped"] = skipped
+    frontier = Frontier()
+    progress: Dict[str, Any] = {
+        "sources": [
+            {"name": src.name, "state": "pending", "discovered": 0, "queued": 0, "done": 0, "items": 0}
+            for src in request.sources
+        ]
+    }
+
+    last_report = 0.0
+    pending: Optional[asyncio.TimerHandle] = None
+
+    def flush() -> None:
+        nonlocal last_report, pending
+        pending = None
+        last_report = time.monotonic()
+        on_progress(progress)
+
+    def report(force: bool = False) -> None:
+        # Coalesces bursts of per-URL updates into one every
+        # _PROGRESS_INTERVAL_S, with a trailing update so the last one lands.
+        nonlocal pending
+        if on_progress is None:
+            return
+        if force:
+            if pending is not None:
+                pending.cancel()
+            flush()
+            return
+        if pending is not None:
+            return
+        wait = last_report + _PROGRESS_INTERVAL_S - time.monotonic()
+        if wait <= 0:
+            flush()
+        else:
+            pending = asyncio.get_running_loop().call_later(wait, flush)
+
+    limiters: Optional[HostLimiters] = None
+    if request.concurrency_mode == "adaptive":
+        # Each host gets its own limit, so the global semaphore is not used.
+        metrics["concurrency"] = {"mode": "adaptive", "hosts": {}}
+        limiters = HostLimiters(
+            concurrency, request.min_concurrency, request.max_concurrency, metrics["concurrency"]["hosts"]
+        )
+    else:
+        metrics["concurrency"] = {"mode": "fixed", "limit": concurrency}
 
     async with httpx.AsyncClient(timeout=timeout, headers=headers, follow_redirects=True) as client:
         sem = asyncio.Semaphore(concurrency)
-        items: List[ScrapedProduct] = []
-
-        async def run_one(url: str, src: SourceConfig) -> ScrapedProduct:
-            async with sem:
-                return await _scrape_product(client, src.name, url, src)
-
-        for src in request.sources:
-            product_urls = await _resolve_product_urls(client, src)
-            tasks = [asyncio.create_task(run_one(url, src)) for url in product_urls]
-            results = await asyncio.gather(*tasks)
-            items.extend(results)
+        items: List[ProductRecord] = []
+
+        async def run_one(url: str, src: SourceConfig, state: Dict[str, Any]) -> Optional[ProductRecord]:
+            item: Optional[ProductRecord] = None
+            try:
+                item = await _scrape_product(
+                    client, url, src, limits, frontier, limiters, sem if limiters is None else None
+                )
+            except SkippedResponse as exc:
+                skipped[exc.reason] = skipped.get(exc.reason, 0) + 1
+            state["done"] += 1
+            state["items"] += item is not None
+            report()
+            return item
+
+        try:
+            for src, state in zip(request.sources, progress["sources"]):
+                state["state"] = "discovering"
+                report(force=True)
+                discovered = await _resolve_product_urls(client, src, limits, skipped, limiters)
+                product_urls = [url for url in discovered if frontier.claim(canonicalize_url(url, src.urls))]
+                state.update(state="fetching", discovered=len(discovered), queued=len(product_urls))
+                report(force=True)
+                tasks = [asyncio.create_task(run_one(url, src, state)) for url in product_urls]
+                results = await asyncio.gather(*tasks)
+                items.extend(x for x in results if x is not None)
+                state["state"] = "done"
+                report(force=True)
+        finally:
+            if pending is not None:
+                pending.cancel()
+            metrics["frontier"] = frontier.snapshot()
 
         return items
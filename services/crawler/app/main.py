@@ -3,20 +3,25 @@ from __future__ import annotations
 import asyncio
 import uuid
 import os
-from typing import Any, Dict
+from typing import Any, AsyncIterator, Dict, Optional
 
 import httpx
-from fastapi import BackgroundTasks, FastAPI, HTTPException
+from fastapi import BackgroundTasks, FastAPI, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from .crawler import crawl
-from .store import JobStore
-from .types import CrawlRequest, JobItemsView, JobView, ScrapedProduct
+from .serialization import ORJSONResponse, dumps
+from .store import JobRecord, JobStore
+from .types import CrawlRequest, JobItemsView, JobView, ProductRecord
 
 
 app = FastAPI()
 store = JobStore()
 
+MAX_WAIT_S = 60.0
+SSE_HEARTBEAT_S = 15.0
+
 allowed_origins = os.getenv("CRAWLER_ALLOWED_ORIGINS", "http://localhost:4200")
 origins = [x.strip() for x in allowed_origins.split(",") if x.strip()]
 app.add_middleware(
@@ -41,26 +46,85 @@ async def create_job(request: CrawlRequest, background: BackgroundTasks) -> JobV
     return JobView(id=job_id, status="queued", count=0, error=None)
 
 
-@app.get("/crawler/jobs/{job_id}", response_model=JobView)
-async def get_job(job_id: str) -> JobView:
+# Job endpoints return plain dicts/dataclasses through ORJSONResponse; the
+# response models are kept for the OpenAPI schema only.
+@app.get("/crawler/jobs/{job_id}", response_model=JobView, response_class=ORJSONResponse)
+async def get_job(
+    job_id: str,
+    wait: float = Query(0.0, ge=0.0),
+    since: Optional[int] = Query(None, ge=0),
+) -> ORJSONResponse:
+    # With ?wait=N the request is held until the job changes (past ?since=,
+    # or past its current version) or N seconds pass, instead of the client
+    # re-polling.
     job = store.get(job_id)
     if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    return JobView(id=job.id, status=job.status, count=len(job.items), error=job.error)
+    if wait > 0:
+        version = job.version if since is None else since
+        await store.wait(job_id, version, min(wait, MAX_WAIT_S))
+    return ORJSONResponse(_job_view(job))
 
 
-@app.get("/crawler/jobs/{job_id}/items", response_model=JobItemsView)
-async def get_job_items(job_id: str) -> JobItemsView:
+@app.get("/crawler/jobs/{job_id}/events")
+async def get_job_events(job_id: str) -> StreamingResponse:
+    job = store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        _job_events(job),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-cache", "x-accel-buffering": "no"},
+    )
+
+
+@app.get("/crawler/jobs/{job_id}/items", response_model=JobItemsView, response_class=ORJSONResponse)
+async def get_job_items(
+    job_id: str,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1),
+) -> ORJSONResponse:
     job = store.get(job_id)
     if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    return JobItemsView(id=job.id, status=job.status, items=job.items, meta={"count": len(job.items)})
+    items = job.items[offset : offset + limit if limit else None]
+    meta = {"count": len(job.items), "offset": offset, "limit": limit, "metrics": job.metrics}
+    return ORJSONResponse({"id": job.id, "status": job.status, "items": items, "meta": meta})
+
+
+def _job_view(job: JobRecord) -> Dict[str, Any]:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "count": job.item_count,
+        "error": job.error,
+        "version": job.version,
+        "progress": job.progress,
+    }
+
+
+async def _job_events(job: JobRecord) -> AsyncIterator[bytes]:
+    # One event per observed version; bursts of updates while a client is
+    # being written to collapse into the latest snapshot.
+    version = -1
+    while True:
+        if job.version != version:
+            version = job.version
+            event = "done" if job.finished else "progress"
+            yield f"event: {event}\nid: {version}\ndata: ".encode() + dumps(_job_view(job)) + b"\n\n"
+            if job.finished:
+                return
+        await store.wait(job.id, version, SSE_HEARTBEAT_S)
+        if job.version == version:
+            yield b": keep-alive\n\n"
 
 
 async def _run_job(job_id: str, request: CrawlRequest) -> None:
     store.set_status(job_id, "running")
+    metrics: Dict[str, Any] = {}
+    store.set_metrics(job_id, metrics)
     try:
-        items = await crawl(request)
+        items = await crawl(request, metrics, lambda progress: store.set_progress(job_id, progress))
     except Exception as exc:
         store.set_error(job_id, str(exc))
         return
@@ -70,10 +134,10 @@ async def _run_job(job_id: str, request: CrawlRequest) -> None:
         await _post_callback(str(request.callback_url), job_id, items)
 
 
-async def _post_callback(url: str, job_id: str, items: list[ScrapedProduct]) -> None:
-    payload: Dict[str, Any] = {"id": job_id, "count": len(items), "items": [x.model_dump() for x in items]}
+async def _post_callback(url: str, job_id: str, items: list[ProductRecord]) -> None:
+    payload: Dict[str, Any] = {"id": job_id, "count": len(items), "items": items}
     try:
         async with httpx.AsyncClient(timeout=httpx.Timeout(10.0)) as client:
-            await client.post(url, json=payload)
+            await client.post(url, content=dumps(payload), headers={"content-type": "application/json"})
     except Exception:
         await asyncio.sleep(0)
@@ -1,17 +1,33 @@
 from __future__ import annotations
 
+import asyncio
+import copy
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 
-from .types import JobStatus, ScrapedProduct
+from .types import JobStatus, ProductRecord
 
 
 @dataclass
 class JobRecord:
     id: str
     status: JobStatus = "queued"
-    items: List[ScrapedProduct] = field(default_factory=list)
+    items: List[ProductRecord] = field(default_factory=list)
     error: Optional[str] = None
+    metrics: Dict[str, Any] = field(default_factory=dict)
+    progress: Dict[str, Any] = field(default_factory=dict)
+    version: int = 0
+    changed: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    @property
+    def item_count(self) -> int:
+        if self.items or self.finished:
+            return len(self.items)
+        return sum(int(x.get("items", 0)) for x in self.progress.get("sources", []))
 
 
 class JobStore:
@@ -31,6 +47,13 @@ class JobStore:
         if job is None:
             return
         job.status = status
+        self._touch(job)
+
+    def set_metrics(self, job_id: str, metrics: Dict[str, Any]) -> None:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        job.metrics = metrics
 
     def set_error(self, job_id: str, message: str) -> None:
         job = self._jobs.get(job_id)
@@ -38,10 +61,38 @@ class JobStore:
             return
         job.status = "failed"
         job.error = message
+        self._touch(job)
 
-    def set_items(self, job_id: str, items: List[ScrapedProduct]) -> None:
+    def set_items(self, job_id: str, items: List[ProductRecord]) -> None:
         job = self._jobs.get(job_id)
         if job is None:
             return
         job.items = items
         job.status = "completed"
+        self._touch(job)
+
+    def set_progress(self, job_id: str, progress: Dict[str, Any]) -> None:
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        # The crawler keeps mutating its own dict; readers get this snapshot.
+        job.progress = copy.deepcopy(progress)
+        self._touch(job)
+
+    async def wait(self, job_id: str, version: int, timeout: float) -> Optional[JobRecord]:
+        # Parks the caller on the job's event until its version moves past
+        # `version`, it finishes, or the timeout expires.
+        job = self._jobs.get(job_id)
+        if job is None or job.version != version or job.finished or timeout <= 0:
+            return job
+        try:
+            await asyncio.wait_for(job.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    def _touch(self, job: JobRecord) -> None:
+        job.version += 1
+        # Waiters hold the old event; swapping in a fresh one re-arms the next wait.
+        changed, job.changed = job.changed, asyncio.Event()
+        changed.set()
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import json
+import re
+from html import unescape
+from html.parser import HTMLParser
+from typing import Any, Dict, Iterator, List, Optional
+from urllib.parse import urljoin
+
+PRODUCT_FIELDS = ("title", "price", "currency", "image", "sku", "availability")
+
+_JSON_LD_RE = re.compile(
+    r"<script\b[^>]*\btype\s*=\s*[\"']?application/ld\+json[\"']?[^>]*>(.*?)</script\s*>",
+    re.IGNORECASE | re.DOTALL,
+)
+
+_MICRODATA_PROPS = {
+    "name": "title",
+    "price": "price",
+    "lowPrice": "price",
+    "priceCurrency": "currency",
+    "image": "image",
+    "sku": "sku",
+    "availability": "availability",
+}
+
+_PRODUCT_SCOPE_RE = re.compile(r"""<[^<>]*\bitemtype\s*=\s*["']?https?://schema\.org/Product\b""", re.IGNORECASE)
+_OFFER_TYPES = ("Offer", "AggregateOffer", "PriceSpecification", "UnitPriceSpecification")
+
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+def _clean(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    text = " ".join(unescape(str(value)).split())
+    return text or None
+
+
+def _to_price(value: Any) -> Optional[float]:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    text = _clean(value)
+    if not text:
+        return None
+    try:
+        return float(text.replace(",", ""))
+    except ValueError:
+        match = re.search(r"\d+(?:\.\d+)?", text.replace(",", ""))
+        return float(match.group(0)) if match else None
+
+
+def _availability(value: Any) -> Optional[str]:
+    # schema.org enumerations arrive as URLs ("https://schema.org/InStock").
+    text = _clean(value)
+    if not text:
+        return None
+    return text.rstrip("/").rsplit("/", 1)[-1]
+
+
+def _first(value: Any) -> Any:
+    if isinstance(value, list):
+        return value[0] if value else None
+    return value
+
+
+def _is_product(node: Dict[str, Any]) -> bool:
+    kind = node.get("@type")
+    kinds = kind if isinstance(kind, list) else [kind]
+    return any(isinstance(k, str) and k.rsplit("/", 1)[-1] == "Product" for k in kinds)
+
+
+def _walk(node: Any) -> Iterator[Dict[str, Any]]:
+    if isinstance(node, list):
+        for child in node:
+            yield from _walk(child)
+    elif isinstance(node, dict):
+        if _is_product(node):
+            yield node
+        for key in ("@graph", "mainEntity", "itemListElement", "item"):
+            if key in node:
+                yield from _walk(node[key])
+
+
+def _from_json_ld(product: Dict[str, Any], base_url: str) -> Dict[str, Any]:
+    values: Dict[str, Any] = {"title": _clean(product.get("name")), "sku": _clean(product.get("sku"))}
+
+    image = _first(product.get("image"))
+    if isinstance(image, dict):
+        image = image.get("url") or image.get("contentUrl")
+    image = _clean(image)
+    values["image"] = urljoin(base_url, image) if image else None
+
+    offer = _first(product.get("offers"))
+    if isinstance(offer, dict):
+        price = offer.get("price", offer.get("lowPrice"))
+        spec = _first(offer.get("priceSpecification"))
+        if price is None and isinstance(spec, dict):
+            price = spec.get("price")
+        values["price"] = _to_price(price)
+        values["currency"] = _clean(offer.get("priceCurrency")) or (
+            _clean(spec.get("priceCurrency")) if isinstance(spec, dict) else None
+        )
+        values["availability"] = _availability(offer.get("availability"))
+    return values
+
+
+class _ScopeClosed(Exception):
+    pass
+
+
+class _MicrodataScanner(HTMLParser):
+    # Streams tags once and records the first value for each itemprop found
+    # inside a schema.org Product scope (and its offers); no tree is built.
+    def __init__(self, base_url: str) -> None:
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.values: Dict[str, Any] = {}
+        self._depth = 0
+        self._product_depth: Optional[int] = None
+        self._skip_depth: Optional[int] = None
+        self._text_field: Optional[str] = None
+        self._text_depth = 0
+        self._text: List[str] = []
+
+    def handle_starttag(self, tag: str, attrs: List[tuple]) -> None:
+        attr = {k: (v or "") for k, v in attrs}
+        void = tag in _VOID_TAGS
+        if not void:
+            self._depth += 1
+
+        itemtype = attr.get("itemtype", "").rstrip("/")
+        if self._product_depth is None:
+            if "itemscope" in attr and itemtype.endswith("schema.org/Product"):
+                self._product_depth = self._depth
+            return
+        if self._skip_depth is not None:
+            return
+        if "itemscope" in attr and not itemtype.endswith(_OFFER_TYPES):
+            # Nested brand/review/etc. scopes have their own "name" and "image".
+            if not void:
+                self._skip_depth = self._depth
+            return
+
+        field = _MICRODATA_PROPS.get(attr.get("itemprop", ""))
+        if field is None or self.values.get(field) is not None or self._text_field is not None:
+            return
+        raw = attr.get("content") or attr.get("href") or attr.get("src")
+        if raw or void:
+            self._store(field, raw)
+        else:
+            self._text_field, self._text_depth, self._text = field, self._depth, []
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in _VOID_TAGS:
+            return
+        if self._text_field is not None and self._depth == self._text_depth:
+            self._store(self._text_field, "".join(self._text))
+            self._text_field = None
+        if self._skip_depth is not None and self._depth == self._skip_depth:
+            self._skip_depth = None
+        if self._product_depth is not None and self._depth == self._product_depth:
+            raise _ScopeClosed()
+        self._depth -= 1
+
+    def handle_data(self, data: str) -> None:
+        if self._text_field is not None:
+            self._text.append(data)
+
+    def _store(self, field: str, raw: Optional[str]) -> None:
+        if field == "price":
+            self.values[field] = _to_price(raw)
+        elif field == "availability":
+            self.values[field] = _availability(raw)
+        elif field == "image":
+            text = _clean(raw)
+            self.values[field] = urljoin(self.base_url, text) if text else None
+        else:
+            self.values[field] = _clean(raw)
+
+
+def extract_structured(html: str, base_url: str) -> Dict[str, Any]:
+    values: Dict[str, Any] = {}
+
+    if "ld+json" in html:
+        for match in _JSON_LD_RE.finditer(html):
+            try:
+                data = json.loads(match.group(1))
+            except ValueError:
+                continue
+            product = next(_walk(data), None)
+            if product is not None:
+                # Only the first Product is used so fields never mix across items.
+                values = {k: v for k, v in _from_json_ld(product, base_url).items() if v is not None}
+                break
+        if all(values.get(f) is not None for f in PRODUCT_FIELDS):
+            return values
+
+    scope = _PRODUCT_SCOPE_RE.search(html) if "itemprop" in html else None
+    if scope is not None and any(values.get(f) is None for f in PRODUCT_FIELDS):
+        scanner = _MicrodataScanner(base_url)
+        try:
+            scanner.feed(html[scope.start() :])
+            scanner.close()
+        except _ScopeClosed:
+            pass
+        for field, value in scanner.values.items():
+            if values.get(field) is None and value is not None:
+                values[field] = value
+
+    return values
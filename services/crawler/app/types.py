@@ -1,8 +1,9 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Literal, Optional
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Literal, Optional, Union
 
-from pydantic import BaseModel, Field, HttpUrl
+from pydantic import BaseModel, Field, HttpUrl, model_validator
 
 
 class ProductSelectors(BaseModel):
@@ -14,6 +15,34 @@ class ProductSelectors(BaseModel):
     availability: Optional[str] = None
 
 
+TRACKING_PARAMS = [
+    "utm_*",
+    "gclid",
+    "dclid",
+    "gbraid",
+    "wbraid",
+    "fbclid",
+    "msclkid",
+    "yclid",
+    "mc_cid",
+    "mc_eid",
+    "_ga",
+    "_gl",
+    "igshid",
+    "srsltid",
+    "ref",
+    "ref_src",
+]
+
+
+class UrlRules(BaseModel):
+    drop_params: List[str] = Field(default_factory=lambda: list(TRACKING_PARAMS))
+    keep_params: Optional[List[str]] = None
+    strip_trailing_slash: bool = True
+    lowercase_path: bool = False
+    use_rel_canonical: bool = True
+
+
 class SourceConfig(BaseModel):
     name: str = Field(min_length=1)
     list_pages: List[HttpUrl] = Field(default_factory=list)
@@ -21,14 +50,32 @@ class SourceConfig(BaseModel):
     item_link_selector: str = "a"
     item_link_attribute: str = "href"
     product: ProductSelectors
+    extraction: Literal["auto", "selectors"] = "auto"
+    # True parses the whole DOM for headings, paragraphs and links on every
+    # page. "auto" does that only when the DOM is parsed for selectors anyway;
+    # pages fully covered by JSON-LD/microdata get title and description from
+    # a <head> scan instead, with empty headings, paragraphs and links.
+    page_info: Union[bool, Literal["auto"]] = "auto"
+    urls: UrlRules = Field(default_factory=UrlRules)
 
 
 class CrawlRequest(BaseModel):
     sources: List[SourceConfig]
     concurrency: int = 4
+    concurrency_mode: Literal["fixed", "adaptive"] = "fixed"
+    min_concurrency: int = Field(default=1, ge=1)
+    max_concurrency: int = Field(default=32, ge=1)
     request_timeout_ms: int = 20000
+    max_response_bytes: int = 5 * 1024 * 1024
+    content_types: List[str] = Field(default_factory=lambda: ["text/html", "application/xhtml+xml"])
     callback_url: Optional[HttpUrl] = None
 
+    @model_validator(mode="after")
+    def _check_concurrency_bounds(self) -> CrawlRequest:
+        if self.min_concurrency > self.max_concurrency:
+            raise ValueError("min_concurrency must not exceed max_concurrency")
+        return self
+
 
 class ScrapedProduct(BaseModel):
     source: str
@@ -45,6 +92,24 @@ class ScrapedProduct(BaseModel):
     page_markdown: Optional[str] = None
 
 
+@dataclass(slots=True)
+class ProductRecord:
+    # Internal result row: same fields as ScrapedProduct, without per-instance
+    # validation or __dict__. ScrapedProduct only documents the API schema.
+    source: str
+    url: str
+    title: Optional[str] = None
+    price: Optional[float] = None
+    currency: Optional[str] = None
+    image_url: Optional[str] = None
+    sku: Optional[str] = None
+    availability: Optional[str] = None
+    scraped_at: str = ""
+    raw_html: Optional[str] = None
+    page_info: Dict[str, Any] = field(default_factory=dict)
+    page_markdown: Optional[str] = None
+
+
 JobStatus = Literal["queued", "running", "completed", "failed"]
 
 
@@ -53,6 +118,8 @@ class JobView(BaseModel):
     status: JobStatus
     count: int = 0
     error: Optional[str] = None
+    version: int = 0
+    progress: Dict[str, Any] = Field(default_factory=dict)
 
 
 class JobItemsView(BaseModel):
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import asyncio
+import re
+from fnmatch import fnmatchcase
+from typing import Any, Dict, Optional, Set
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+from .types import UrlRules
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+_HEAD_END_RE = re.compile(r"</head\s*>", re.IGNORECASE)
+_LINK_TAG_RE = re.compile(r"<link\b[^>]*>", re.IGNORECASE)
+_ATTR_RE = re.compile(r"""([\w:-]+)\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+)""")
+
+
+def canonicalize_url(url: str, rules: UrlRules) -> str:
+    # The result is a dedup key only; requests always go to the URL as found.
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        host = f"[{host}]"
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port is None or _DEFAULT_PORTS.get(scheme) == port else f"{host}:{port}"
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f"{parts.username}:{parts.password}"
+        netloc = f"{userinfo}@{netloc}"
+
+    path = re.sub(r"/{2,}", "/", parts.path) or "/"
+    if rules.lowercase_path:
+        path = path.lower()
+    if rules.strip_trailing_slash and len(path) > 1:
+        path = path.rstrip("/") or "/"
+
+    params = []
+    for key, value in parse_qsl(parts.query, keep_blank_values=True):
+        if rules.keep_params is not None:
+            if not any(fnmatchcase(key.lower(), p) for p in rules.keep_params):
+                continue
+        elif any(fnmatchcase(key.lower(), p) for p in rules.drop_params):
+            continue
+        params.append((key, value))
+    params.sort()
+
+    return urlunsplit((scheme, netloc, path, urlencode(params), ""))
+
+
+def find_rel_canonical(html: str, base_url: str) -> Optional[str]:
+    # A regex over the <head> is enough here and avoids building a DOM just
+    # for one tag.
+    end = _HEAD_END_RE.search(html)
+    head = html[: end.start()] if end else html[:65536]
+    for tag in _LINK_TAG_RE.findall(head):
+        attrs = {k.lower(): v.strip("\"'") for k, v in _ATTR_RE.findall(tag)}
+        if "canonical" in attrs.get("rel", "").lower().split() and attrs.get("href"):
+            return urljoin(base_url, attrs["href"].strip())
+    return None
+
+
+class Frontier:
+    # Job-wide record of canonical product URLs; each one is handed out once,
+    # whichever source or alias reached it first. The fetch holding a key
+    # reports through resolve() whether it covered the product, so an alias
+    # deferring to it can still return its own page if that fetch fails.
+    def __init__(self) -> None:
+        self._claimed: Set[str] = set()
+        self._covered: Dict[str, bool] = {}
+        self._resolved: Dict[str, asyncio.Event] = {}
+        self._waiting: Dict[str, str] = {}
+        self.discovered = 0
+        self.duplicates = 0
+        self.alias_fallbacks = 0
+
+    def claim(self, url: str) -> bool:
+        self.discovered += 1
+        if url in self._claimed:
+            self.duplicates += 1
+            return False
+        self._claimed.add(url)
+        return True
+
+    def claim_alias(self, fetched_url: str, canonical_url: str) -> bool:
+        # Called after a fetch when the page names a different canonical URL;
+        # False means another fetch already covers that product.
+        if canonical_url == fetched_url or canonical_url not in self._claimed:
+            self._claimed.add(canonical_url)
+            return True
+        return False
+
+    def resolve(self, url: str, covered: bool) -> None:
+        if url in self._covered:
+            return
+        self._covered[url] = covered
+        event = self._resolved.pop(url, None)
+        if event is not None:
+            event.set()
+
+    async def covered(self, fetched_url: str, canonical_url: str) -> bool:
+        # Waits for the fetch holding `canonical_url`. Aliases that name each
+        # other would wait forever, so the one closing the loop keeps its page.
+        node = canonical_url
+        while node in self._waiting:
+            node = self._waiting[node]
+            if node == fetched_url:
+                return False
+        if canonical_url not in self._covered:
+            self._waiting[fetched_url] = canonical_url
+            try:
+                await self._resolved.setdefault(canonical_url, asyncio.Event()).wait()
+            finally:
+                del self._waiting[fetched_url]
+        if not self._covered[canonical_url]:
+            self.alias_fallbacks += 1
+            return False
+        return True
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "discovered": self.discovered,
+            "unique": len(self._claimed),
+            "duplicates": self.duplicates,
+            "alias_fallbacks": self.alias_fallbacks,
+        }
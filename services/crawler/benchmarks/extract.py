@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from typing import Dict, List
+
+from app.crawler import _extract_product
+from app.types import ProductSelectors, SourceConfig
+
+SELECTORS = ProductSelectors(
+    title="h1.product-title",
+    price=".product-price .amount",
+    currency=".product-price .currency",
+    image=".gallery img.main",
+    sku=".meta .sku",
+    availability=".stock-status",
+)
+
+
+def _chrome(body: str, head: str = "") -> str:
+    nav = "".join(f'<li class="nav-item"><a href="/c/{i}">Category {i}</a></li>' for i in range(120))
+    related = "".join(
+        f'<div class="card"><a href="/p/{i}"><img src="/img/{i}.jpg" alt="Item {i}"></a>'
+        f'<p class="name">Related item {i}</p><span class="price">{i}.99</span></div>'
+        for i in range(48)
+    )
+    copy = "".join(f"<p>Paragraph {i} of the long product description with <em>markup</em>.</p>" for i in range(40))
+    footer = "".join(f'<a href="/help/{i}">Help {i}</a>' for i in range(80))
+    return (
+        f"<!doctype html><html><head><title>Blue Kettle | Shop</title>"
+        f'<meta name="description" content="A kettle.">{head}</head><body>'
+        f'<header><ul class="nav">{nav}</ul></header><main>{body}<section class="copy">{copy}</section>'
+        f'<section class="related">{related}</section></main><footer>{footer}</footer></body></html>'
+    )
+
+
+_VISIBLE = (
+    '<h1 class="product-title">Blue Kettle</h1>'
+    '<div class="gallery"><img class="main" src="/img/kettle.jpg"></div>'
+    '<div class="product-price"><span class="amount">49.90</span><span class="currency">EUR</span></div>'
+    '<div class="meta"><span class="sku">KT-100</span></div><div class="stock-status">InStock</div>'
+)
+
+
+def fixture_pages() -> Dict[str, str]:
+    json_ld = {
+        "@context": "https://schema.org",
+        "@type": "Product",
+        "name": "Blue Kettle",
+        "sku": "KT-100",
+        "image": "/img/kettle.jpg",
+        "offers": {
+            "@type": "Offer",
+            "price": "49.90",
+            "priceCurrency": "EUR",
+            "availability": "https://schema.org/InStock",
+        },
+    }
+    microdata = (
+        '<div itemscope itemtype="https://schema.org/Product">'
+        '<h1 class="product-title" itemprop="name">Blue Kettle</h1>'
+        '<img itemprop="image" src="/img/kettle.jpg"><meta itemprop="sku" content="KT-100">'
+        '<div itemprop="offers" itemscope itemtype="https://schema.org/Offer">'
+        '<span itemprop="price" content="49.90">49.90</span><meta itemprop="priceCurrency" content="EUR">'
+        '<link itemprop="availability" href="https://schema.org/InStock"></div></div>'
+    )
+    return {
+        "json_ld": _chrome(_VISIBLE, head=f'<script type="application/ld+json">{json.dumps(json_ld)}</script>'),
+        "microdata": _chrome(microdata),
+        "selectors_only": _chrome(_VISIBLE),
+    }
+
+
+def run(rounds: int) -> List[Dict[str, object]]:
+    pages = fixture_pages()
+    modes = {
+        "selectors": {"extraction": "selectors", "page_info": True},
+        "auto": {"extraction": "auto", "page_info": "auto"},
+        "auto_full_page_info": {"extraction": "auto", "page_info": True},
+        "auto_no_page_info": {"extraction": "auto", "page_info": False},
+    }
+    rows: List[Dict[str, object]] = []
+    for page_name, html in pages.items():
+        for mode_name, options in modes.items():
+            source = SourceConfig(name="bench", product=SELECTORS, **options)
+            item = _extract_product(html, "https://shop.test/p/kettle", source)
+            started = time.perf_counter()
+            for _ in range(rounds):
+                _extract_product(html, "https://shop.test/p/kettle", source)
+            elapsed = time.perf_counter() - started
+            rows.append(
+                {
+                    "page": page_name,
+                    "mode": mode_name,
+                    "bytes": len(html),
+                    "ms_per_page": elapsed * 1000.0 / rounds,
+                    "pages_per_sec": rounds / elapsed,
+                    "title": item.title,
+                    "price": item.price,
+                }
+            )
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    for row in run(args.rounds):
+        print(
+            f"{row['page']:<15} {row['mode']:<20} {row['bytes']:>7}B "
+            f"{row['ms_per_page']:>8.2f} ms/page {row['pages_per_sec']:>8.1f} pages/s  {row['title']} {row['price']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
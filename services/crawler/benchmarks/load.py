@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import resource
+import socket
+import sys
+import time
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+import uvicorn
+
+from .extract import fixture_pages
+
+# Load test for the crawler API. A fake shop is served from this process;
+# the API under test is either started in-process on the same event loop
+# (so loop lag and JobStore memory can be measured directly) or reached at
+# --base_url. httpx.ASGITransport is not used for the API because it only
+# returns after background tasks finish, which hides the job lifecycle.
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"count": 0, "p50": None, "p90": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 2)
+
+    return {"count": len(ordered), "p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": round(ordered[-1], 2)}
+
+
+def fake_shop(latency_ms: float) -> Callable[..., Awaitable[None]]:
+    product_page = fixture_pages()["json_ld"].encode("utf-8")
+
+    async def app(scope: Dict[str, Any], receive: Callable[..., Any], send: Callable[..., Any]) -> None:
+        if scope["type"] != "http":
+            return
+        if latency_ms:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * latency_ms / 1000.0)
+        path = scope["path"]
+        if path.startswith("/list/"):
+            _, _, job, count = path.split("/")
+            body = "".join(f'<a href="/p/{job}/{i}">item {i}</a>' for i in range(int(count))).encode("utf-8")
+        else:
+            body = product_page
+        headers = [(b"content-type", b"text/html; charset=utf-8"), (b"content-length", str(len(body)).encode())]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    return app
+
+
+async def _serve(app: Any, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off"))
+    asyncio.get_running_loop().create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server
+
+
+async def _loop_lag(samples: List[float], stop: asyncio.Event, interval: float = 0.01) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append((time.perf_counter() - started - interval) * 1000.0)
+
+
+class LoadTest:
+    def __init__(self, client: httpx.AsyncClient, shop_url: str, args: argparse.Namespace) -> None:
+        self.client = client
+        self.shop_url = shop_url
+        self.args = args
+        self.latency: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.job_seconds: List[float] = []
+
+    async def _call(self, name: str, method: str, url: str, **kwargs: Any) -> Optional[httpx.Response]:
+        started = time.perf_counter()
+        try:
+            resp = await self.client.request(method, url, **kwargs)
+            resp.raise_for_status()
+        except httpx.HTTPError:
+            self.errors[name] = self.errors.get(name, 0) + 1
+            return None
+        finally:
+            self.latency.setdefault(name, []).append((time.perf_counter() - started) * 1000.0)
+        return resp
+
+    async def run_job(self, index: int) -> None:
+        args = self.args
+        body = {
+            "concurrency": args.crawl_concurrency,
+            "sources": [
+                {
+                    "name": f"shop-{index}",
+                    "list_pages": [f"{self.shop_url}/list/{index}/{args.products}"],
+                    "product": {"title": "h1.product-title", "price": ".product-price .amount"},
+                    "page_info": args.page_info,
+                }
+            ],
+        }
+        started = time.perf_counter()
+        resp = await self._call("create_job", "POST", "/crawler/jobs", json=body)
+        if resp is None:
+            return
+        job_id = resp.json()["id"]
+
+        status = "queued"
+        while status not in ("completed", "failed"):
+            await asyncio.sleep(1.0 / args.poll_hz)
+            resp = await self._call("get_job", "GET", f"/crawler/jobs/{job_id}")
+            if resp is not None:
+                status = resp.json()["status"]
+        self.job_seconds.append(time.perf_counter() - started)
+
+        for _ in range(args.item_reads):
+            for offset in range(0, args.products, args.page_size):
+                params = {"offset": offset, "limit": args.page_size}
+                await self._call("get_items", "GET", f"/crawler/jobs/{job_id}/items", params=params)
+
+    async def run(self) -> None:
+        # Jobs arrive at a fixed rate regardless of how fast earlier ones finish.
+        tasks = []
+        for index in range(self.args.jobs):
+            tasks.append(asyncio.create_task(self.run_job(index)))
+            await asyncio.sleep(1.0 / self.args.rate)
+        await asyncio.gather(*tasks)
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    shop_port = _free_port()
+    shop = await _serve(fake_shop(args.shop_latency_ms), shop_port)
+
+    api_server: Optional[uvicorn.Server] = None
+    store = None
+    if args.base_url:
+        base_url = args.base_url
+    else:
+        from app.main import app, store
+
+        tracemalloc.start()
+        api_port = _free_port()
+        api_server = await _serve(app, api_port)
+        base_url = f"http://127.0.0.1:{api_port}"
+
+    lag: List[float] = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(_loop_lag(lag, stop))
+    memory_before = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+    started = time.perf_counter()
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0, limits=limits) as client:
+        test = LoadTest(client, f"http://127.0.0.1:{shop_port}", args)
+        await test.run()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await lag_task
+
+    report: Dict[str, Any] = {
+        "mode": "external" if args.base_url else "in-process",
+        "jobs": args.jobs,
+        "products_per_job": args.products,
+        "seconds": round(elapsed, 2),
+        "jobs_per_sec": round(args.jobs / elapsed, 2),
+        "job_seconds": _percentiles(test.job_seconds),
+        "latency_ms": {name: _percentiles(values) for name, values in test.latency.items()},
+        "errors": test.errors,
+        "loop_lag_ms": _percentiles(lag),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+    }
+    if store is not None:
+        grown = tracemalloc.get_traced_memory()[0] - memory_before
+        report["job_store"] = {
+            "jobs": len(store._jobs),
+            "items": sum(len(job.items) for job in store._jobs.values()),
+            "traced_growth_mb": round(grown / 1e6, 2),
+            "bytes_per_job": round(grown / max(1, len(store._jobs))),
+        }
+        tracemalloc.stop()
+
+    if api_server is not None:
+        api_server.should_exit = True
+    shop.should_exit = True
+    await asyncio.sleep(0.2)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base_url", default=None, help="crawler API to test; default starts one in-process")
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--rate", type=float, default=10.0, help="job submissions per second")
+    parser.add_argument("--products", type=int, default=40)
+    parser.add_argument("--crawl_concurrency", type=int, default=8)
+    parser.add_argument("--page_info", action="store_true")
+    parser.add_argument("--poll_hz", type=float, default=4.0)
+    parser.add_argument("--item_reads", type=int, default=1)
+    parser.add_argument("--page_size", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--shop_latency_ms", type=float, default=20.0)
+    parser.add_argument("--max_p99_ms", type=float, default=None, help="fail if any endpoint p99 exceeds this")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    failed = bool(report["errors"])
+    if args.max_p99_ms is not None:
+        failed |= any((s["p99"] or 0) > args.max_p99_ms for s in report["latency_ms"].values())
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
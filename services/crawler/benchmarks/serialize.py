@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import argparse
+import json
+import time
+import tracemalloc
+from dataclasses import asdict
+from typing import Any, Callable, Dict, List
+
+from app.crawler import _extract_product
+from app.serialization import dumps
+from app.types import JobItemsView, ProductRecord, ScrapedProduct, SourceConfig
+
+from .extract import SELECTORS, fixture_pages
+
+
+def _records(n: int) -> List[ProductRecord]:
+    html = fixture_pages()["json_ld"]
+    source = SourceConfig(name="bench", product=SELECTORS)
+    template = _extract_product(html, "https://shop.test/p/0", source)
+    records = []
+    for i in range(n):
+        record = ProductRecord(**asdict(template))
+        record.url = f"https://shop.test/p/{i}"
+        record.sku = f"KT-{i}"
+        records.append(record)
+    return records
+
+
+def _measure(fn: Callable[[], Any], rounds: int) -> Dict[str, float]:
+    fn()
+    tracemalloc.start()
+    out = fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    started = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    elapsed = (time.perf_counter() - started) / rounds
+    return {"ms": elapsed * 1000.0, "peak_mb": peak / 1e6, "bytes": float(len(out))}
+
+
+def _object_bytes(build: Callable[[], List[Any]], n: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return (after - before) / n
+
+
+def run(n: int, rounds: int) -> List[Dict[str, Any]]:
+    records = _records(n)
+    values = [asdict(r) for r in records]
+    products = [ScrapedProduct(**v) for v in values]
+
+    def pydantic_dict() -> bytes:
+        view = JobItemsView(id="job", status="completed", items=products, meta={"count": n})
+        return json.dumps(view.model_dump()).encode("utf-8")
+
+    def pydantic_json() -> bytes:
+        view = JobItemsView(id="job", status="completed", items=products, meta={"count": n})
+        return view.model_dump_json().encode("utf-8")
+
+    def orjson_records() -> bytes:
+        return dumps({"id": "job", "status": "completed", "items": records, "meta": {"count": n}})
+
+    assert json.loads(pydantic_json()) == json.loads(orjson_records())
+
+    rows = []
+    for name, fn in (
+        ("pydantic model_dump + json", pydantic_dict),
+        ("pydantic model_dump_json", pydantic_json),
+        ("orjson ProductRecord", orjson_records),
+    ):
+        stats = _measure(fn, rounds)
+        rows.append(
+            {
+                "serializer": name,
+                "items": n,
+                "ms": stats["ms"],
+                "items_per_sec": n / (stats["ms"] / 1000.0),
+                "peak_mb": stats["peak_mb"],
+                "mb_out": stats["bytes"] / 1e6,
+            }
+        )
+
+    # Container overhead only: field values are shared between both builds.
+    for name, model in (("ScrapedProduct object", ScrapedProduct), ("ProductRecord object", ProductRecord)):
+        rows.append({"serializer": name, "bytes_per_item": _object_bytes(lambda: [model(**v) for v in values], n)})
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    for row in run(args.items, args.rounds):
+        if "bytes_per_item" in row:
+            print(f"{row['serializer']:<28} {row['bytes_per_item']:>10.0f} B/item")
+        else:
+            print(
+                f"{row['serializer']:<28} {row['ms']:>9.1f} ms {row['items_per_sec']:>10.0f} items/s "
+                f"peak {row['peak_mb']:>7.1f} MB  out {row['mb_out']:.1f} MB"
+            )
+
+
+if __name__ == "__main__":
+    main()
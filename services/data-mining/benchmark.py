@@ -0,0 +1,249 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Any, Optional
+
+SCALES: dict[str, dict[str, int]] = {
+    "10k": {"users": 2_000, "products": 500, "orders": 10_000, "chunk_rows": 0},
+    "100k": {"users": 20_000, "products": 5_000, "orders": 100_000, "chunk_rows": 0},
+    "1m": {"users": 100_000, "products": 20_000, "orders": 1_000_000, "chunk_rows": 500_000},
+    "10m": {"users": 1_000_000, "products": 100_000, "orders": 10_000_000, "chunk_rows": 1_000_000},
+}
+
+STAGES = (
+    "generate_synthetic",
+    "prepare_propensity_dataset",
+    "train_propensity_ml",
+    "train_propensity_dl",
+    "train_recommender_dl",
+)
+
+
+def _paths(work_dir: str) -> dict[str, str]:
+    raw = os.path.join(work_dir, "raw")
+    return {
+        "users_csv": os.path.join(raw, "users.csv"),
+        "products_csv": os.path.join(raw, "products.csv"),
+        "orders_csv": os.path.join(raw, "orders.csv"),
+        "order_items_csv": os.path.join(raw, "order_items.csv"),
+        "dataset_csv": os.path.join(work_dir, "processed", "propensity_dataset.csv"),
+        "artifacts": os.path.join(work_dir, "artifacts"),
+    }
+
+
+def _count_rows(path: str) -> int:
+    with open(path, "rb") as f:
+        return max(0, sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b"")) - 1)
+
+
+def _run_stage(stage: str, spec: dict[str, int], work_dir: str, seed: int, threads: int) -> dict[str, Any]:
+    # Runs in a freshly spawned process so ru_maxrss is this stage's peak alone;
+    # torch is only imported here when a thread cap is requested.
+    if threads > 0:
+        import torch
+        from threadpoolctl import threadpool_limits
+
+        torch.set_num_threads(threads)
+        threadpool_limits(limits=threads)
+    p = _paths(work_dir)
+    raw = {k: p[k] for k in ("users_csv", "products_csv", "orders_csv", "order_items_csv")}
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+
+    if stage == "generate_synthetic":
+        from generate_synthetic import Paths, generate
+
+        os.makedirs(os.path.dirname(p["orders_csv"]), exist_ok=True)
+        sizes = {k: spec[k] for k in ("users", "products", "orders")}
+        generate(out=Paths(**raw), seed=seed, days=180, **sizes)
+    elif stage == "prepare_propensity_dataset":
+        from prepare_propensity_dataset import build_dataset, build_dataset_chunked
+
+        os.makedirs(os.path.dirname(p["dataset_csv"]), exist_ok=True)
+        common = {**raw, "out_csv": p["dataset_csv"], "label_window_days": 30, "min_history_orders": 2}
+        if spec["chunk_rows"] > 0:
+            build_dataset_chunked(chunk_rows=spec["chunk_rows"], **common)
+        else:
+            build_dataset(**common)
+    elif stage == "train_propensity_ml":
+        from train_propensity_ml import train
+
+        train(dataset_csv=p["dataset_csv"], out_dir=os.path.join(p["artifacts"], "ml"), test_ratio=0.2, seed=seed)
+    elif stage == "train_propensity_dl":
+        from train_propensity_dl import train
+
+        train(
+            dataset_csv=p["dataset_csv"],
+            out_dir=os.path.join(p["artifacts"], "dl"),
+            test_ratio=0.2,
+            seed=seed,
+            epochs=1,
+            batch_size=1024,
+            lr=0.001,
+            hidden=64,
+            dropout=0.1,
+        )
+    elif stage == "train_recommender_dl":
+        from train_recommender_dl import train
+
+        train(
+            orders_csv=raw["orders_csv"],
+            order_items_csv=raw["order_items_csv"],
+            out_dir=os.path.join(p["artifacts"], "rec"),
+            dim=32,
+            epochs=1,
+            batch_size=8192,
+            lr=0.003,
+            seed=seed,
+            neg_per_pos=3,
+        )
+    else:
+        raise ValueError(f"Unknown stage: {stage}")
+
+    seconds = time.perf_counter() - started
+    return {
+        "seconds": seconds,
+        "cpu_seconds": time.process_time() - cpu_started,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        "orders_per_sec": spec["orders"] / seconds if seconds > 0 else None,
+    }
+
+
+def run_scale(scale: str, work_dir: str, seed: int, threads: int) -> dict[str, dict[str, Any]]:
+    spec = SCALES[scale]
+    if os.path.isdir(work_dir):
+        shutil.rmtree(work_dir)
+    results: dict[str, dict[str, Any]] = {}
+    for stage in STAGES:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            results[stage] = pool.submit(_run_stage, stage, spec, work_dir, seed, threads).result()
+        if stage == "prepare_propensity_dataset":
+            results[stage]["dataset_rows"] = _count_rows(_paths(work_dir)["dataset_csv"])
+        print(f"{scale:>5} {stage:<28} {results[stage]['seconds']:9.2f}s  {results[stage]['peak_rss_mb']:8.0f} MB")
+    return results
+
+
+def compare(
+    results: dict[str, Any], baseline: dict[str, Any], tolerance: float, rss_tolerance: float
+) -> list[dict[str, Any]]:
+    # Only (scale, stage) pairs present in both runs are compared.
+    regressions = []
+    for scale, stages in results["scales"].items():
+        for stage, current in stages.items():
+            base = baseline.get("scales", {}).get(scale, {}).get(stage)
+            if not base:
+                continue
+            for key, tol in (("seconds", tolerance), ("peak_rss_mb", rss_tolerance)):
+                if base.get(key) and current[key] > base[key] * (1.0 + tol):
+                    regressions.append(
+                        {
+                            "scale": scale,
+                            "stage": stage,
+                            "metric": key,
+                            "baseline": base[key],
+                            "current": current[key],
+                            "ratio": current[key] / base[key],
+                        }
+                    )
+    return regressions
+
+
+def _machine() -> dict[str, Any]:
+    import numpy as np
+    import torch
+
+    return {
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "torch": torch.__version__,
+    }
+
+
+def run(
+    scales: list[str],
+    work_dir: str,
+    out_json: str,
+    baseline_json: Optional[str] = None,
+    update_baseline: bool = False,
+    tolerance: float = 0.2,
+    rss_tolerance: float = 0.25,
+    seed: int = 7,
+    threads: int = 0,
+    keep: bool = False,
+) -> dict[str, Any]:
+    unknown = [s for s in scales if s not in SCALES]
+    if unknown:
+        raise ValueError(f"Unknown scales: {unknown}; choose from {sorted(SCALES)}")
+
+    results: dict[str, Any] = {"created_at": time.time(), "scales": {}}
+    for scale in scales:
+        scale_dir = os.path.join(work_dir, scale)
+        results["scales"][scale] = run_scale(scale, scale_dir, seed, threads)
+        if not keep:
+            shutil.rmtree(scale_dir, ignore_errors=True)
+    # Imports torch, so it runs last: children inherit the parent's RSS high-water mark.
+    results["machine"] = _machine()
+
+    if baseline_json and os.path.exists(baseline_json) and not update_baseline:
+        with open(baseline_json, encoding="utf-8") as f:
+            baseline = json.load(f)
+        results["baseline"] = {
+            "path": baseline_json,
+            "tolerance": tolerance,
+            "rss_tolerance": rss_tolerance,
+            "regressions": compare(results, baseline, tolerance, rss_tolerance),
+        }
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_json)), exist_ok=True)
+    with open(out_json, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    if baseline_json and update_baseline:
+        with open(baseline_json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scales", nargs="+", default=["10k"], choices=sorted(SCALES))
+    parser.add_argument("--work_dir", default="services/data-mining/data/bench")
+    parser.add_argument("--out_json", default="services/data-mining/artifacts/benchmarks/benchmark.json")
+    parser.add_argument("--baseline", default="services/data-mining/benchmark_baseline.json")
+    parser.add_argument("--update_baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--rss_tolerance", type=float, default=0.25)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--keep", action="store_true")
+    args = parser.parse_args()
+
+    results = run(
+        scales=args.scales,
+        work_dir=args.work_dir,
+        out_json=args.out_json,
+        baseline_json=args.baseline,
+        update_baseline=args.update_baseline,
+        tolerance=args.tolerance,
+        rss_tolerance=args.rss_tolerance,
+        seed=args.seed,
+        threads=args.threads,
+        keep=args.keep,
+    )
+    regressions = results.get("baseline", {}).get("regressions", [])
+    for r in regressions:
+        change = f"{r['baseline']:.2f} -> {r['current']:.2f} ({r['ratio']:.2f}x)"
+        print(f"REGRESSION {r['scale']} {r['stage']} {r['metric']}: {change}")
+    if regressions:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import time
+from collections.abc import Sequence
+from typing import Optional
+
+import numpy as np
+import torch
+
+from interactions import Interactions, csr_from_pairs, load_interactions
+from mf_artifact import IdIndex, load_mf
+from ranking import block_topk
+
+
+def ranking_metrics(
+    user_emb: np.ndarray,
+    item_emb: np.ndarray,
+    seen_indptr: np.ndarray,
+    seen_indices: np.ndarray,
+    test_indptr: np.ndarray,
+    test_indices: np.ndarray,
+    ks: Sequence[int],
+    user_block: int = 0,
+    item_block: int = 65536,
+) -> dict[str, float]:
+    n_items = item_emb.shape[0]
+    ks = sorted({max(1, min(int(k), n_items)) for k in ks})
+    max_k = ks[-1]
+    # Bound each score block to ~64M floats regardless of catalog size.
+    user_block = user_block or max(1, (1 << 26) // max(1, min(n_items, item_block)))
+
+    test_counts = np.diff(test_indptr)
+    eval_users = np.flatnonzero(test_counts > 0)
+    test_keys = np.repeat(np.arange(len(test_counts), dtype=np.int64), test_counts) * n_items + test_indices
+    discount = 1.0 / np.log2(np.arange(max_k) + 2.0)
+    ideal = np.cumsum(discount)
+    sums = {f"{name}@{k}": 0.0 for k in ks for name in ("recall", "ndcg", "map")}
+
+    items_t = torch.from_numpy(np.array(item_emb, dtype=np.float32))
+    with torch.inference_mode():
+        for lo in range(0, eval_users.size, user_block):
+            users = eval_users[lo : lo + user_block]
+            starts = seen_indptr[users]
+            counts = seen_indptr[users + 1] - starts
+            seen_rows = np.repeat(np.arange(users.size, dtype=np.int64), counts)
+            shift = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+            seen_cols = seen_indices[shift + np.arange(seen_rows.size)]
+            queries = torch.from_numpy(np.ascontiguousarray(user_emb[users], dtype=np.float32))
+            top, _ = block_topk(
+                queries, items_t, torch.from_numpy(seen_rows), torch.from_numpy(seen_cols), max_k, item_block
+            )
+            top = top.numpy()
+
+            query = users[:, None] * n_items + top
+            pos = np.minimum(np.searchsorted(test_keys, query), test_keys.size - 1)
+            rel = (test_keys[pos] == query) & (top >= 0)
+            n_test = test_counts[users]
+            hits = np.cumsum(rel, axis=1)
+            precision = hits / np.arange(1, max_k + 1)
+            for k in ks:
+                cap = np.minimum(n_test, k)
+                sums[f"recall@{k}"] += float((hits[:, k - 1] / n_test).sum())
+                sums[f"ndcg@{k}"] += float(((rel[:, :k] * discount[:k]).sum(axis=1) / ideal[cap - 1]).sum())
+                sums[f"map@{k}"] += float(((precision[:, :k] * rel[:, :k]).sum(axis=1) / cap).sum())
+
+    n_eval = max(1, eval_users.size)
+    metrics = {name: total / n_eval for name, total in sums.items()}
+    metrics["users"] = float(eval_users.size)
+    return metrics
+
+
+def evaluate_split(
+    user_emb: np.ndarray,
+    item_emb: np.ndarray,
+    users: IdIndex,
+    items: IdIndex,
+    train: Interactions,
+    test: Interactions,
+    ks: Sequence[int],
+) -> dict[str, float]:
+    seen_rows, seen_cols, _ = train.remap(users, items)
+    test_rows, test_cols, _ = test.remap(users, items)
+    seen_indptr, seen_indices = csr_from_pairs(seen_rows, seen_cols, len(users))
+    test_indptr, test_indices = csr_from_pairs(test_rows, test_cols, len(users))
+    return ranking_metrics(user_emb, item_emb, seen_indptr, seen_indices, test_indptr, test_indices, ks)
+
+
+def evaluate(
+    artifact_dir: str,
+    orders_csv: str,
+    order_items_csv: str,
+    ks: Sequence[int],
+    holdout_orders: Optional[int] = None,
+    cache_dir: Optional[str] = None,
+) -> dict[str, float]:
+    meta_path = os.path.join(artifact_dir, "recommender_mf.meta.json")
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    previous = meta.get("evaluation") or {}
+    if holdout_orders is None:
+        holdout_orders = int(previous.get("holdout_orders") or 0)
+        # Artifacts from before meta.full_history was recorded saw everything
+        # unless they were trained with a holdout.
+        if meta.get("full_history", holdout_orders <= 0):
+            raise ValueError(
+                f"{artifact_dir} was trained on every order, so its own holdout would score seen orders; "
+                "pass holdout_orders explicitly to score orders added after training"
+            )
+    if holdout_orders <= 0:
+        raise ValueError("holdout_orders must be at least 1")
+    holdout_offset = int(previous.get("holdout_offset") or 0)
+
+    started = time.perf_counter()
+    user_emb, item_emb, users, items = load_mf(artifact_dir)
+    split = {"holdout_orders": holdout_orders, "holdout_offset": holdout_offset, "cache_dir": cache_dir}
+    train = load_interactions(orders_csv, order_items_csv, **split)
+    test = load_interactions(orders_csv, order_items_csv, test=True, **split)
+    metrics = evaluate_split(user_emb, item_emb, users, items, train, test, ks)
+
+    meta["metrics"] = metrics
+    meta["evaluation"] = {
+        "holdout_orders": holdout_orders,
+        "holdout_offset": holdout_offset,
+        "seconds": time.perf_counter() - started,
+    }
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return metrics
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--artifact_dir", default="services/data-mining/artifacts/recommender_mf")
+    parser.add_argument("--orders_csv", default="services/data-mining/data/raw/orders.csv")
+    parser.add_argument("--order_items_csv", default="services/data-mining/data/raw/order_items.csv")
+    parser.add_argument("--k", type=int, nargs="+", default=[10, 20])
+    parser.add_argument("--holdout_orders", type=int, default=None)
+    parser.add_argument("--cache_dir", default="services/data-mining/data/cache/interactions")
+    args = parser.parse_args()
+
+    metrics = evaluate(
+        artifact_dir=args.artifact_dir,
+        orders_csv=args.orders_csv,
+        order_items_csv=args.order_items_csv,
+        ks=args.k,
+        holdout_orders=args.holdout_orders,
+        cache_dir=args.cache_dir,
+    )
+    print(json.dumps(metrics, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import time
+from typing import Optional
+
+import numpy as np
+import torch
+
+from mf_artifact import load_mf, write_id_json
+from ranking import block_topk
+from serve_recommender import load_purchased
+
+
+def export_recommendations(
+    artifact_dir: str,
+    orders_csv: str,
+    order_items_csv: str,
+    out_dir: str,
+    k: int,
+    user_block: int,
+    item_block: int,
+    threads: int = 0,
+    cache_dir: Optional[str] = None,
+) -> dict[str, float]:
+    started = time.perf_counter()
+    user_block = max(1, int(user_block))
+    item_block = max(1, int(item_block))
+    torch.set_num_threads(threads if threads > 0 else (os.cpu_count() or 1))
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Copy-on-write maps keep torch.from_numpy happy without copying the matrices.
+    user_emb, item_emb, users, items = load_mf(artifact_dir, mmap_mode="c")
+    indptr, indices = load_purchased(orders_csv, order_items_csv, users, items, cache_dir=cache_dir)
+    n_users = len(users)
+    k = max(1, min(int(k), len(items)))
+
+    users_t = torch.from_numpy(user_emb)
+    items_t = torch.from_numpy(item_emb)
+    top_items = np.lib.format.open_memmap(
+        os.path.join(out_dir, "recommendations.items.npy"), mode="w+", dtype=np.int32, shape=(n_users, k)
+    )
+    top_scores = np.lib.format.open_memmap(
+        os.path.join(out_dir, "recommendations.scores.npy"), mode="w+", dtype=np.float32, shape=(n_users, k)
+    )
+
+    with torch.inference_mode():
+        for lo in range(0, n_users, user_block):
+            hi = min(lo + user_block, n_users)
+            counts = np.diff(indptr[lo : hi + 1])
+            seen_rows = torch.from_numpy(np.repeat(np.arange(hi - lo, dtype=np.int64), counts))
+            seen_cols = torch.from_numpy(indices[indptr[lo] : indptr[hi]])
+            best_items, best_scores = block_topk(users_t[lo:hi], items_t, seen_rows, seen_cols, k, item_block)
+            top_items[lo:hi] = best_items.numpy()
+            top_scores[lo:hi] = best_scores.numpy()
+
+    top_items.flush()
+    top_scores.flush()
+    users.save(os.path.join(out_dir, "recommendations.user"))
+    items.save(os.path.join(out_dir, "recommendations.item"))
+    write_id_json(os.path.join(out_dir, "recommendations"), users, items)
+
+    elapsed = time.perf_counter() - started
+    meta = {
+        "source": os.path.abspath(artifact_dir),
+        "users": n_users,
+        "items": len(items),
+        "k": k,
+        "user_block": user_block,
+        "item_block": item_block,
+        "threads": torch.get_num_threads(),
+        "seconds": elapsed,
+    }
+    with open(os.path.join(out_dir, "recommendations.meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    return {"users": float(n_users), "seconds": elapsed}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--artifact_dir", default="services/data-mining/artifacts/recommender_mf")
+    parser.add_argument("--orders_csv", default="services/data-mining/data/raw/orders.csv")
+    parser.add_argument("--order_items_csv", default="services/data-mining/data/raw/order_items.csv")
+    parser.add_argument("--out_dir", default="services/data-mining/artifacts/recommendations")
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--user_block", type=int, default=4096)
+    parser.add_argument("--item_block", type=int, default=65536)
+    parser.add_argument("--threads", type=int, default=0)
+    parser.add_argument("--cache_dir", default="services/data-mining/data/cache/interactions")
+    args = parser.parse_args()
+
+    export_recommendations(
+        artifact_dir=args.artifact_dir,
+        orders_csv=args.orders_csv,
+        order_items_csv=args.order_items_csv,
+        out_dir=args.out_dir,
+        k=args.k,
+        user_block=args.user_block,
+        item_block=args.item_block,
+        threads=args.threads,
+        cache_dir=args.cache_dir,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,31 @@
 import argparse
 import csv
 import os
-import random
+import shutil
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+from typing import Optional, TextIO
+
+import numpy as np
+
+
+CATEGORIES = ["electronics", "fashion", "beauty", "grocery", "home", "sports"]
+STATUSES = ["pending", "processing", "shipped", "delivered", "cancelled"]
+STATUS_WEIGHTS = [0.05, 0.1, 0.25, 0.55, 0.05]
+MAX_ITEMS_PER_ORDER = 5
+
+_STREAM_USERS = 0
+_STREAM_PRODUCTS = 1
+_STREAM_USER_WEIGHTS = 2
+_STREAM_ORDERS = 3
+
+_QUANTITY_TEXT = np.array(["0", "1", "2", "3"])
+
+# Rows per generation block. Each block draws from its own seeded stream, so
+# the output depends on this value but never on how blocks are spread across
+# workers.
+DEFAULT_CHUNK_ROWS = 65_536
 
 
 @dataclass(frozen=True)
@@ -24,12 +46,199 @@ def _ensure_parent_dir(path: str) -> None:
         os.makedirs(parent, exist_ok=True)
 
 
-def _write_csv(path: str, fieldnames: list[str], rows: list[dict]) -> None:
-    _ensure_parent_dir(path)
+def _chunk_rng(seed: int, stream: int, chunk: int) -> np.random.Generator:
+    return np.random.default_rng([seed, stream, chunk])
+
+
+def _ids(prefix: str, start: int, stop: int) -> np.ndarray:
+    return np.char.add(prefix, np.arange(start + 1, stop + 1).astype(str))
+
+
+def _iso(base: np.datetime64, seconds: np.ndarray) -> np.ndarray:
+    stamps = np.datetime_as_string(base + seconds.astype("timedelta64[s]"), unit="s")
+    return np.char.add(stamps, "+00:00")
+
+
+def _money(cents: np.ndarray) -> np.ndarray:
+    cents = cents.astype(np.int64)
+    whole = (cents // 100).astype(str)
+    frac = np.char.zfill((cents % 100).astype(str), 2)
+    return np.char.add(np.char.add(whole, "."), frac)
+
+
+def _write_columns(f: TextIO, columns: list[np.ndarray]) -> None:
+    # Generated values never contain delimiters or quotes, so rows are joined
+    # directly instead of going through csv.writer's per-field quoting checks.
+    if len(columns[0]) == 0:
+        return
+    f.write("\r\n".join(map(",".join, zip(*[c.tolist() for c in columns]))))
+    f.write("\r\n")
+
+
+def _sample_distinct(rng: np.random.Generator, n: int, population: int, counts: np.ndarray) -> np.ndarray:
+    width = MAX_ITEMS_PER_ORDER
+    picks = rng.integers(0, population, size=(n, width))
+    valid = np.arange(width)[None, :] < counts[:, None]
+    todo = np.arange(n)
+    while todo.size:
+        rows = picks[todo]
+        dup = np.zeros(todo.size, dtype=bool)
+        for b in range(1, width):
+            for a in range(b):
+                dup |= (rows[:, a] == rows[:, b]) & valid[todo, b]
+        todo = todo[dup]
+        if todo.size:
+            picks[todo] = rng.integers(0, population, size=(todo.size, width))
+    return picks
+
+
+def _user_cdf(seed: int, users: int) -> np.ndarray:
+    rng = _chunk_rng(seed, _STREAM_USER_WEIGHTS, 0)
+    weights = rng.random(users) ** 2
+    cdf = np.cumsum(weights)
+    total = cdf[-1] if users and cdf[-1] > 0 else 1.0
+    return cdf / total
+
+
+def _product_table(seed: int, products: int, days: int) -> tuple[np.ndarray, ...]:
+    rng = _chunk_rng(seed, _STREAM_PRODUCTS, 0)
+    created = rng.integers(0, max(days, 1), size=products) * 86400
+    category = rng.integers(0, len(CATEGORIES), size=products)
+    price_cents = np.round(rng.uniform(5.0, 500.0, size=products) * 100).astype(np.int64)
+    return created, category, price_cents
+
+
+def _user_chunk(seed: int, chunk: int, lo: int, hi: int, days: int, start: np.datetime64) -> list[np.ndarray]:
+    rng = _chunk_rng(seed, _STREAM_USERS, chunk)
+    created = rng.integers(0, max(days, 1), size=hi - lo) * 86400
+    return [
+        _ids("u", lo, hi),
+        np.char.add(np.char.add("user", np.arange(lo + 1, hi + 1).astype(str)), "@example.com"),
+        np.full(hi - lo, "user"),
+        _iso(start, created),
+    ]
+
+
+def _order_chunk(
+    seed: int,
+    chunk: int,
+    lo: int,
+    hi: int,
+    days: int,
+    start: np.datetime64,
+    user_cdf: np.ndarray,
+    price_cents: np.ndarray,
+    product_ids: np.ndarray,
+    product_prices: np.ndarray,
+) -> tuple[list[np.ndarray], list[np.ndarray]]:
+    rng = _chunk_rng(seed, _STREAM_ORDERS, chunk)
+    n = hi - lo
+    products = len(price_cents)
+
+    user_idx = np.minimum(np.searchsorted(user_cdf, rng.random(n), side="right"), len(user_cdf) - 1)
+    seconds = rng.integers(0, max(days * 24 * 3600, 1), size=n)
+    status_cdf = np.cumsum(STATUS_WEIGHTS) / sum(STATUS_WEIGHTS)
+    status = np.minimum(np.searchsorted(status_cdf, rng.random(n), side="right"), len(STATUSES) - 1)
+
+    counts = np.minimum(rng.integers(1, MAX_ITEMS_PER_ORDER + 1, size=n), products)
+    picks = _sample_distinct(rng, n, products, counts)
+    qty = rng.integers(1, len(_QUANTITY_TEXT), size=(n, MAX_ITEMS_PER_ORDER))
+    valid = np.arange(MAX_ITEMS_PER_ORDER)[None, :] < counts[:, None]
+
+    line_cents = price_cents[picks] * qty * valid
+    order_ids = _ids("o", lo, hi)
+
+    orders = [
+        order_ids,
+        np.char.add("u", (user_idx + 1).astype(str)),
+        _money(line_cents.sum(axis=1)),
+        np.asarray(STATUSES)[status],
+        _iso(start, seconds),
+    ]
+    picked = picks[valid]
+    items = [
+        np.repeat(order_ids, counts),
+        product_ids[picked],
+        _QUANTITY_TEXT[qty[valid]],
+        product_prices[picked],
+    ]
+    return orders, items
+
+
+USER_FIELDS = ["user_id", "email", "role", "created_at"]
+PRODUCT_FIELDS = ["product_id", "category", "price", "created_at"]
+ORDER_FIELDS = ["order_id", "user_id", "total_amount", "status", "created_at"]
+ORDER_ITEM_FIELDS = ["order_id", "product_id", "quantity", "price"]
+
+
+def _start_of(days: int, end_at: datetime) -> np.datetime64:
+    return np.datetime64((end_at - timedelta(days=days)).replace(tzinfo=None), "s")
+
+
+def _write_users(path: str, seed: int, users: int, days: int, end_at: datetime, chunk_rows: int, chunks: range) -> None:
+    start = _start_of(days, end_at)
     with open(path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(rows)
+        csv.writer(f).writerow(USER_FIELDS)
+        for chunk in chunks:
+            lo = chunk * chunk_rows
+            hi = min(lo + chunk_rows, users)
+            _write_columns(f, _user_chunk(seed, chunk, lo, hi, days, start))
+
+
+def _write_products(path: str, seed: int, products: int, days: int, end_at: datetime) -> None:
+    created, category, price_cents = _product_table(seed, products, days)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow(PRODUCT_FIELDS)
+        _write_columns(
+            f,
+            [
+                _ids("p", 0, products),
+                np.asarray(CATEGORIES)[category],
+                _money(price_cents),
+                _iso(_start_of(days, end_at), created),
+            ],
+        )
+
+
+def _write_orders(
+    orders_path: str,
+    items_path: str,
+    seed: int,
+    users: int,
+    products: int,
+    orders: int,
+    days: int,
+    end_at: datetime,
+    chunk_rows: int,
+    chunks: range,
+) -> None:
+    start = _start_of(days, end_at)
+    user_cdf = _user_cdf(seed, users)
+    _, _, price_cents = _product_table(seed, products, days)
+    product_ids = _ids("p", 0, products)
+    product_prices = _money(price_cents)
+    with open(orders_path, "w", newline="", encoding="utf-8") as fo, open(
+        items_path, "w", newline="", encoding="utf-8"
+    ) as fi:
+        csv.writer(fo).writerow(ORDER_FIELDS)
+        csv.writer(fi).writerow(ORDER_ITEM_FIELDS)
+        for chunk in chunks:
+            lo = chunk * chunk_rows
+            hi = min(lo + chunk_rows, orders)
+            order_cols, item_cols = _order_chunk(
+                seed, chunk, lo, hi, days, start, user_cdf, price_cents, product_ids, product_prices
+            )
+            _write_columns(fo, order_cols)
+            _write_columns(fi, item_cols)
+
+
+def _chunk_count(rows: int, chunk_rows: int) -> int:
+    return (max(rows, 0) + chunk_rows - 1) // chunk_rows
+
+
+def _check_sizes(users: int, products: int, orders: int) -> None:
+    if orders > 0 and (users <= 0 or products <= 0):
+        raise ValueError("Generating orders requires at least one user and one product.")
 
 
 def generate(
@@ -39,103 +248,135 @@ def generate(
     orders: int,
     seed: int,
     days: int,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    end_at: Optional[datetime] = None,
 ) -> None:
-    rng = random.Random(seed)
-    now = _utc_now()
-    start = now - timedelta(days=days)
-
-    user_rows: list[dict] = []
-    for i in range(users):
-        created_at = start + timedelta(days=rng.randint(0, max(days - 1, 0)))
-        user_rows.append(
-            {
-                "user_id": f"u{i+1}",
-                "email": f"user{i+1}@example.com",
-                "role": "user",
-                "created_at": created_at.isoformat(),
-            }
-        )
-
-    categories = ["electronics", "fashion", "beauty", "grocery", "home", "sports"]
-    product_rows: list[dict] = []
-    for i in range(products):
-        created_at = start + timedelta(days=rng.randint(0, max(days - 1, 0)))
-        price = round(rng.uniform(5.0, 500.0), 2)
-        product_rows.append(
-            {
-                "product_id": f"p{i+1}",
-                "category": rng.choice(categories),
-                "price": f"{price:.2f}",
-                "created_at": created_at.isoformat(),
-            }
-        )
+    _check_sizes(users, products, orders)
+    chunk_rows = max(1, int(chunk_rows))
+    end_at = end_at or _utc_now()
 
-    order_rows: list[dict] = []
-    item_rows: list[dict] = []
-
-    weights = [rng.random() ** 2 for _ in range(users)]
-    weight_sum = sum(weights) or 1.0
-    probs = [w / weight_sum for w in weights]
-    user_ids = [r["user_id"] for r in user_rows]
-    product_ids = [r["product_id"] for r in product_rows]
-    product_price = {r["product_id"]: float(r["price"]) for r in product_rows}
-
-    for i in range(orders):
-        user_id = rng.choices(user_ids, weights=probs, k=1)[0]
-        created_at = start + timedelta(seconds=rng.randint(0, max(days * 24 * 3600 - 1, 0)))
-        status = rng.choices(
-            ["pending", "processing", "shipped", "delivered", "cancelled"],
-            weights=[0.05, 0.1, 0.25, 0.55, 0.05],
-            k=1,
-        )[0]
-        order_id = f"o{i+1}"
-
-        item_count = rng.randint(1, 5)
-        picked = rng.sample(product_ids, k=min(item_count, len(product_ids)))
-        total = 0.0
-        for pid in picked:
-            qty = rng.randint(1, 3)
-            price = product_price[pid]
-            total += price * qty
-            item_rows.append(
-                {
-                    "order_id": order_id,
-                    "product_id": pid,
-                    "quantity": str(qty),
-                    "price": f"{price:.2f}",
-                }
-            )
-
-        order_rows.append(
-            {
-                "order_id": order_id,
-                "user_id": user_id,
-                "total_amount": f"{total:.2f}",
-                "status": status,
-                "created_at": created_at.isoformat(),
-            }
-        )
+    for path in (out.users_csv, out.products_csv, out.orders_csv, out.order_items_csv):
+        _ensure_parent_dir(path)
 
-    _write_csv(
-        out.users_csv,
-        ["user_id", "email", "role", "created_at"],
-        user_rows,
-    )
-    _write_csv(
-        out.products_csv,
-        ["product_id", "category", "price", "created_at"],
-        product_rows,
-    )
-    _write_csv(
+    _write_users(out.users_csv, seed, users, days, end_at, chunk_rows, range(_chunk_count(users, chunk_rows)))
+    _write_products(out.products_csv, seed, products, days, end_at)
+    _write_orders(
         out.orders_csv,
-        ["order_id", "user_id", "total_amount", "status", "created_at"],
-        order_rows,
-    )
-    _write_csv(
         out.order_items_csv,
-        ["order_id", "product_id", "quantity", "price"],
-        item_rows,
+        seed,
+        users,
+        products,
+        orders,
+        days,
+        end_at,
+        chunk_rows,
+        range(_chunk_count(orders, chunk_rows)),
+    )
+
+
+def shard_path(path: str, shard: int) -> str:
+    base, ext = os.path.splitext(path)
+    return f"{base}.part-{shard:05d}{ext}"
+
+
+def _split_chunks(total_chunks: int, shards: int) -> list[range]:
+    bounds = [total_chunks * k // shards for k in range(shards + 1)]
+    return [range(bounds[k], bounds[k + 1]) for k in range(shards)]
+
+
+def _generate_shard(
+    out: Paths,
+    shard: int,
+    user_chunks: range,
+    order_chunks: range,
+    users: int,
+    products: int,
+    orders: int,
+    seed: int,
+    days: int,
+    chunk_rows: int,
+    end_at: datetime,
+) -> int:
+    _write_users(shard_path(out.users_csv, shard), seed, users, days, end_at, chunk_rows, user_chunks)
+    _write_orders(
+        shard_path(out.orders_csv, shard),
+        shard_path(out.order_items_csv, shard),
+        seed,
+        users,
+        products,
+        orders,
+        days,
+        end_at,
+        chunk_rows,
+        order_chunks,
     )
+    return shard
+
+
+def merge_shards(path: str, shards: int) -> None:
+    with open(path, "wb") as dst:
+        for shard in range(shards):
+            part = shard_path(path, shard)
+            with open(part, "rb") as src:
+                header = src.readline()
+                if shard == 0:
+                    dst.write(header)
+                shutil.copyfileobj(src, dst, 16 << 20)
+            os.remove(part)
+
+
+def generate_sharded(
+    out: Paths,
+    users: int,
+    products: int,
+    orders: int,
+    seed: int,
+    days: int,
+    workers: int,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS,
+    end_at: Optional[datetime] = None,
+    merge: bool = True,
+) -> int:
+    _check_sizes(users, products, orders)
+    workers = max(1, int(workers))
+    chunk_rows = max(1, int(chunk_rows))
+    end_at = end_at or _utc_now()
+
+    for path in (out.users_csv, out.products_csv, out.orders_csv, out.order_items_csv):
+        _ensure_parent_dir(path)
+
+    user_chunks = _chunk_count(users, chunk_rows)
+    order_chunks = _chunk_count(orders, chunk_rows)
+    shards = max(1, min(workers, max(user_chunks, order_chunks)))
+    user_split = _split_chunks(user_chunks, shards)
+    order_split = _split_chunks(order_chunks, shards)
+
+    _write_products(out.products_csv, seed, products, days, end_at)
+    with ProcessPoolExecutor(max_workers=shards) as pool:
+        futures = [
+            pool.submit(
+                _generate_shard,
+                out,
+                shard,
+                user_split[shard],
+                order_split[shard],
+                users,
+                products,
+                orders,
+                seed,
+                days,
+                chunk_rows,
+                end_at,
+            )
+            for shard in range(shards)
+        ]
+        for future in futures:
+            future.result()
+
+    if merge:
+        for path in (out.users_csv, out.orders_csv, out.order_items_csv):
+            merge_shards(path, shards)
+    return shards
 
 
 def main() -> None:
@@ -146,8 +387,17 @@ def main() -> None:
     parser.add_argument("--orders", type=int, default=5000)
     parser.add_argument("--seed", type=int, default=7)
     parser.add_argument("--days", type=int, default=180)
+    parser.add_argument("--chunk_rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument("--end_at", default="")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--no_merge", action="store_true")
     args = parser.parse_args()
 
+    end_at = None
+    if args.end_at:
+        end_at = datetime.fromisoformat(args.end_at.replace("Z", "+00:00"))
+        end_at = end_at.replace(tzinfo=timezone.utc) if end_at.tzinfo is None else end_at.astimezone(timezone.utc)
+
     base = args.out_dir
     out = Paths(
         users_csv=os.path.join(base, "users.csv"),
@@ -155,6 +405,21 @@ def main() -> None:
         orders_csv=os.path.join(base, "orders.csv"),
         order_items_csv=os.path.join(base, "order_items.csv"),
     )
+    if args.workers > 1 or args.no_merge:
+        generate_sharded(
+            out=out,
+            users=args.users,
+            products=args.products,
+            orders=args.orders,
+            seed=args.seed,
+            days=args.days,
+            workers=args.workers,
+            chunk_rows=args.chunk_rows,
+            end_at=end_at,
+            merge=not args.no_merge,
+        )
+        return
+
     generate(
         out=out,
         users=args.users,
@@ -162,6 +427,8 @@ def main() -> None:
         orders=args.orders,
         seed=args.seed,
         days=args.days,
+        chunk_rows=args.chunk_rows,
+        end_at=end_at,
     )
 
 
@@ -0,0 +1,364 @@
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import Manager, shared_memory
+from typing import Any, Optional
+
+import numpy as np
+import torch
+from threadpoolctl import threadpool_limits
+
+from interactions import load_interactions
+from train_propensity_dl import train as train_dl
+from train_propensity_ml import load_columns, split_mask
+from train_propensity_ml import train as train_ml
+from train_recommender_dl import train as train_rec
+
+DEFAULTS: dict[str, dict[str, Any]] = {
+    "propensity_ml": {"test_ratio": 0.2, "seed": 7, "c": 0.1},
+    "propensity_dl": {
+        "test_ratio": 0.2,
+        "seed": 7,
+        "epochs": 10,
+        "batch_size": 256,
+        "lr": 0.001,
+        "hidden": 64,
+        "dropout": 0.1,
+    },
+    "recommender": {
+        "dim": 64,
+        "epochs": 10,
+        "batch_size": 2048,
+        "lr": 0.003,
+        "seed": 7,
+        "neg_per_pos": 3,
+        "holdout_orders": 1,
+        "eval_k": [10, 20],
+    },
+}
+DEFAULT_METRIC = {"propensity_ml": "auc", "propensity_dl": "auc", "recommender": "ndcg@10"}
+# These define the test split, which is fixed for the whole search.
+SPLIT_PARAMS = ("test_ratio", "holdout_orders")
+DATASET_CSV = "services/data-mining/data/processed/propensity_dataset.csv"
+ORDERS_CSV = "services/data-mining/data/raw/orders.csv"
+ORDER_ITEMS_CSV = "services/data-mining/data/raw/order_items.csv"
+
+# Per-worker state installed by _init_worker; shared blocks must outlive the views.
+_WORKER: dict[str, Any] = {}
+
+
+def grid_trials(space: dict[str, list[Any]]) -> list[dict[str, Any]]:
+    names = sorted(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+
+
+def _sample(spec: Any, rng: np.random.Generator) -> Any:
+    if isinstance(spec, list):
+        return spec[int(rng.integers(len(spec)))]
+    if not isinstance(spec, dict) or len(spec) != 1:
+        return spec
+    kind, args = next(iter(spec.items()))
+    if kind == "choice":
+        return args[int(rng.integers(len(args)))]
+    if kind == "uniform":
+        return float(rng.uniform(args[0], args[1]))
+    if kind == "log_uniform":
+        return float(math.exp(rng.uniform(math.log(args[0]), math.log(args[1]))))
+    if kind == "int":
+        return int(rng.integers(args[0], args[1] + 1))
+    raise ValueError(f"Unknown search distribution: {kind}")
+
+
+def random_trials(space: dict[str, Any], trials: int, seed: int) -> list[dict[str, Any]]:
+    rng = np.random.default_rng(seed)
+    names = sorted(space)
+    return [{n: _sample(space[n], rng) for n in names} for _ in range(trials)]
+
+
+def _share(arrays: dict[str, np.ndarray]) -> tuple[list[shared_memory.SharedMemory], dict[str, tuple]]:
+    blocks = []
+    specs = {}
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+        blocks.append(shm)
+        specs[name] = (shm.name, arr.shape, arr.dtype.str)
+    return blocks, specs
+
+
+def _attach(specs: dict[str, tuple]) -> dict[str, np.ndarray]:
+    arrays = {}
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _WORKER.setdefault("blocks", []).append(shm)
+        view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        view.flags.writeable = False
+        arrays[name] = view
+    return arrays
+
+
+def _init_worker(threads: int, specs: dict[str, tuple], curves: Any) -> None:
+    _WORKER["limits"] = threadpool_limits(limits=threads)
+    torch.set_num_threads(threads)
+    _WORKER["arrays"] = _attach(specs)
+    _WORKER["curves"] = curves
+
+
+class MedianStopper:
+    # Median stopping rule: after `grace` epochs, stop a trial whose metric is
+    # below the median of what other trials reported at the same epoch.
+    def __init__(self, curves: Any, trial: int, metric: str, grace: int = 1, min_peers: int = 3):
+        self.curves = curves
+        self.trial = trial
+        self.metric = metric
+        self.grace = grace
+        self.min_peers = min_peers
+        self.epochs = 0
+        self.stopped = False
+
+    def __call__(self, epoch: int, metrics: dict[str, float]) -> bool:
+        value = float(metrics.get(self.metric, float("nan")))
+        self.curves[self.trial] = list(self.curves.get(self.trial, [])) + [value]
+        self.epochs = epoch
+        if epoch < self.grace or math.isnan(value):
+            return False
+        peers = [
+            c[epoch - 1]
+            for t, c in self.curves.items()
+            if t != self.trial and len(c) >= epoch and not math.isnan(c[epoch - 1])
+        ]
+        if len(peers) < self.min_peers:
+            return False
+        self.stopped = value < float(np.median(peers))
+        return self.stopped
+
+
+def _run_trial(
+    trainer: str,
+    trial: int,
+    params: dict[str, Any],
+    fixed: dict[str, Any],
+    out_dir: str,
+    metric: str,
+    early_stop: bool,
+) -> dict[str, Any]:
+    trial_dir = os.path.join(out_dir, "trials", f"trial_{trial:03d}")
+    kwargs = {**DEFAULTS[trainer], **fixed, **params, "out_dir": trial_dir}
+    stopper = MedianStopper(_WORKER["curves"], trial, metric) if early_stop else None
+    arrays = _WORKER["arrays"]
+    record: dict[str, Any] = {"trial": trial, "params": params, "artifact_dir": trial_dir}
+
+    started = time.perf_counter()
+    try:
+        if trainer == "propensity_ml":
+            result = train_ml(arrays=(arrays["x"], arrays["y"], arrays["is_test"]), **kwargs)
+        elif trainer == "propensity_dl":
+            result = train_dl(arrays=(arrays["x"], arrays["y"], arrays["is_test"]), on_epoch=stopper, **kwargs)
+        else:
+            result = train_rec(on_epoch=stopper, **kwargs)
+        record["status"] = "stopped" if stopper is not None and stopper.stopped else "completed"
+        record["metrics"] = result
+        record["epochs"] = stopper.epochs if record["status"] == "stopped" else kwargs.get("epochs")
+    except Exception:
+        record["status"] = "failed"
+        record["error"] = traceback.format_exc(limit=3)
+    record["seconds"] = time.perf_counter() - started
+    return record
+
+
+def _write_leaderboard(out_dir: str, records: list[dict[str, Any]], metric: str) -> list[dict[str, Any]]:
+    def sort_key(r: dict[str, Any]) -> tuple:
+        value = (r.get("metrics") or {}).get(metric, float("nan"))
+        ok = r["status"] != "failed" and not math.isnan(value)
+        return (not ok, r["status"] != "completed", -value if ok else 0.0, r["trial"])
+
+    board = sorted(records, key=sort_key)
+    for rank, r in enumerate(board, start=1):
+        r["rank"] = rank
+    with open(os.path.join(out_dir, "leaderboard.json"), "w", encoding="utf-8") as f:
+        json.dump({"metric": metric, "trials": board}, f, ensure_ascii=False, indent=2)
+
+    with open(os.path.join(out_dir, "leaderboard.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["rank", "trial", "status", metric, "seconds", "epochs", "artifact_dir", "params"])
+        for r in board:
+            value = (r.get("metrics") or {}).get(metric, "")
+            writer.writerow(
+                [
+                    r["rank"],
+                    r["trial"],
+                    r["status"],
+                    value,
+                    round(r["seconds"], 3),
+                    r.get("epochs", ""),
+                    r["artifact_dir"],
+                    json.dumps(r["params"], sort_keys=True),
+                ]
+            )
+    return board
+
+
+def search(
+    trainer: str,
+    space: dict[str, Any],
+    out_dir: str,
+    strategy: str = "grid",
+    trials: int = 20,
+    workers: int = 0,
+    threads_per_trial: int = 1,
+    early_stop: bool = True,
+    metric: Optional[str] = None,
+    fixed: Optional[dict[str, Any]] = None,
+    seed: int = 7,
+    val_ratio: float = 0.2,
+) -> list[dict[str, Any]]:
+    if trainer not in DEFAULTS:
+        raise ValueError(f"Unknown trainer: {trainer}")
+    searched = sorted(set(space) & set(SPLIT_PARAMS))
+    if searched:
+        raise ValueError(f"{', '.join(searched)} defines the test split and cannot be searched; pass it in fixed")
+    metric = metric or DEFAULT_METRIC[trainer]
+    fixed = dict(fixed or {})
+    threads_per_trial = max(1, int(threads_per_trial))
+    workers = workers or max(1, (os.cpu_count() or 1) // threads_per_trial)
+    os.makedirs(out_dir, exist_ok=True)
+
+    candidates = grid_trials(space) if strategy == "grid" else random_trials(space, trials, seed)
+
+    # Load the dataset once; workers see it without re-reading or copying.
+    # Trials are pruned and ranked on a validation slice of the training data;
+    # the test split is only scored once, by refitting the winner.
+    blocks: list[shared_memory.SharedMemory] = []
+    specs: dict[str, tuple] = {}
+    arrays: Optional[tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+    if trainer.startswith("propensity"):
+        dataset_csv = fixed.pop("dataset_csv", None) or DATASET_CSV
+        test_ratio = fixed.get("test_ratio", DEFAULTS[trainer]["test_ratio"])
+        x, y, user_ids = load_columns(dataset_csv)
+        is_test = split_mask(user_ids, test_ratio)
+        # Same user hash as the test split, so validation users are a
+        # `val_ratio` share of the training users.
+        is_val = split_mask(user_ids, test_ratio + val_ratio * (1.0 - test_ratio))[~is_test]
+        blocks, specs = _share({"x": x[~is_test], "y": y[~is_test], "is_test": is_val})
+        arrays = (x, y, is_test)
+        fixed["dataset_csv"] = ""
+        trial_fixed = fixed
+    else:
+        # Interaction splits are cached as .npy and memory-mapped by every
+        # trial, so the page cache is the shared copy.
+        fixed.setdefault("orders_csv", ORDERS_CSV)
+        fixed.setdefault("order_items_csv", ORDER_ITEMS_CSV)
+        fixed.setdefault("cache_dir", os.path.join(out_dir, "cache"))
+        holdout = fixed.get("holdout_orders", DEFAULTS[trainer]["holdout_orders"])
+        # Trials validate on the order before each user's test orders and
+        # keep the validation-fit model; only the winner is refit.
+        trial_fixed = {**fixed, "holdout_orders": 1, "holdout_offset": holdout, "refit": False}
+        for test in (False, True):
+            load_interactions(
+                fixed["orders_csv"],
+                fixed["order_items_csv"],
+                holdout_orders=1,
+                holdout_offset=holdout,
+                test=test,
+                cache_dir=fixed["cache_dir"],
+            )
+
+    records: list[dict[str, Any]] = []
+    try:
+        with Manager() as manager:
+            curves = manager.dict()
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker, initargs=(threads_per_trial, specs, curves)
+            ) as pool:
+                futures = [
+                    pool.submit(_run_trial, trainer, i, params, trial_fixed, out_dir, metric, early_stop)
+                    for i, params in enumerate(candidates)
+                ]
+                for future in as_completed(futures):
+                    records.append(future.result())
+                    _write_leaderboard(out_dir, records, metric)
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+    board = _write_leaderboard(out_dir, records, metric)
+    if board and board[0]["status"] != "failed":
+        best = board[0]
+        best_dir = os.path.join(out_dir, "best")
+        kwargs = {**DEFAULTS[trainer], **fixed, **best["params"], "out_dir": best_dir}
+        if trainer == "propensity_ml":
+            result = train_ml(arrays=arrays, **kwargs)
+        elif trainer == "propensity_dl":
+            result = train_dl(arrays=arrays, **kwargs)
+        else:
+            result = train_rec(**kwargs)
+        best["test_metrics"] = result
+        best["test_artifact_dir"] = best_dir
+        board = _write_leaderboard(out_dir, records, metric)
+    return board
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trainer", choices=sorted(DEFAULTS), required=True)
+    parser.add_argument("--space", required=True, help="JSON object or path to a JSON file")
+    parser.add_argument("--fixed", default="{}", help="JSON object of trainer arguments shared by all trials")
+    parser.add_argument("--strategy", choices=["grid", "random"], default="grid")
+    parser.add_argument("--trials", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--threads_per_trial", type=int, default=1)
+    parser.add_argument("--metric", default=None)
+    parser.add_argument("--no_early_stop", action="store_true")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out_dir", default="services/data-mining/artifacts/hparam_search")
+    parser.add_argument("--val_ratio", type=float, default=0.2)
+    parser.add_argument("--dataset_csv", default=DATASET_CSV)
+    parser.add_argument("--orders_csv", default=ORDERS_CSV)
+    parser.add_argument("--order_items_csv", default=ORDER_ITEMS_CSV)
+    args = parser.parse_args()
+
+    def parse_json(value: str) -> dict[str, Any]:
+        if os.path.exists(value):
+            with open(value, encoding="utf-8") as f:
+                return json.load(f)
+        return json.loads(value)
+
+    fixed = parse_json(args.fixed)
+    if args.trainer.startswith("propensity"):
+        fixed.setdefault("dataset_csv", args.dataset_csv)
+    else:
+        fixed.setdefault("orders_csv", args.orders_csv)
+        fixed.setdefault("order_items_csv", args.order_items_csv)
+
+    board = search(
+        trainer=args.trainer,
+        space=parse_json(args.space),
+        out_dir=args.out_dir,
+        strategy=args.strategy,
+        trials=args.trials,
+        workers=args.workers,
+        threads_per_trial=args.threads_per_trial,
+        early_stop=not args.no_early_stop,
+        metric=args.metric,
+        fixed=fixed,
+        seed=args.seed,
+        val_ratio=args.val_ratio,
+    )
+    metric = args.metric or DEFAULT_METRIC[args.trainer]
+    for r in board[:10]:
+        value = (r.get("metrics") or {}).get(metric)
+        print(f"{r['rank']:>3}  trial_{r['trial']:03d}  {r['status']:<9}  {value}  {json.dumps(r['params'])}")
+    if board and "test_metrics" in board[0]:
+        print(f"test {metric} of trial_{board[0]['trial']:03d}: {(board[0]['test_metrics'] or {}).get(metric)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+import argparse
+import cProfile
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import AbstractContextManager, contextmanager
+from dataclasses import dataclass
+from types import FrameType
+from typing import Any, Optional
+
+ENV_VAR = "DATA_MINING_PROFILE"
+MODES = ("timings", "cprofile", "sample")
+
+
+def _peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+@dataclass(slots=True)
+class Phase:
+    rows: int = 0
+
+
+class _Sampler:
+    # Samples the main thread's stack from a background thread and counts
+    # collapsed stacks ("file:func;file:func"), the input format of flamegraph.pl
+    # and speedscope.
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._target = threading.main_thread().ident
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="instrument-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame: Optional[FrameType] = sys._current_frames().get(self._target)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+    def dump(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Stopwatch:
+    # For straight-line code: each lap() records the time since the previous
+    # lap (or since creation) as one phase.
+    def __init__(self, instrument: "Instrument") -> None:
+        self.instrument = instrument
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+
+    def lap(self, name: str, rows: int = 0) -> None:
+        if self.instrument.mode is None:
+            return
+        wall, cpu = time.perf_counter(), time.process_time()
+        self.instrument.record(name, wall - self._wall, cpu - self._cpu, rows)
+        self._wall, self._cpu = wall, cpu
+
+
+class Instrument:
+    # Per-phase wall time, process CPU time (all threads), rows and the RSS
+    # high-water mark once the phase ends. Repeated phases (e.g. one per
+    # epoch) are summed into one entry; a nested phase's time is also counted
+    # in its parent. Disabled instances only pay for an empty context manager.
+    def __init__(self, mode: Optional[str] = None) -> None:
+        if mode is not None and mode not in MODES:
+            raise ValueError(f"Unknown profile mode: {mode}; choose from {MODES}")
+        self.mode = mode
+        self.phases: dict[str, dict[str, Any]] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode is not None
+
+    @contextmanager
+    def phase(self, name: str, rows: int = 0) -> Iterator[Phase]:
+        current = Phase(rows=rows)
+        if self.mode is None:
+            yield current
+            return
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        try:
+            yield current
+        finally:
+            self.record(name, time.perf_counter() - started, time.process_time() - cpu_started, current.rows)
+
+    def stopwatch(self) -> Stopwatch:
+        return Stopwatch(self)
+
+    def record(self, name: str, seconds: float, cpu_seconds: float, rows: int = 0) -> None:
+        entry = self.phases.setdefault(name, {"calls": 0, "seconds": 0.0, "cpu_seconds": 0.0, "rows": 0})
+        entry["calls"] += 1
+        entry["seconds"] += seconds
+        entry["cpu_seconds"] += cpu_seconds
+        entry["rows"] += rows
+        entry["peak_rss_mb"] = _peak_rss_mb()
+
+    def report(self) -> dict[str, dict[str, Any]]:
+        phases = {}
+        for name, entry in self.phases.items():
+            seconds = entry["seconds"]
+            rows_per_sec = entry["rows"] / seconds if entry["rows"] and seconds > 0 else None
+            phases[name] = {**entry, "rows_per_sec": rows_per_sec}
+        return phases
+
+
+_active = Instrument()
+
+
+def active() -> Instrument:
+    return _active
+
+
+def phase(name: str, rows: int = 0) -> AbstractContextManager[Phase]:
+    return _active.phase(name, rows)
+
+
+def stopwatch() -> Stopwatch:
+    return _active.stopwatch()
+
+
+def add_args(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--profile",
+        choices=MODES,
+        default=os.environ.get(ENV_VAR) or None,
+        help=f"record per-phase timings (cprofile/sample also dump a profile); defaults to ${ENV_VAR}",
+    )
+    parser.add_argument("--profile_interval_ms", type=float, default=5.0)
+
+
+@contextmanager
+def session(
+    name: str, out_json: str, mode: Optional[str], sample_interval_ms: float = 5.0
+) -> Iterator[Instrument]:
+    # Activates an Instrument for the duration of an entry point and writes
+    # <out_json> (plus <base>.prof or <base>.stacks.txt) even if the run fails.
+    global _active
+    if mode is None:
+        yield _active
+        return
+    instrument = Instrument(mode)
+    previous, _active = _active, instrument
+    base = os.path.splitext(out_json)[0].removesuffix(".profile")
+    profiler: Optional[cProfile.Profile] = None
+    sampler: Optional[_Sampler] = None
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif mode == "sample":
+        sampler = _Sampler(sample_interval_ms / 1000.0)
+        sampler.start()
+
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    error = None
+    try:
+        yield instrument
+    except BaseException as exc:
+        error = f"{type(exc).__name__}: {exc}"
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        cpu_seconds = time.process_time() - cpu_started
+        os.makedirs(os.path.dirname(os.path.abspath(out_json)), exist_ok=True)
+        profile_path = None
+        if profiler is not None:
+            profiler.disable()
+            profile_path = base + ".prof"
+            profiler.dump_stats(profile_path)
+        if sampler is not None:
+            sampler.stop()
+            profile_path = base + ".stacks.txt"
+            sampler.dump(profile_path)
+        _active = previous
+
+        report = {
+            "name": name,
+            "mode": mode,
+            "argv": sys.argv,
+            "pid": os.getpid(),
+            "seconds": seconds,
+            "cpu_seconds": cpu_seconds,
+            "peak_rss_mb": _peak_rss_mb(),
+            "phases": instrument.report(),
+            "profile": profile_path,
+            "error": error,
+        }
+        with open(out_json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
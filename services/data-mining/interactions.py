@@ -0,0 +1,181 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+from dataclasses import dataclass, fields
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from mf_artifact import IdIndex, encode_ids
+from pipeline_cache import StageCache, fingerprint_file
+
+CACHE_VERSION = 2
+CACHE_MAX_MB = 2048
+
+
+@dataclass
+class Interactions:
+    user_ids: np.ndarray
+    item_ids: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+    weights: np.ndarray
+
+    @property
+    def n_users(self) -> int:
+        return int(self.user_ids.shape[0])
+
+    @property
+    def n_items(self) -> int:
+        return int(self.item_ids.shape[0])
+
+    @property
+    def nnz(self) -> int:
+        return int(self.indices.shape[0])
+
+    def rows(self) -> np.ndarray:
+        return np.repeat(np.arange(self.n_users, dtype=np.int64), np.diff(self.indptr))
+
+    def users(self) -> IdIndex:
+        return IdIndex(self.user_ids, np.arange(self.n_users, dtype=np.int64))
+
+    def items(self) -> IdIndex:
+        return IdIndex(self.item_ids, np.arange(self.n_items, dtype=np.int64))
+
+    def remap(self, users: IdIndex, items: IdIndex) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Translates to another id space (e.g. a trained model's rows), dropping unknown ids.
+        rows = users.lookup(self.user_ids)[self.rows()]
+        cols = items.lookup(self.item_ids)[self.indices]
+        keep = (rows >= 0) & (cols >= 0)
+        return rows[keep], cols[keep], np.asarray(self.weights)[keep]
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        for f in fields(self):
+            np.save(os.path.join(path, f"{f.name}.npy"), getattr(self, f.name))
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = "r") -> "Interactions":
+        return cls(**{f.name: np.load(os.path.join(path, f"{f.name}.npy"), mmap_mode=mmap_mode) for f in fields(cls)})
+
+
+def csr_from_pairs(rows: np.ndarray, cols: np.ndarray, n_rows: int) -> tuple[np.ndarray, np.ndarray]:
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(n_rows + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr, cols[order].astype(np.int64)
+
+
+def _holdout_mask(orders: pd.DataFrame, holdout_orders: int) -> pd.Series:
+    # Marks each user's last `holdout_orders` orders, leaving users without
+    # enough earlier history entirely in the training side.
+    created = pd.to_datetime(orders["created_at"], utc=True, errors="coerce")
+    ranked = orders.assign(_created=created).sort_values(["user_id", "_created", "order_id"], kind="stable")
+    from_end = ranked.groupby("user_id", sort=False).cumcount(ascending=False)
+    total = ranked.groupby("user_id", sort=False)["order_id"].transform("size")
+    return ((from_end < holdout_orders) & (total > holdout_orders)).reindex(orders.index)
+
+
+def build_interactions(
+    orders_csv: str,
+    order_items_csv: str,
+    since_days: Optional[float] = None,
+    holdout_orders: int = 0,
+    test: bool = False,
+    holdout_offset: int = 0,
+) -> Interactions:
+    items = pd.read_csv(
+        order_items_csv, usecols=["order_id", "product_id", "quantity"], dtype={"order_id": str, "product_id": str}
+    )
+    if since_days is None and holdout_orders <= 0 and holdout_offset <= 0:
+        orders = pd.read_csv(orders_csv, usecols=["order_id", "user_id"], dtype=str)
+    else:
+        orders = pd.read_csv(orders_csv, usecols=["order_id", "user_id", "created_at"], dtype=str)
+        keep = pd.Series(True, index=orders.index)
+        if holdout_offset > 0:
+            # A validation split: each user's last `holdout_offset` orders are
+            # someone else's test set and stay out of both sides.
+            keep &= ~_holdout_mask(orders, holdout_offset)
+        if holdout_orders > 0:
+            held = _holdout_mask(orders, holdout_orders + holdout_offset)
+            keep &= held if test else ~held
+        if since_days is not None:
+            created = pd.to_datetime(orders["created_at"], utc=True, errors="coerce")
+            keep &= created >= created.max() - pd.Timedelta(days=since_days)
+        orders = orders.loc[keep, ["order_id", "user_id"]]
+    df = items.merge(orders, on="order_id", how="inner")
+
+    user_codes, user_uniq = pd.factorize(df["user_id"], sort=True)
+    item_codes, item_uniq = pd.factorize(df["product_id"], sort=True)
+    n_users, n_items = len(user_uniq), len(item_uniq)
+
+    keys, inverse = np.unique(user_codes.astype(np.int64) * n_items + item_codes, return_inverse=True)
+    weights = np.bincount(inverse, weights=df["quantity"].astype(float).to_numpy(), minlength=keys.size)
+    indptr = np.zeros(n_users + 1, dtype=np.int64)
+    if keys.size:
+        np.cumsum(np.bincount(keys // n_items, minlength=n_users), out=indptr[1:])
+
+    return Interactions(
+        user_ids=encode_ids(user_uniq.tolist()),
+        item_ids=encode_ids(item_uniq.tolist()),
+        indptr=indptr,
+        indices=keys % n_items if n_items else keys,
+        weights=weights,
+    )
+
+
+def load_interactions(
+    orders_csv: str,
+    order_items_csv: str,
+    since_days: Optional[float] = None,
+    holdout_orders: int = 0,
+    test: bool = False,
+    cache_dir: Optional[str] = None,
+    cache_max_mb: int = CACHE_MAX_MB,
+    holdout_offset: int = 0,
+) -> Interactions:
+    options = {"since_days": since_days, "holdout_orders": holdout_orders, "test": test}
+    if holdout_offset > 0:
+        options["holdout_offset"] = holdout_offset
+    if not cache_dir:
+        return build_interactions(orders_csv, order_items_csv, **options)
+
+    payload = {
+        "version": CACHE_VERSION,
+        "inputs": {os.path.abspath(p): fingerprint_file(p) for p in (orders_csv, order_items_csv)},
+        **options,
+    }
+    key = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+    path = os.path.join(cache_dir, f"interactions-{key}")
+    manifest_path = os.path.join(path, "manifest.json")
+    try:
+        cached = Interactions.load(path)
+        os.utime(manifest_path)
+        return cached
+    except OSError:
+        # Missing, or evicted by another process between check and load.
+        pass
+
+    built = build_interactions(orders_csv, order_items_csv, **options)
+    tmp = f"{path}.tmp-{os.getpid()}"
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    built.save(tmp)
+    # Entries carry a StageCache manifest so the same LRU eviction bounds this
+    # directory; keys change whenever the inputs do (e.g. every daily refresh).
+    size = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp))
+    manifest = {"stage": "interactions", "key": key, "size": size, "created_at": time.time()}
+    with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    if os.path.isdir(path):
+        shutil.rmtree(tmp)
+    else:
+        os.replace(tmp, path)
+    loaded = Interactions.load(path)
+    # The arrays are memory-mapped, so they stay readable even if this
+    # entry is the one evicted.
+    StageCache(cache_dir, max_bytes=cache_max_mb * 1024 * 1024).evict()
+    return loaded
@@ -0,0 +1,134 @@
+import json
+import os
+from collections.abc import Sequence
+from typing import Optional
+
+import numpy as np
+
+EMB_DTYPES = ("float32", "float16", "int8")
+
+
+def encode_ids(keys: Sequence[str]) -> np.ndarray:
+    if isinstance(keys, np.ndarray) and keys.dtype.kind == "S":
+        return keys
+    if len(keys) == 0:
+        return np.empty(0, dtype="S1")
+    return np.char.encode(np.asarray(keys, dtype=str), "utf-8")
+
+
+class IdIndex:
+    # Ids stay in row order (utf-8 bytes) next to their argsort permutation, so
+    # lookups are a binary search over mmap'd pages instead of a Python dict.
+    def __init__(self, ids: np.ndarray, order: np.ndarray):
+        self.ids = ids
+        self.order = order
+
+    @classmethod
+    def from_list(cls, ids: Sequence[str]) -> "IdIndex":
+        encoded = encode_ids(ids)
+        return cls(encoded, np.argsort(encoded, kind="stable").astype(np.int64))
+
+    @classmethod
+    def load(cls, prefix: str, mmap_mode: Optional[str] = "r") -> "IdIndex":
+        ids = np.load(f"{prefix}_ids.npy", mmap_mode=mmap_mode)
+        return cls(ids, np.load(f"{prefix}_order.npy", mmap_mode=mmap_mode))
+
+    def save(self, prefix: str) -> None:
+        np.save(f"{prefix}_ids.npy", self.ids)
+        np.save(f"{prefix}_order.npy", self.order)
+
+    def __len__(self) -> int:
+        return int(self.ids.shape[0])
+
+    def lookup(self, keys: Sequence[str]) -> np.ndarray:
+        query = encode_ids(keys)
+        if len(self) == 0 or query.size == 0:
+            return np.full(query.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.ids, query, sorter=self.order), len(self) - 1)
+        rows = np.asarray(self.order[pos], dtype=np.int64)
+        return np.where(self.ids[rows] == query, rows, -1)
+
+    def get(self, key: str) -> Optional[int]:
+        row = int(self.lookup([key])[0])
+        return row if row >= 0 else None
+
+    def decode(self, rows: Sequence[int]) -> list[str]:
+        return [b.decode("utf-8") for b in self.ids[np.asarray(rows, dtype=np.int64)].tolist()]
+
+
+def _save_embedding(prefix: str, emb: np.ndarray, emb_dtype: str) -> None:
+    emb = np.asarray(emb, dtype=np.float32)
+    if emb_dtype == "float32":
+        np.save(f"{prefix}.npy", emb)
+    elif emb_dtype == "float16":
+        np.save(f"{prefix}.npy", emb.astype(np.float16))
+    elif emb_dtype == "int8":
+        # Symmetric per-row scales keep each vector's direction intact.
+        scale = np.abs(emb).max(axis=1) / 127.0 if emb.size else np.zeros(emb.shape[0], dtype=np.float32)
+        scale = np.where(scale > 0, scale, 1.0).astype(np.float32)
+        np.save(f"{prefix}.npy", np.clip(np.rint(emb / scale[:, None]), -127, 127).astype(np.int8))
+        np.save(f"{prefix}_scale.npy", scale)
+    else:
+        raise ValueError(f"Unknown embedding dtype: {emb_dtype}")
+
+
+def _load_embedding(prefix: str, mmap_mode: Optional[str]) -> np.ndarray:
+    emb = np.load(f"{prefix}.npy", mmap_mode=mmap_mode)
+    if emb.dtype == np.float32:
+        return emb
+    if emb.dtype == np.int8:
+        scale = np.load(f"{prefix}_scale.npy")
+        return emb.astype(np.float32) * scale[:, None]
+    return emb.astype(np.float32)
+
+
+def write_id_json(base: str, users: IdIndex, items: IdIndex) -> None:
+    # Deprecated: the pre-.npy layout's {base}.users.json / {base}.items.json id
+    # lists, still written for existing consumers and dropped in the next release.
+    for suffix, index in (("users", users), ("items", items)):
+        with open(f"{base}.{suffix}.json", "w", encoding="utf-8") as f:
+            json.dump(index.decode(range(len(index))), f, ensure_ascii=False)
+
+
+def save_mf(
+    out_dir: str,
+    user_emb: np.ndarray,
+    item_emb: np.ndarray,
+    user_ids: Sequence[str],
+    item_ids: Sequence[str],
+    emb_dtype: str = "float32",
+) -> None:
+    base = os.path.join(out_dir, "recommender_mf")
+    _save_embedding(f"{base}.user_emb", user_emb, emb_dtype)
+    _save_embedding(f"{base}.item_emb", item_emb, emb_dtype)
+    users = IdIndex.from_list(user_ids)
+    items = IdIndex.from_list(item_ids)
+    users.save(f"{base}.user")
+    items.save(f"{base}.item")
+    write_id_json(base, users, items)
+
+
+def load_mf(artifact_dir: str, mmap_mode: Optional[str] = "r") -> tuple[np.ndarray, np.ndarray, IdIndex, IdIndex]:
+    base = os.path.join(artifact_dir, "recommender_mf")
+    if os.path.exists(f"{base}.item_emb.npy"):
+        return (
+            _load_embedding(f"{base}.user_emb", mmap_mode),
+            _load_embedding(f"{base}.item_emb", mmap_mode),
+            IdIndex.load(f"{base}.user", mmap_mode),
+            IdIndex.load(f"{base}.item", mmap_mode),
+        )
+
+    import torch
+
+    ckpt = torch.load(f"{base}.pt", map_location="cpu", weights_only=False)
+    state = ckpt["state_dict"]
+    with open(f"{base}.users.json", encoding="utf-8") as f:
+        user_ids = json.load(f)
+    with open(f"{base}.items.json", encoding="utf-8") as f:
+        item_ids = json.load(f)
+    return (
+        np.ascontiguousarray(state["user.weight"].numpy(), dtype=np.float32),
+        np.ascontiguousarray(state["item.weight"].numpy(), dtype=np.float32),
+        IdIndex.from_list(user_ids),
+        IdIndex.from_list(item_ids),
+    )
@@ -0,0 +1,180 @@
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Callable, Optional
+
+import torch
+from threadpoolctl import threadpool_limits
+
+from pipeline_cache import StageCache
+
+
+@dataclass
+class Stage:
+    name: str
+    fn: Callable[..., Any]
+    kwargs: dict[str, Any]
+    inputs: list[str]
+    outputs: list[str]
+    # Cache key parameters; `sources` (e.g. the stage's script) are fingerprinted
+    # with the inputs but never create dependencies.
+    params: dict[str, Any] = field(default_factory=dict)
+    sources: list[str] = field(default_factory=list)
+    threads: int = 1
+
+
+def _contains(output: str, path: str) -> bool:
+    return path == output or path.startswith(output.rstrip(os.sep) + os.sep)
+
+
+def stage_graph(stages: list[Stage]) -> dict[str, set[str]]:
+    # A stage depends on whichever stage produces one of its inputs (or the
+    # directory containing it).
+    names = [s.name for s in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("Stage names must be unique")
+    producers: dict[str, str] = {}
+    for stage in stages:
+        for out in stage.outputs:
+            out = os.path.abspath(out)
+            if out in producers:
+                raise ValueError(f"{out} is produced by both {producers[out]} and {stage.name}")
+            producers[out] = stage.name
+
+    deps = {
+        s.name: {
+            name
+            for path in map(os.path.abspath, s.inputs)
+            for out, name in producers.items()
+            if name != s.name and _contains(out, path)
+        }
+        for s in stages
+    }
+
+    visiting: set[str] = set()
+    done: set[str] = set()
+
+    def visit(name: str) -> None:
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Pipeline has a cycle through {name}")
+        visiting.add(name)
+        for dep in deps[name]:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+
+    for name in names:
+        visit(name)
+    return deps
+
+
+def _run_stage(stage: Stage, cache: Optional[StageCache]) -> dict[str, Any]:
+    started = time.time()
+    cpu_started = time.process_time()
+    torch.set_num_threads(stage.threads)
+    with threadpool_limits(limits=stage.threads):
+        fn = partial(stage.fn, **stage.kwargs)
+        if cache is None:
+            fn()
+            cached = False
+        else:
+            inputs = stage.inputs + stage.sources
+            # Workers share the cache; run_pipeline evicts once they are done.
+            cached = cache.run(
+                name=stage.name, inputs=inputs, params=stage.params, outputs=stage.outputs, fn=fn, evict=False
+            )
+    return {
+        "cached": cached,
+        "started": started,
+        "seconds": time.time() - started,
+        "cpu_seconds": time.process_time() - cpu_started,
+        "pid": os.getpid(),
+    }
+
+
+def _critical_path(deps: dict[str, set[str]], seconds: dict[str, float]) -> tuple[list[str], float]:
+    finish: dict[str, tuple[float, list[str]]] = {}
+
+    def longest(name: str) -> tuple[float, list[str]]:
+        if name not in finish:
+            best = max((longest(d) for d in deps[name]), default=(0.0, []))
+            finish[name] = (best[0] + seconds.get(name, 0.0), best[1] + [name])
+        return finish[name]
+
+    total, path = max((longest(name) for name in deps), default=(0.0, []))
+    return path, total
+
+
+def run_pipeline(
+    stages: list[Stage],
+    cpus: int = 0,
+    cache: Optional[StageCache] = None,
+    report_path: Optional[str] = None,
+) -> dict[str, Any]:
+    deps = stage_graph(stages)
+    cpus = cpus or os.cpu_count() or 1
+    pending = {s.name: s for s in stages}
+    running: dict[Future, Stage] = {}
+    records: dict[str, dict[str, Any]] = {}
+    errors: dict[str, str] = {}
+    failed: Optional[BaseException] = None
+    used = 0
+    started = time.time()
+
+    with ProcessPoolExecutor(max_workers=max(1, min(len(stages), cpus))) as pool:
+        while running or (pending and failed is None):
+            if failed is None:
+                # Ready stages start in declaration order while their thread
+                # budget fits; an oversized stage still runs when nothing else is.
+                for stage in [s for s in pending.values() if deps[s.name] <= records.keys()]:
+                    threads = max(1, min(stage.threads, cpus))
+                    if running and used + threads > cpus:
+                        continue
+                    stage.threads = threads
+                    running[pool.submit(_run_stage, stage, cache)] = stage
+                    used += threads
+                    del pending[stage.name]
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                used -= stage.threads
+                try:
+                    record = future.result()
+                except BaseException as exc:
+                    # Running stages finish, nothing new starts, and the error is re-raised after the report.
+                    failed = failed or exc
+                    errors[stage.name] = f"{type(exc).__name__}: {exc}"
+                    continue
+                record.update(name=stage.name, threads=stage.threads, deps=sorted(deps[stage.name]))
+                records[stage.name] = record
+
+    wall = time.time() - started
+    if cache is not None:
+        cache.evict()
+    seconds = {name: r["seconds"] for name, r in records.items()}
+    path, path_seconds = _critical_path({n: d for n, d in deps.items() if n in records}, seconds)
+    for record in records.values():
+        record["start_offset"] = record.pop("started") - started
+    report = {
+        "cpus": cpus,
+        "wall_seconds": wall,
+        "serial_seconds": sum(seconds.values()),
+        "critical_path": path,
+        "critical_path_seconds": path_seconds,
+        "stages": [records[s.name] for s in stages if s.name in records],
+        "failed": errors,
+        "not_run": sorted(pending),
+    }
+    if report_path:
+        os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if failed is not None:
+        raise failed
+    return report
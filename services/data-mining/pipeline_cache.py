@@ -0,0 +1,210 @@
+import ast
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
+
+
+def fingerprint_file(path: str, mode: str = "stat") -> str:
+    if os.path.isdir(path):
+        parts = []
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                parts.append(f"{os.path.relpath(full, path)}={fingerprint_file(full, mode)}")
+        return hashlib.blake2b("\n".join(parts).encode("utf-8"), digest_size=16).hexdigest()
+
+    if mode == "content":
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+    if mode == "stat":
+        st = os.stat(path)
+        return f"{st.st_size}:{st.st_mtime_ns}"
+    raise ValueError(f"Unknown fingerprint mode: {mode}")
+
+
+def local_sources(script: str) -> list[str]:
+    # The script plus every module it imports (transitively) from its own
+    # directory, so edits to shared helpers also invalidate cached stages.
+    base_dir = os.path.dirname(os.path.abspath(script))
+    seen: set[str] = set()
+    todo = [os.path.abspath(script)]
+    while todo:
+        path = todo.pop()
+        if path in seen:
+            continue
+        seen.add(path)
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                candidate = os.path.join(base_dir, name.split(".")[0] + ".py")
+                if os.path.isfile(candidate):
+                    todo.append(candidate)
+    return sorted(seen)
+
+
+def _path_size(path: str) -> int:
+    if os.path.isdir(path):
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                total += os.path.getsize(os.path.join(root, name))
+        return total
+    return os.path.getsize(path)
+
+
+def _copy(src: str, dst: str) -> None:
+    parent = os.path.dirname(dst)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    if os.path.isdir(src):
+        if os.path.isdir(dst):
+            shutil.rmtree(dst)
+        shutil.copytree(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+
+class StageCache:
+    # Safe to share between processes: restores hold a shared lock on
+    # <cache_dir>/.lock, while swapping an entry in and evicting hold it
+    # exclusively, so an entry is never removed while it is being copied out.
+    def __init__(self, cache_dir: str, max_bytes: int = 2 << 30, mode: str = "stat"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.mode = mode
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, name: str, inputs: list[str], params: dict[str, Any], outputs: list[str]) -> str:
+        payload = {
+            "stage": name,
+            "inputs": {os.path.abspath(p): fingerprint_file(p, self.mode) for p in inputs},
+            "params": params,
+            "outputs": [os.path.abspath(p) for p in outputs],
+        }
+        raw = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(raw).hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    @contextmanager
+    def _locked(self, shared: bool = False) -> Iterator[None]:
+        with open(os.path.join(self.cache_dir, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_manifest(self, key: str) -> Optional[dict[str, Any]]:
+        path = os.path.join(self._entry_dir(key), "manifest.json")
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def run(
+        self,
+        name: str,
+        inputs: list[str],
+        params: dict[str, Any],
+        outputs: list[str],
+        fn: Callable[[], Any],
+        evict: bool = True,
+    ) -> bool:
+        # Pass evict=False when other workers share the cache and call evict()
+        # once they are done (see run_pipeline).
+        key = self.key(name, inputs, params, outputs)
+        entry = self._entry_dir(key)
+        manifest = self._read_manifest(key)
+        if manifest is not None:
+            with self._locked(shared=True):
+                if self._restore(entry, manifest):
+                    os.utime(os.path.join(entry, "manifest.json"))
+                    return True
+
+        fn()
+        self._store(name, key, outputs)
+        if evict:
+            self.evict()
+        return False
+
+    def _restore(self, entry: str, manifest: dict[str, Any]) -> bool:
+        for out in manifest["outputs"]:
+            if not os.path.exists(os.path.join(entry, out["stored"])):
+                return False
+        for out in manifest["outputs"]:
+            path = out["path"]
+            if os.path.exists(path) and fingerprint_file(path, "stat") == out["fingerprint"]:
+                continue
+            _copy(os.path.join(entry, out["stored"]), path)
+        return True
+
+    def _store(self, name: str, key: str, outputs: list[str]) -> None:
+        entry = self._entry_dir(key)
+        tmp = f"{entry}.tmp-{os.getpid()}"
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+
+        records = []
+        size = 0
+        for i, path in enumerate(outputs):
+            stored = f"{i}_{os.path.basename(os.path.normpath(path))}"
+            _copy(path, os.path.join(tmp, stored))
+            records.append(
+                {
+                    "path": os.path.abspath(path),
+                    "stored": stored,
+                    "fingerprint": fingerprint_file(path, "stat"),
+                }
+            )
+            size += _path_size(path)
+
+        manifest = {"stage": name, "key": key, "outputs": records, "size": size, "created_at": time.time()}
+        with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        with self._locked():
+            if os.path.isdir(entry):
+                shutil.rmtree(entry)
+            os.replace(tmp, entry)
+
+    def evict(self) -> list[str]:
+        with self._locked():
+            entries = []
+            for key in os.listdir(self.cache_dir):
+                manifest_path = os.path.join(self.cache_dir, key, "manifest.json")
+                manifest = self._read_manifest(key)
+                # Skip entries another process is still writing.
+                if manifest is None or ".tmp-" in key:
+                    continue
+                entries.append((os.path.getmtime(manifest_path), key, int(manifest.get("size", 0))))
+
+            total = sum(size for _, _, size in entries)
+            removed: list[str] = []
+            for _, key, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                total -= size
+                removed.append(key)
+        return removed
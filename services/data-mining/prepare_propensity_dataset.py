@@ -1,9 +1,31 @@
 import argparse
 import csv
+import itertools
 import math
 import os
+import tempfile
+import zlib
 from collections import defaultdict
+from collections.abc import Iterator
+from dataclasses import dataclass, replace
 from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+import instrument
+
+
+FIELDNAMES = [
+    "user_id",
+    "cutoff_at",
+    "recency_days",
+    "order_count",
+    "total_amount",
+    "avg_order_value",
+    "category_diversity",
+    "log_total_amount",
+    "log_order_count",
+    "label_purchase_in_window",
+]
 
 
 def _parse_dt(value: str) -> datetime:
@@ -28,6 +50,81 @@ def _write_csv(path: str, fieldnames: list[str], rows: list[dict[str, object]])
         writer.writerows(rows)
 
 
+def _iter_chunks(path: str, chunk_rows: int) -> Iterator[list[dict[str, str]]]:
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        while True:
+            chunk = list(itertools.islice(reader, chunk_rows))
+            if not chunk:
+                return
+            yield chunk
+
+
+def _feature_row(
+    uid: str,
+    cutoff: datetime,
+    last_time: datetime,
+    order_count: int,
+    total_amount: float,
+    category_diversity: int,
+    label: int,
+) -> dict[str, object]:
+    recency_days = max(0.0, (cutoff - last_time).total_seconds() / 86400.0)
+    freq = float(order_count)
+    monetary = float(total_amount)
+    avg_order_value = monetary / freq if freq > 0 else 0.0
+    return {
+        "user_id": uid,
+        "cutoff_at": cutoff.isoformat(),
+        "recency_days": f"{recency_days:.6f}",
+        "order_count": f"{freq:.6f}",
+        "total_amount": f"{monetary:.6f}",
+        "avg_order_value": f"{avg_order_value:.6f}",
+        "category_diversity": f"{float(category_diversity):.6f}",
+        "log_total_amount": f"{math.log1p(monetary):.6f}",
+        "log_order_count": f"{math.log1p(freq):.6f}",
+        "label_purchase_in_window": str(label),
+    }
+
+
+@dataclass
+class UserAggregate:
+    last_time: Optional[datetime] = None
+    order_count: int = 0
+    total_amount: float = 0.0
+    category_bits: int = 0
+    orders_after: int = 0
+
+    def add_order(self, ts: datetime, amount: float, cutoff: Optional[datetime] = None) -> None:
+        if cutoff is not None and ts > cutoff:
+            self.orders_after += 1
+            return
+        self.order_count += 1
+        self.total_amount += amount
+        if self.last_time is None or ts > self.last_time:
+            self.last_time = ts
+
+    def merge(self, other: "UserAggregate") -> None:
+        if other.last_time is not None and (self.last_time is None or other.last_time > self.last_time):
+            self.last_time = other.last_time
+        self.order_count += other.order_count
+        self.total_amount += other.total_amount
+        self.category_bits |= other.category_bits
+        self.orders_after += other.orders_after
+
+    def to_row(self, uid: str, cutoff: datetime) -> dict[str, object]:
+        assert self.last_time is not None
+        return _feature_row(
+            uid=uid,
+            cutoff=cutoff,
+            last_time=self.last_time,
+            order_count=self.order_count,
+            total_amount=self.total_amount,
+            category_diversity=self.category_bits.bit_count(),
+            label=1 if self.orders_after > 0 else 0,
+        )
+
+
 def build_dataset(
     users_csv: str,
     products_csv: str,
@@ -37,10 +134,12 @@ def build_dataset(
     label_window_days: int,
     min_history_orders: int,
 ) -> dict[str, str]:
+    watch = instrument.stopwatch()
     users = _read_csv(users_csv)
     products = _read_csv(products_csv)
     orders = _read_csv(orders_csv)
     order_items = _read_csv(order_items_csv)
+    watch.lap("read", rows=len(users) + len(products) + len(orders) + len(order_items))
 
     product_category: dict[str, str] = {p["product_id"]: p["category"] for p in products}
     order_time: dict[str, datetime] = {o["order_id"]: _parse_dt(o["created_at"]) for o in orders}
@@ -80,46 +179,21 @@ def build_dataset(
         if len(oids) < min_history_orders:
             continue
 
-        times = [order_time[oid] for oid in oids]
-        last_time = max(times)
-        recency_days = max(0.0, (cutoff - last_time).total_seconds() / 86400.0)
-
-        freq = float(len(oids))
-        monetary = float(sum(order_total[oid] for oid in oids))
-        avg_order_value = monetary / freq if freq > 0 else 0.0
-        category_diversity = float(len(user_categories_before.get(uid, set())))
-        log_monetary = math.log1p(monetary)
-        log_freq = math.log1p(freq)
-        label = 1 if len(user_orders_after.get(uid, [])) > 0 else 0
-
         rows.append(
-            {
-                "user_id": uid,
-                "cutoff_at": cutoff.isoformat(),
-                "recency_days": f"{recency_days:.6f}",
-                "order_count": f"{freq:.6f}",
-                "total_amount": f"{monetary:.6f}",
-                "avg_order_value": f"{avg_order_value:.6f}",
-                "category_diversity": f"{category_diversity:.6f}",
-                "log_total_amount": f"{log_monetary:.6f}",
-                "log_order_count": f"{log_freq:.6f}",
-                "label_purchase_in_window": str(label),
-            }
+            _feature_row(
+                uid=uid,
+                cutoff=cutoff,
+                last_time=max(order_time[oid] for oid in oids),
+                order_count=len(oids),
+                total_amount=sum(order_total[oid] for oid in oids),
+                category_diversity=len(user_categories_before.get(uid, set())),
+                label=1 if len(user_orders_after.get(uid, [])) > 0 else 0,
+            )
         )
+    watch.lap("transform", rows=len(orders) + len(order_items))
 
-    fieldnames = [
-        "user_id",
-        "cutoff_at",
-        "recency_days",
-        "order_count",
-        "total_amount",
-        "avg_order_value",
-        "category_diversity",
-        "log_total_amount",
-        "log_order_count",
-        "label_purchase_in_window",
-    ]
-    _write_csv(out_csv, fieldnames, rows)
+    _write_csv(out_csv, FIELDNAMES, rows)
+    watch.lap("write", rows=len(rows))
 
     return {
         "cutoff_at": cutoff.isoformat(),
@@ -127,6 +201,322 @@ def build_dataset(
     }
 
 
+# Spill files open at once; buckets holding more than chunk_rows orders are
+# split again rather than adding files, so this also bounds file handles.
+SPILL_BUCKETS = 64
+
+
+def _bucket_of(order_id: str, buckets: int, level: int = 0) -> int:
+    # Each level of re-splitting uses the next base-`buckets` digit of the hash.
+    return (zlib.crc32(order_id.encode("utf-8")) // buckets**level) % buckets
+
+
+def _split_spill(path: str, buckets: int, level: int) -> tuple[list[str], list[int]]:
+    paths = [f"{path}.{b}" for b in range(buckets)]
+    counts = [0] * buckets
+    files = [open(p, "w", newline="", encoding="utf-8") for p in paths]
+    try:
+        writers = [csv.writer(f) for f in files]
+        with open(path, newline="", encoding="utf-8") as src:
+            for row in csv.reader(src):
+                b = _bucket_of(row[0], buckets, level)
+                writers[b].writerow(row)
+                counts[b] += 1
+    finally:
+        for f in files:
+            f.close()
+    os.remove(path)
+    return paths, counts
+
+
+def _merge_spill(
+    order_path: str,
+    item_path: str,
+    order_rows: int,
+    chunk_rows: int,
+    buckets: int,
+    level: int,
+    aggregates: dict[str, UserAggregate],
+) -> None:
+    if order_rows == 0:
+        return
+    if order_rows > chunk_rows and buckets > 1 and buckets**level < 2**32:
+        order_parts, counts = _split_spill(order_path, buckets, level)
+        item_parts, _ = _split_spill(item_path, buckets, level)
+        for part_orders, part_items, rows in zip(order_parts, item_parts, counts):
+            _merge_spill(part_orders, part_items, rows, chunk_rows, buckets, level + 1, aggregates)
+        return
+
+    with open(order_path, newline="", encoding="utf-8") as f:
+        bucket_user = {oid: uid for oid, uid in csv.reader(f)}
+    with open(item_path, newline="", encoding="utf-8") as f:
+        for oid, bit in csv.reader(f):
+            uid = bucket_user.get(oid)
+            if uid is not None:
+                aggregates[uid].category_bits |= int(bit)
+
+
+def build_dataset_chunked(
+    users_csv: str,
+    products_csv: str,
+    orders_csv: str,
+    order_items_csv: str,
+    out_csv: str,
+    label_window_days: int,
+    min_history_orders: int,
+    chunk_rows: int,
+    spill_buckets: int = SPILL_BUCKETS,
+) -> dict[str, str]:
+    chunk_rows = max(1, int(chunk_rows))
+    watch = instrument.stopwatch()
+
+    category_bit: dict[str, int] = {}
+    product_bits: dict[str, int] = {}
+    for chunk in _iter_chunks(products_csv, chunk_rows):
+        for p in chunk:
+            cat = p["category"]
+            if not cat:
+                continue
+            bit = category_bit.setdefault(cat, 1 << len(category_bit))
+            product_bits[p["product_id"]] = bit
+    watch.lap("read_products", rows=len(product_bits))
+
+    max_time: Optional[datetime] = None
+    order_rows = 0
+    for chunk in _iter_chunks(orders_csv, chunk_rows):
+        order_rows += len(chunk)
+        chunk_max = max(_parse_dt(o["created_at"]) for o in chunk)
+        if max_time is None or chunk_max > max_time:
+            max_time = chunk_max
+    if max_time is None:
+        max_time = datetime.now(timezone.utc)
+    cutoff = max_time - timedelta(days=label_window_days)
+    watch.lap("scan_orders", rows=order_rows)
+    spill_buckets = max(1, int(spill_buckets))
+
+    aggregates: dict[str, UserAggregate] = {}
+    with tempfile.TemporaryDirectory(prefix="propensity_spill_") as spill_dir:
+        order_paths = [os.path.join(spill_dir, f"orders_{b}.csv") for b in range(spill_buckets)]
+        item_paths = [os.path.join(spill_dir, f"items_{b}.csv") for b in range(spill_buckets)]
+
+        order_counts = [0] * spill_buckets
+        order_files = [open(path, "w", newline="", encoding="utf-8") for path in order_paths]
+        try:
+            order_writers = [csv.writer(f) for f in order_files]
+            for chunk in _iter_chunks(orders_csv, chunk_rows):
+                partial: dict[str, UserAggregate] = defaultdict(UserAggregate)
+                for o in chunk:
+                    oid = o["order_id"]
+                    uid = o["user_id"]
+                    ts = _parse_dt(o["created_at"])
+                    partial[uid].add_order(ts, float(o["total_amount"]), cutoff)
+                    if ts <= cutoff:
+                        b = _bucket_of(oid, spill_buckets)
+                        order_writers[b].writerow((oid, uid))
+                        order_counts[b] += 1
+                for uid, agg in partial.items():
+                    current = aggregates.get(uid)
+                    if current is None:
+                        aggregates[uid] = agg
+                    else:
+                        current.merge(agg)
+        finally:
+            for f in order_files:
+                f.close()
+        watch.lap("aggregate_orders", rows=order_rows)
+
+        item_files = [open(path, "w", newline="", encoding="utf-8") for path in item_paths]
+        try:
+            item_writers = [csv.writer(f) for f in item_files]
+            item_rows = 0
+            for chunk in _iter_chunks(order_items_csv, chunk_rows):
+                item_rows += len(chunk)
+                for it in chunk:
+                    bit = product_bits.get(it["product_id"])
+                    if bit:
+                        oid = it["order_id"]
+                        item_writers[_bucket_of(oid, spill_buckets)].writerow((oid, bit))
+        finally:
+            for f in item_files:
+                f.close()
+        watch.lap("spill_items", rows=item_rows)
+
+        # Each merge holds at most about chunk_rows orders in memory.
+        for order_path, item_path, bucket_rows in zip(order_paths, item_paths, order_counts):
+            _merge_spill(order_path, item_path, bucket_rows, chunk_rows, spill_buckets, 1, aggregates)
+        watch.lap("merge_buckets", rows=item_rows)
+
+    parent = os.path.dirname(out_csv)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    rows = 0
+    with open(out_csv, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        for chunk in _iter_chunks(users_csv, chunk_rows):
+            for u in chunk:
+                uid = u["user_id"]
+                agg = aggregates.get(uid)
+                if agg is None or agg.last_time is None or agg.order_count < min_history_orders:
+                    continue
+                writer.writerow(agg.to_row(uid, cutoff))
+                rows += 1
+    watch.lap("write", rows=rows)
+
+    return {
+        "cutoff_at": cutoff.isoformat(),
+        "rows": str(rows),
+    }
+
+
+def rolling_cutoffs(
+    max_time: datetime, label_window_days: int, every_days: int, count: int
+) -> list[datetime]:
+    last = max_time - timedelta(days=label_window_days)
+    return [last - timedelta(days=every_days * k) for k in reversed(range(max(1, count)))]
+
+
+def build_snapshots(
+    users_csv: str,
+    products_csv: str,
+    orders_csv: str,
+    order_items_csv: str,
+    out_csv: str,
+    label_window_days: int,
+    min_history_orders: int,
+    cutoffs: Optional[list[datetime]] = None,
+    cutoff_every_days: int = 30,
+    cutoff_count: int = 1,
+) -> dict[str, str]:
+    watch = instrument.stopwatch()
+    users = _read_csv(users_csv)
+    products = _read_csv(products_csv)
+    orders = _read_csv(orders_csv)
+    order_items = _read_csv(order_items_csv)
+    watch.lap("read", rows=len(users) + len(products) + len(orders) + len(order_items))
+
+    category_bit: dict[str, int] = {}
+    product_bits: dict[str, int] = {}
+    for p in products:
+        if p["category"]:
+            product_bits[p["product_id"]] = category_bit.setdefault(p["category"], 1 << len(category_bit))
+
+    order_bits: dict[str, int] = defaultdict(int)
+    for it in order_items:
+        order_bits[it["order_id"]] |= product_bits.get(it["product_id"], 0)
+
+    timeline = sorted(
+        ((_parse_dt(o["created_at"]), o["user_id"], o["order_id"], float(o["total_amount"])) for o in orders),
+        key=lambda x: x[0],
+    )
+    max_time = timeline[-1][0] if timeline else datetime.now(timezone.utc)
+
+    window = timedelta(days=label_window_days)
+    if cutoffs is None:
+        cutoffs = rolling_cutoffs(max_time, label_window_days, cutoff_every_days, cutoff_count)
+    cutoffs = sorted(set(cutoffs))
+    for c in cutoffs:
+        if c + window > max_time:
+            raise ValueError(
+                f"Label window of cutoff {c.isoformat()} ends after the last order {max_time.isoformat()}."
+            )
+
+    aggregates: dict[str, UserAggregate] = {}
+    snapshots: list[tuple[datetime, dict[str, UserAggregate]]] = []
+    next_cutoff = 0
+    open_from = 0
+
+    def take_snapshot(cutoff: datetime) -> None:
+        state = {
+            uid: replace(agg)
+            for uid, agg in aggregates.items()
+            if agg.order_count >= min_history_orders
+        }
+        snapshots.append((cutoff, state))
+
+    for ts, uid, oid, amount in timeline:
+        while next_cutoff < len(cutoffs) and cutoffs[next_cutoff] < ts:
+            take_snapshot(cutoffs[next_cutoff])
+            next_cutoff += 1
+        while open_from < len(snapshots) and snapshots[open_from][0] + window < ts:
+            open_from += 1
+        for cutoff, state in snapshots[open_from:]:
+            labelled = state.get(uid)
+            if labelled is not None:
+                labelled.orders_after += 1
+
+        agg = aggregates.get(uid)
+        if agg is None:
+            agg = aggregates[uid] = UserAggregate()
+        agg.add_order(ts, amount)
+        agg.category_bits |= order_bits.get(oid, 0)
+
+    while next_cutoff < len(cutoffs):
+        take_snapshot(cutoffs[next_cutoff])
+        next_cutoff += 1
+    watch.lap("transform", rows=len(orders) + len(order_items))
+
+    rows: list[dict[str, object]] = []
+    for cutoff, state in snapshots:
+        for u in users:
+            agg = state.get(u["user_id"])
+            if agg is None or agg.last_time is None:
+                continue
+            rows.append(agg.to_row(u["user_id"], cutoff))
+
+    _write_csv(out_csv, FIELDNAMES, rows)
+    watch.lap("write", rows=len(rows))
+
+    return {
+        "cutoffs": ",".join(c.isoformat() for c, _ in snapshots),
+        "rows": str(len(rows)),
+    }
+
+
+def _run(parser: argparse.ArgumentParser, args: argparse.Namespace) -> None:
+    cutoffs = [_parse_dt(x.strip()) for x in args.cutoffs.split(",") if x.strip()]
+    if cutoffs or args.cutoff_count > 1:
+        if args.chunk_rows > 0:
+            parser.error("--chunk_rows cannot be combined with --cutoffs / --cutoff_count.")
+        build_snapshots(
+            users_csv=args.users_csv,
+            products_csv=args.products_csv,
+            orders_csv=args.orders_csv,
+            order_items_csv=args.order_items_csv,
+            out_csv=args.out_csv,
+            label_window_days=args.label_window_days,
+            min_history_orders=args.min_history_orders,
+            cutoffs=cutoffs or None,
+            cutoff_every_days=args.cutoff_every_days,
+            cutoff_count=args.cutoff_count,
+        )
+        return
+
+    if args.chunk_rows > 0:
+        build_dataset_chunked(
+            users_csv=args.users_csv,
+            products_csv=args.products_csv,
+            orders_csv=args.orders_csv,
+            order_items_csv=args.order_items_csv,
+            out_csv=args.out_csv,
+            label_window_days=args.label_window_days,
+            min_history_orders=args.min_history_orders,
+            chunk_rows=args.chunk_rows,
+            spill_buckets=args.spill_buckets,
+        )
+        return
+
+    build_dataset(
+        users_csv=args.users_csv,
+        products_csv=args.products_csv,
+        orders_csv=args.orders_csv,
+        order_items_csv=args.order_items_csv,
+        out_csv=args.out_csv,
+        label_window_days=args.label_window_days,
+        min_history_orders=args.min_history_orders,
+    )
+
+
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("--users_csv", default="services/data-mining/data/raw/users.csv")
@@ -136,17 +526,17 @@ def main() -> None:
     parser.add_argument("--out_csv", default="services/data-mining/data/processed/propensity_dataset.csv")
     parser.add_argument("--label_window_days", type=int, default=30)
     parser.add_argument("--min_history_orders", type=int, default=2)
+    parser.add_argument("--chunk_rows", type=int, default=0)
+    parser.add_argument("--spill_buckets", type=int, default=SPILL_BUCKETS)
+    parser.add_argument("--cutoffs", default="")
+    parser.add_argument("--cutoff_every_days", type=int, default=30)
+    parser.add_argument("--cutoff_count", type=int, default=1)
+    instrument.add_args(parser)
     args = parser.parse_args()
 
-    build_dataset(
-        users_csv=args.users_csv,
-        products_csv=args.products_csv,
-        orders_csv=args.orders_csv,
-        order_items_csv=args.order_items_csv,
-        out_csv=args.out_csv,
-        label_window_days=args.label_window_days,
-        min_history_orders=args.min_history_orders,
-    )
+    profile_json = os.path.splitext(args.out_csv)[0] + ".profile.json"
+    with instrument.session("prepare_propensity_dataset", profile_json, args.profile, args.profile_interval_ms):
+        _run(parser, args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,29 @@
+import torch
+
+
+def block_topk(
+    user_block: torch.Tensor,
+    item_emb: torch.Tensor,
+    seen_rows: torch.Tensor,
+    seen_cols: torch.Tensor,
+    k: int,
+    item_block: int,
+) -> tuple[torch.Tensor, torch.Tensor]:
+    n_users = user_block.shape[0]
+    item_block = max(1, int(item_block))
+    best_scores = torch.full((n_users, k), float("-inf"))
+    best_items = torch.full((n_users, k), -1, dtype=torch.int64)
+    for lo in range(0, item_emb.shape[0], item_block):
+        hi = min(lo + item_block, item_emb.shape[0])
+        scores = user_block @ item_emb[lo:hi].T
+        in_block = (seen_cols >= lo) & (seen_cols < hi)
+        scores[seen_rows[in_block], seen_cols[in_block] - lo] = float("-inf")
+
+        block_scores, block_items = scores.topk(min(k, hi - lo), dim=1)
+        merged_scores = torch.cat([best_scores, block_scores], dim=1)
+        merged_items = torch.cat([best_items, block_items + lo], dim=1)
+        best_scores, pos = merged_scores.topk(k, dim=1)
+        best_items = merged_items.gather(1, pos)
+
+    best_items[torch.isinf(best_scores)] = -1
+    return best_items, best_scores
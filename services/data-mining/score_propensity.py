@@ -0,0 +1,135 @@
+import argparse
+import os
+import time
+from collections.abc import Iterator
+
+import joblib
+import numpy as np
+import pandas as pd
+import torch
+
+from train_propensity_dl import FEATURES as DL_FEATURES
+from train_propensity_dl import MLP
+from train_propensity_ml import FEATURES as ML_FEATURES
+
+
+class PropensityScorer:
+    def __init__(self, artifact_path: str, threads: int = 0):
+        if threads > 0:
+            torch.set_num_threads(threads)
+        self.artifact_path = artifact_path
+
+        if artifact_path.endswith(".joblib"):
+            self.kind = "ml"
+            self.pipeline = joblib.load(artifact_path)
+            self.features = list(ML_FEATURES)
+        elif artifact_path.endswith(".pt"):
+            self.kind = "dl"
+            ckpt = torch.load(artifact_path, map_location="cpu", weights_only=False)
+            state = ckpt["state_dict"]
+            hidden, in_dim = state["net.0.weight"].shape
+            self.features = list(ckpt.get("features", DL_FEATURES))
+            self.mean = np.asarray(ckpt["mean"], dtype=np.float32).reshape(-1)
+            self.std = np.asarray(ckpt["std"], dtype=np.float32).reshape(-1)
+            self.model = MLP(in_dim=int(in_dim), hidden=int(hidden), dropout=0.0)
+            self.model.load_state_dict(state)
+            self.model.eval()
+        else:
+            raise ValueError(f"Unsupported model artifact: {artifact_path}")
+
+    def score(self, x: np.ndarray) -> np.ndarray:
+        if self.kind == "ml":
+            x = np.clip(x.astype(np.float64), -1_000_000.0, 1_000_000.0)
+            return self.pipeline.predict_proba(x)[:, 1].astype(np.float32)
+
+        xt = torch.from_numpy(((x - self.mean) / self.std).astype(np.float32))
+        with torch.inference_mode():
+            return torch.sigmoid(self.model(xt)).numpy()
+
+
+def _iter_feature_batches(features_csv: str, features: list[str], batch_rows: int) -> Iterator[pd.DataFrame]:
+    dtypes = {f: np.float64 for f in features}
+    dtypes["user_id"] = str
+    yield from pd.read_csv(
+        features_csv,
+        usecols=["user_id", *features],
+        dtype=dtypes,
+        chunksize=max(1, int(batch_rows)),
+    )
+
+
+class _ScoreWriter:
+    def __init__(self, out_path: str):
+        parent = os.path.dirname(out_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self.out_path = out_path
+        self.parquet = out_path.endswith(".parquet")
+        self._writer = None
+        self._header = True
+
+    def write(self, user_ids: np.ndarray, scores: np.ndarray) -> None:
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.table({"user_id": pa.array(user_ids, type=pa.string()), "score": scores})
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.out_path, table.schema, compression="zstd")
+            self._writer.write_table(table)
+            return
+
+        frame = pd.DataFrame({"user_id": user_ids, "score": scores})
+        frame.to_csv(self.out_path, mode="w" if self._header else "a", header=self._header, index=False)
+        self._header = False
+
+    def close(self) -> None:
+        if self._writer is None and (self.parquet or self._header):
+            self.write(np.array([], dtype=object), np.array([], dtype=np.float32))
+        if self._writer is not None:
+            self._writer.close()
+
+
+def score_file(
+    model_path: str,
+    features_csv: str,
+    out_path: str,
+    batch_rows: int,
+    threads: int = 0,
+) -> dict[str, float]:
+    started = time.perf_counter()
+    scorer = PropensityScorer(model_path, threads=threads)
+    writer = _ScoreWriter(out_path)
+    rows = 0
+    try:
+        for batch in _iter_feature_batches(features_csv, scorer.features, batch_rows):
+            x = batch[scorer.features].replace([np.inf, -np.inf], np.nan).fillna(0).to_numpy()
+            writer.write(batch["user_id"].to_numpy(), scorer.score(x))
+            rows += len(batch)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    return {"rows": float(rows), "seconds": elapsed, "rows_per_sec": rows / elapsed if elapsed > 0 else 0.0}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="services/data-mining/artifacts/propensity_ml/propensity_ml.joblib")
+    parser.add_argument("--features_csv", default="services/data-mining/data/processed/propensity_dataset.csv")
+    parser.add_argument("--out", default="services/data-mining/data/processed/propensity_scores.parquet")
+    parser.add_argument("--batch_rows", type=int, default=500_000)
+    parser.add_argument("--threads", type=int, default=0)
+    args = parser.parse_args()
+
+    score_file(
+        model_path=args.model,
+        features_csv=args.features_csv,
+        out_path=args.out,
+        batch_rows=args.batch_rows,
+        threads=args.threads,
+    )
+
+
+if __name__ == "__main__":
+    main()
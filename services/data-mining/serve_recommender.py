@@ -0,0 +1,344 @@
+import argparse
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from interactions import csr_from_pairs, load_interactions
+from mf_artifact import IdIndex, load_mf
+
+
+# Below this catalog size one blocked matmul beats probing inverted lists.
+IVF_MIN_ITEMS = 50_000
+# Items scored per matmul in exact search, so memory stays batch x block.
+EXACT_ITEM_BLOCK = 65_536
+
+
+def load_purchased(
+    orders_csv: Optional[str],
+    order_items_csv: Optional[str],
+    users: IdIndex,
+    items: IdIndex,
+    cache_dir: Optional[str] = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    if not (orders_csv and order_items_csv):
+        return np.zeros(len(users) + 1, dtype=np.int64), np.empty(0, dtype=np.int64)
+    rows, cols, _ = load_interactions(orders_csv, order_items_csv, cache_dir=cache_dir).remap(users, items)
+    return csr_from_pairs(rows, cols, len(users))
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(scores.shape[:-1] + (0,), dtype=np.int64)
+    part = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=-1), axis=-1, kind="stable")
+    return np.take_along_axis(part, order, axis=-1)
+
+
+class IVFIndex:
+    def __init__(self, item_emb: np.ndarray, nlist: int, iters: int = 10, seed: int = 7):
+        n = item_emb.shape[0]
+        nlist = max(1, min(int(nlist), n))
+        rng = np.random.default_rng(seed)
+        # Spherical k-means: inner-product search cares about direction, and
+        # probing by query-centroid dot products matches that geometry.
+        unit = item_emb / np.maximum(np.linalg.norm(item_emb, axis=1, keepdims=True), 1e-12)
+        centroids = unit[rng.choice(n, size=nlist, replace=False)].copy()
+        for _ in range(iters):
+            assign = (unit @ centroids.T).argmax(axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, unit)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            nonempty = norms[:, 0] > 0
+            centroids[nonempty] = sums[nonempty] / norms[nonempty]
+        assign = (unit @ centroids.T).argmax(axis=1)
+
+        order = np.argsort(assign, kind="stable")
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.list_items = order.astype(np.int64)
+        self.list_vectors = np.ascontiguousarray(item_emb[order], dtype=np.float32)
+        self.offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=nlist), out=self.offsets[1:])
+
+    def probe(self, queries: np.ndarray, nprobe: int) -> np.ndarray:
+        nprobe = max(1, min(int(nprobe), self.centroids.shape[0]))
+        return _top_k(queries @ self.centroids.T, nprobe)
+
+    def search(
+        self, query: np.ndarray, probes: np.ndarray, k: int, exclude: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        spans = [(self.offsets[c], self.offsets[c + 1]) for c in probes.tolist()]
+        ids = np.concatenate([self.list_items[a:b] for a, b in spans])
+        scores = np.concatenate([self.list_vectors[a:b] @ query for a, b in spans])
+        # Over-fetch by the number of excluded items so filtering them out
+        # afterwards still leaves k results whenever the lists hold enough.
+        top = _top_k(scores, k + exclude.size)
+        ids, scores = ids[top], scores[top]
+        if exclude.size:
+            keep = ~np.isin(ids, exclude)
+            ids, scores = ids[keep], scores[keep]
+        return ids[:k], scores[:k]
+
+
+class Recommender:
+    def __init__(
+        self,
+        artifact_dir: str,
+        orders_csv: Optional[str] = None,
+        order_items_csv: Optional[str] = None,
+        index: str = "auto",
+        nlist: int = 0,
+        nprobe: int = 8,
+        seed: int = 7,
+        cache_dir: Optional[str] = None,
+    ):
+        self.user_emb, self.item_emb, self.users, self.items = load_mf(artifact_dir)
+        n_items = len(self.items)
+
+        self.seen_indptr, self.seen_indices = load_purchased(
+            orders_csv, order_items_csv, self.users, self.items, cache_dir=cache_dir
+        )
+
+        self.nprobe = nprobe
+        self.index: Optional[IVFIndex] = None
+        if index == "auto":
+            index = "ivf" if n_items >= IVF_MIN_ITEMS else "exact"
+        if index == "ivf" and n_items > 0:
+            nlist = nlist or max(1, int(np.sqrt(n_items)))
+            self.index = IVFIndex(self.item_emb, nlist=nlist, seed=seed)
+
+    def _seen(self, u: int) -> np.ndarray:
+        return self.seen_indices[self.seen_indptr[u] : self.seen_indptr[u + 1]]
+
+    def _exact(self, users: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        queries = self.user_emb[users]
+        n_items = self.item_emb.shape[0]
+        k = max(0, min(k, n_items))
+        seen = [self._seen(u) for u in users.tolist()]
+        best_scores = np.full((len(users), k), -np.inf, dtype=np.result_type(queries, self.item_emb))
+        best_items = np.zeros((len(users), k), dtype=np.int64)
+        for lo in range(0, n_items, EXACT_ITEM_BLOCK):
+            hi = min(lo + EXACT_ITEM_BLOCK, n_items)
+            scores = queries @ self.item_emb[lo:hi].T
+            for row, cols in enumerate(seen):
+                scores[row, cols[(cols >= lo) & (cols < hi)] - lo] = -np.inf
+            top = _top_k(scores, k)
+            merged_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            merged_items = np.concatenate([best_items, top + lo], axis=1)
+            keep = _top_k(merged_scores, k)
+            best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+            best_items = np.take_along_axis(merged_items, keep, axis=1)
+        return best_items, best_scores
+
+    def recommend_idx(self, users: np.ndarray, k: int, exact: bool = False) -> list[tuple[np.ndarray, np.ndarray]]:
+        if self.index is None or exact:
+            top, scores = self._exact(users, k)
+            return [(t[np.isfinite(s)], s[np.isfinite(s)]) for t, s in zip(top, scores)]
+
+        queries = self.user_emb[users]
+        probes = self.index.probe(queries, self.nprobe)
+        out = [
+            self.index.search(queries[row], probes[row], k, self._seen(u)) for row, u in enumerate(users.tolist())
+        ]
+
+        short = [row for row, (items, _) in enumerate(out) if items.size < k]
+        if short:
+            for row, result in zip(short, self.recommend_idx(users[short], k, exact=True)):
+                out[row] = result
+        return out
+
+    def recommend(self, user_ids: list[str], k: int, exact: bool = False) -> list[list[dict[str, object]]]:
+        rows = self.users.lookup(user_ids)
+        known = np.flatnonzero(rows >= 0)
+        results: list[list[dict[str, object]]] = [[] for _ in user_ids]
+        if known.size == 0:
+            return results
+        for pos, (items, scores) in zip(known.tolist(), self.recommend_idx(rows[known], k, exact=exact)):
+            results[pos] = [
+                {"product_id": p, "score": float(s)} for p, s in zip(self.items.decode(items), scores.tolist())
+            ]
+        return results
+
+
+def benchmark(recommender: Recommender, k: int, batch_size: int, batches: int, seed: int) -> dict[str, object]:
+    rng = np.random.default_rng(seed)
+    n_users = len(recommender.users)
+    if n_users == 0:
+        raise ValueError("Cannot benchmark an artifact without users")
+    report: dict[str, object] = {"users": n_users, "items": len(recommender.items), "k": k, "batch_size": batch_size}
+    # Without an index recommend_idx falls back to exact search, so there are
+    # no IVF numbers to report (--index ivf forces one on small catalogs).
+    report["index"] = "exact" if recommender.index is None else "ivf"
+    modes = ("exact",) if recommender.index is None else ("exact", "ivf")
+    for mode in modes:
+        latencies = []
+        for _ in range(batches):
+            users = rng.integers(0, n_users, size=batch_size)
+            started = time.perf_counter()
+            recommender.recommend_idx(users, k, exact=mode == "exact")
+            latencies.append((time.perf_counter() - started) * 1000.0)
+        lat = np.asarray(latencies)
+        report[mode] = {
+            "p50_ms": float(np.percentile(lat, 50)),
+            "p95_ms": float(np.percentile(lat, 95)),
+            "p99_ms": float(np.percentile(lat, 99)),
+            "queries_per_sec": float(batch_size * batches / (lat.sum() / 1000.0)),
+        }
+
+    if recommender.index is None:
+        report["ivf"] = None
+        report["ivf_recall_at_k"] = None
+        return report
+
+    users = rng.integers(0, n_users, size=min(n_users, batch_size * batches))
+    approx = recommender.recommend_idx(users, k)
+    exact = recommender.recommend_idx(users, k, exact=True)
+    hits = 0
+    total = 0
+    for (approx_items, _), (truth, _) in zip(approx, exact):
+        hits += np.intersect1d(approx_items, truth).size
+        total += truth.size
+    report["ivf_recall_at_k"] = hits / total if total else float("nan")
+    return report
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def _parse_k(value: object) -> int:
+    if isinstance(value, bool):
+        raise BadRequest("k must be a positive integer")
+    try:
+        k = int(value)  # type: ignore[arg-type]
+    except (TypeError, ValueError):
+        raise BadRequest("k must be a positive integer") from None
+    if k < 1 or (isinstance(value, float) and value != k):
+        raise BadRequest("k must be a positive integer")
+    return k
+
+
+def _parse_user_ids(value: object) -> list[str]:
+    if not isinstance(value, list) or not all(
+        isinstance(u, (str, int)) and not isinstance(u, bool) for u in value
+    ):
+        raise BadRequest("user_ids must be a list of strings")
+    return [str(u) for u in value]
+
+
+def _handler(recommender: Recommender, default_k: int) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status: int, payload: object) -> None:
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _error(self, status: int, message: str) -> None:
+            self._send(status, {"error": message})
+
+        def _recommend(self, user_ids: list[str], k: int, exact: bool) -> None:
+            results = recommender.recommend(user_ids, k, exact=exact)
+            self._send(200, {"k": k, "results": [{"user_id": u, "items": r} for u, r in zip(user_ids, results)]})
+
+        def do_GET(self) -> None:
+            url = urlparse(self.path)
+            if url.path == "/health":
+                self._send(200, {"status": "ok"})
+                return
+            if url.path != "/recommend":
+                self._error(404, "Not found")
+                return
+            query = parse_qs(url.query)
+            try:
+                k = _parse_k(query.get("k", [default_k])[0])
+            except BadRequest as exc:
+                self._error(400, str(exc))
+                return
+            exact = query.get("exact", ["0"])[0] in ("1", "true")
+            self._recommend(query.get("user_id", []), k, exact)
+
+        def do_POST(self) -> None:
+            if urlparse(self.path).path != "/recommend":
+                self._error(404, "Not found")
+                return
+            try:
+                length = int(self.headers.get("content-length") or 0)
+            except ValueError:
+                length = -1
+            if length < 0:
+                self._error(400, "Invalid content-length")
+                self.close_connection = True
+                return
+            try:
+                body = json.loads(self.rfile.read(length) or b"{}")
+            except ValueError:
+                self._error(400, "Invalid JSON")
+                return
+            try:
+                if not isinstance(body, dict):
+                    raise BadRequest("Body must be a JSON object")
+                user_ids = _parse_user_ids(body.get("user_ids", []))
+                k = _parse_k(body.get("k", default_k))
+            except BadRequest as exc:
+                self._error(400, str(exc))
+                return
+            self._recommend(user_ids, k, bool(body.get("exact")))
+
+        def log_message(self, format: str, *args: object) -> None:
+            return
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--artifact_dir", default="services/data-mining/artifacts/recommender_mf")
+    parser.add_argument("--orders_csv", default="services/data-mining/data/raw/orders.csv")
+    parser.add_argument("--order_items_csv", default="services/data-mining/data/raw/order_items.csv")
+    parser.add_argument("--index", choices=["auto", "ivf", "exact"], default="auto")
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--mode", choices=["serve", "bench"], default="serve")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--bench_batch_size", type=int, default=64)
+    parser.add_argument("--bench_batches", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--cache_dir", default="services/data-mining/data/cache/interactions")
+    args = parser.parse_args()
+
+    recommender = Recommender(
+        artifact_dir=args.artifact_dir,
+        orders_csv=args.orders_csv,
+        order_items_csv=args.order_items_csv,
+        index=args.index,
+        nlist=args.nlist,
+        nprobe=args.nprobe,
+        seed=args.seed,
+        cache_dir=args.cache_dir,
+    )
+
+    if args.mode == "bench":
+        report = benchmark(
+            recommender, k=args.k, batch_size=args.bench_batch_size, batches=args.bench_batches, seed=args.seed
+        )
+        print(json.dumps(report, indent=2))
+        return
+
+    server = ThreadingHTTPServer((args.host, args.port), _handler(recommender, args.k))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("torch")
+
+from evaluate_recommender import evaluate  # noqa: E402
+
+
+def _artifact(tmp_path, **meta) -> str:
+    with open(tmp_path / "recommender_mf.meta.json", "w", encoding="utf-8") as f:
+        json.dump({"model_type": "matrix_factorization", **meta}, f)
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize(
+    "meta",
+    [
+        {"evaluation": None},
+        {"evaluation": {"holdout_orders": 0, "holdout_offset": 0}},
+        {"evaluation": None, "full_history": True},
+        {"evaluation": {"holdout_orders": 1, "holdout_offset": 0}, "full_history": True},
+    ],
+)
+def test_refuses_to_score_orders_the_artifact_was_trained_on(tmp_path, meta):
+    with pytest.raises(ValueError, match="trained on every order"):
+        evaluate(_artifact(tmp_path, **meta), "orders.csv", "order_items.csv", ks=[10])
+
+
+def test_rejects_an_empty_explicit_holdout(tmp_path):
+    artifact = _artifact(tmp_path, evaluation={"holdout_orders": 1, "holdout_offset": 0}, full_history=False)
+    with pytest.raises(ValueError, match="at least 1"):
+        evaluate(artifact, "orders.csv", "order_items.csv", ks=[10], holdout_orders=0)
@@ -0,0 +1,71 @@
+import os
+import resource
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+from generate_synthetic import Paths, generate
+from prepare_propensity_dataset import SPILL_BUCKETS, build_dataset
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prepare_propensity_dataset.py")
+
+
+@pytest.fixture
+def raw(tmp_path):
+    out = Paths(
+        users_csv=str(tmp_path / "users.csv"),
+        products_csv=str(tmp_path / "products.csv"),
+        orders_csv=str(tmp_path / "orders.csv"),
+        order_items_csv=str(tmp_path / "order_items.csv"),
+    )
+    end_at = datetime(2024, 6, 1, tzinfo=timezone.utc)
+    generate(out, users=500, products=50, orders=20_000, seed=7, days=180, end_at=end_at)
+    return out
+
+
+def _build(raw: Paths, out_csv: str, extra: list[str], nofile: int) -> None:
+    def limit_fds() -> None:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (nofile, nofile))
+
+    subprocess.run(
+        [
+            sys.executable,
+            SCRIPT,
+            "--users_csv",
+            raw.users_csv,
+            "--products_csv",
+            raw.products_csv,
+            "--orders_csv",
+            raw.orders_csv,
+            "--order_items_csv",
+            raw.order_items_csv,
+            "--out_csv",
+            out_csv,
+            *extra,
+        ],
+        check=True,
+        preexec_fn=limit_fds,
+    )
+
+
+def test_chunked_build_stays_under_a_low_fd_limit(raw, tmp_path):
+    expected = str(tmp_path / "expected.csv")
+    build_dataset(
+        users_csv=raw.users_csv,
+        products_csv=raw.products_csv,
+        orders_csv=raw.orders_csv,
+        order_items_csv=raw.order_items_csv,
+        out_csv=expected,
+        label_window_days=30,
+        min_history_orders=2,
+    )
+
+    # 20k orders in chunks of 50 would need 400 buckets of one chunk each;
+    # oversized buckets are split again instead, within SPILL_BUCKETS files.
+    chunked = str(tmp_path / "chunked.csv")
+    _build(raw, chunked, ["--chunk_rows", "50"], nofile=SPILL_BUCKETS * 2)
+
+    with open(expected, encoding="utf-8") as a, open(chunked, encoding="utf-8") as b:
+        assert a.read() == b.read()
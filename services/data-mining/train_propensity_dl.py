@@ -2,12 +2,18 @@ import argparse
 import hashlib
 import json
 import os
+import queue
+import threading
+from collections.abc import Callable, Iterator
+from typing import Optional
 
 import numpy as np
 import pandas as pd
 import torch
 from sklearn.metrics import accuracy_score, roc_auc_score
 
+import instrument
+
 
 FEATURES = [
     "recency_days",
@@ -50,6 +56,107 @@ class MLP(torch.nn.Module):
         return self.net(x).squeeze(-1)
 
 
+class TensorBatches:
+    def __init__(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        batch_size: int,
+        device: torch.device,
+        generator: torch.Generator,
+        prefetch: int = 0,
+    ):
+        self.pin = device.type == "cuda"
+        self.x = torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32))
+        self.y = torch.from_numpy(np.ascontiguousarray(y, dtype=np.float32))
+        if self.pin:
+            self.x = self.x.pin_memory()
+            self.y = self.y.pin_memory()
+        self.batch_size = max(1, int(batch_size))
+        self.device = device
+        self.generator = generator
+        self.prefetch = max(0, int(prefetch))
+        self._x = torch.empty_like(self.x, pin_memory=self.pin)
+        self._y = torch.empty_like(self.y, pin_memory=self.pin)
+
+    def __len__(self) -> int:
+        return (self.x.shape[0] + self.batch_size - 1) // self.batch_size
+
+    def _batches(self) -> Iterator[tuple[torch.Tensor, torch.Tensor]]:
+        perm = torch.randperm(self.x.shape[0], generator=self.generator)
+        if self.pin:
+            # Earlier non_blocking copies may still be reading the pinned buffers.
+            torch.cuda.current_stream(self.device).synchronize()
+        torch.index_select(self.x, 0, perm, out=self._x)
+        torch.index_select(self.y, 0, perm, out=self._y)
+        for start in range(0, self._x.shape[0], self.batch_size):
+            xb = self._x[start : start + self.batch_size]
+            yb = self._y[start : start + self.batch_size]
+            if self.pin:
+                xb = xb.to(self.device, non_blocking=True)
+                yb = yb.to(self.device, non_blocking=True)
+            yield xb, yb
+
+    def __iter__(self) -> Iterator[tuple[torch.Tensor, torch.Tensor]]:
+        if self.prefetch == 0:
+            yield from self._batches()
+            return
+
+        q: queue.Queue = queue.Queue(maxsize=self.prefetch)
+        done = object()
+        failure: list[BaseException] = []
+        # Set when the consumer stops early (break, exception, early stop) so
+        # the producer gives up instead of blocking on a full queue forever.
+        stop = threading.Event()
+
+        def offer(item: object) -> bool:
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce() -> None:
+            try:
+                for item in self._batches():
+                    if not offer(item):
+                        return
+            except BaseException as exc:
+                failure.append(exc)
+            finally:
+                offer(done)
+
+        worker = threading.Thread(target=produce, daemon=True)
+        worker.start()
+        try:
+            while True:
+                item = q.get()
+                if item is done:
+                    break
+                yield item
+        finally:
+            stop.set()
+            while True:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    break
+            worker.join()
+        if failure:
+            raise failure[0]
+
+
+def _evaluate(model: MLP, x_test: torch.Tensor, y_test: np.ndarray) -> dict[str, float]:
+    model.eval()
+    with torch.no_grad():
+        prob = torch.sigmoid(model(x_test)).cpu().numpy()
+    pred = (prob >= 0.5).astype(int)
+    auc = float(roc_auc_score(y_test, prob)) if len(np.unique(y_test)) > 1 else float("nan")
+    return {"auc": auc, "accuracy": float(accuracy_score(y_test, pred))}
+
+
 def train(
     dataset_csv: str,
     out_dir: str,
@@ -60,53 +167,61 @@ def train(
     lr: float,
     hidden: int,
     dropout: float,
+    prefetch: int = 0,
+    arrays: Optional[tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+    on_epoch: Optional[Callable[[int, dict[str, float]], bool]] = None,
 ) -> dict[str, float]:
     os.makedirs(out_dir, exist_ok=True)
-    rng = np.random.default_rng(seed)
     torch.manual_seed(seed)
+    generator = torch.Generator().manual_seed(seed)
+    watch = instrument.stopwatch()
 
-    df = pd.read_csv(dataset_csv)
-    df = df.replace([np.inf, -np.inf], np.nan).fillna(0)
-    y = df["label_purchase_in_window"].astype(int).to_numpy()
-    x = df[FEATURES].astype(float).to_numpy()
-    user_ids = df["user_id"].astype(str).tolist()
+    if arrays is None:
+        df = pd.read_csv(dataset_csv)
+        df = df.replace([np.inf, -np.inf], np.nan).fillna(0)
+        y = df["label_purchase_in_window"].astype(int).to_numpy()
+        x = df[FEATURES].astype(float).to_numpy()
+        is_test = split_mask(df["user_id"].astype(str).tolist(), test_ratio=test_ratio)
+    else:
+        x, y, is_test = arrays
+    watch.lap("read", rows=len(x))
 
-    is_test = split_mask(user_ids, test_ratio=test_ratio)
     x_train, x_test = x[~is_test], x[is_test]
     y_train, y_test = y[~is_test], y[is_test]
 
     mean = x_train.mean(axis=0, keepdims=True)
     std = x_train.std(axis=0, keepdims=True) + 1e-6
-    x_train = (x_train - mean) / std
-    x_test = (x_test - mean) / std
+    x_train = ((x_train - mean) / std).astype(np.float32)
+    x_test = ((x_test - mean) / std).astype(np.float32)
 
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     model = MLP(in_dim=x_train.shape[1], hidden=hidden, dropout=dropout).to(device)
     opt = torch.optim.AdamW(model.parameters(), lr=lr)
     loss_fn = torch.nn.BCEWithLogitsLoss()
 
-    x_train_t = torch.from_numpy(x_train).float()
-    y_train_t = torch.from_numpy(y_train).float()
-
-    n = x_train_t.shape[0]
-    for _ in range(epochs):
-        idx = rng.permutation(n)
-        for start in range(0, n, batch_size):
-            batch = idx[start : start + batch_size]
-            xb = x_train_t[batch].to(device)
-            yb = y_train_t[batch].to(device)
+    batches = TensorBatches(
+        x_train, y_train, batch_size=batch_size, device=device, generator=generator, prefetch=prefetch
+    )
+    xt_test = torch.from_numpy(x_test).to(device)
+    watch.lap("transform", rows=len(x))
+    for epoch in range(epochs):
+        model.train()
+        for xb, yb in batches:
             logits = model(xb)
             loss = loss_fn(logits, yb)
             opt.zero_grad(set_to_none=True)
             loss.backward()
             opt.step()
+        watch.lap("train_epoch", rows=len(x_train))
+        if on_epoch is not None and epoch + 1 < epochs:
+            stop = on_epoch(epoch + 1, _evaluate(model, xt_test, y_test))
+            watch.lap("evaluate")
+            if stop:
+                break
 
-    model.eval()
-    with torch.no_grad():
-        prob = torch.sigmoid(model(torch.from_numpy(x_test).float().to(device))).cpu().numpy()
-    pred = (prob >= 0.5).astype(int)
-    auc = float(roc_auc_score(y_test, prob)) if len(np.unique(y_test)) > 1 else float("nan")
-    acc = float(accuracy_score(y_test, pred))
+    metrics = _evaluate(model, xt_test, y_test)
+    watch.lap("evaluate", rows=len(x_test))
+    auc, acc = metrics["auc"], metrics["accuracy"]
 
     torch.save(
         {
@@ -133,6 +248,7 @@ def train(
     }
     with open(os.path.join(out_dir, "propensity_dl.meta.json"), "w", encoding="utf-8") as f:
         json.dump(meta, f, ensure_ascii=False, indent=2)
+    watch.lap("write")
 
     return {"auc": auc, "accuracy": acc}
 
@@ -148,19 +264,24 @@ def main() -> None:
     parser.add_argument("--lr", type=float, default=0.001)
     parser.add_argument("--hidden", type=int, default=64)
     parser.add_argument("--dropout", type=float, default=0.1)
+    parser.add_argument("--prefetch", type=int, default=0)
+    instrument.add_args(parser)
     args = parser.parse_args()
 
-    train(
-        dataset_csv=args.dataset_csv,
-        out_dir=args.out_dir,
-        test_ratio=args.test_ratio,
-        seed=args.seed,
-        epochs=args.epochs,
-        batch_size=args.batch_size,
-        lr=args.lr,
-        hidden=args.hidden,
-        dropout=args.dropout,
-    )
+    profile_json = os.path.join(args.out_dir, "propensity_dl.profile.json")
+    with instrument.session("train_propensity_dl", profile_json, args.profile, args.profile_interval_ms):
+        train(
+            dataset_csv=args.dataset_csv,
+            out_dir=args.out_dir,
+            test_ratio=args.test_ratio,
+            seed=args.seed,
+            epochs=args.epochs,
+            batch_size=args.batch_size,
+            lr=args.lr,
+            hidden=args.hidden,
+            dropout=args.dropout,
+            prefetch=args.prefetch,
+        )
 
 
 if __name__ == "__main__":
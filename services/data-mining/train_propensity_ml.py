@@ -2,6 +2,7 @@ import argparse
 import hashlib
 import json
 import os
+from typing import Optional
 
 import joblib
 import numpy as np
@@ -11,6 +12,8 @@ from sklearn.metrics import accuracy_score, roc_auc_score
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import StandardScaler
 
+import instrument
+
 
 FEATURES = [
     "recency_days",
@@ -36,23 +39,33 @@ def split_mask(user_ids: list[str], test_ratio: float) -> np.ndarray:
     return np.array([_stable_hash_u64(u) < threshold for u in user_ids], dtype=bool)
 
 
+def load_columns(dataset_csv: str) -> tuple[np.ndarray, np.ndarray, list[str]]:
+    df = pd.read_csv(dataset_csv)
+    df = df.replace([np.inf, -np.inf], np.nan).fillna(0)
+    y = df["label_purchase_in_window"].astype(int).to_numpy()
+    x = df[FEATURES].astype(float).to_numpy()
+    return x, y, df["user_id"].astype(str).tolist()
+
+
+def load_arrays(dataset_csv: str, test_ratio: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    x, y, user_ids = load_columns(dataset_csv)
+    return x, y, split_mask(user_ids, test_ratio=test_ratio)
+
+
 def train(
     dataset_csv: str,
     out_dir: str,
     test_ratio: float,
     seed: int,
+    c: float = 0.1,
+    arrays: Optional[tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
 ) -> dict[str, float]:
     os.makedirs(out_dir, exist_ok=True)
-    df = pd.read_csv(dataset_csv)
-    df = df.replace([np.inf, -np.inf], np.nan).fillna(0)
-    for col in FEATURES:
-        df[col] = df[col].astype(float).clip(-1_000_000.0, 1_000_000.0)
+    watch = instrument.stopwatch()
+    x, y, is_test = arrays if arrays is not None else load_arrays(dataset_csv, test_ratio)
+    watch.lap("read", rows=len(x))
+    x = np.clip(x, -1_000_000.0, 1_000_000.0)
 
-    y = df["label_purchase_in_window"].astype(int).to_numpy()
-    x = df[FEATURES].astype(float).to_numpy()
-    user_ids = df["user_id"].astype(str).tolist()
-
-    is_test = split_mask(user_ids, test_ratio=test_ratio)
     x_train, x_test = x[~is_test], x[is_test]
     y_train, y_test = y[~is_test], y[is_test]
 
@@ -66,17 +79,19 @@ def train(
                     max_iter=2000,
                     class_weight="balanced",
                     solver="liblinear",
-                    C=0.1,
+                    C=c,
                 ),
             ),
         ]
     )
     model.fit(x_train, y_train)
+    watch.lap("fit", rows=len(x_train))
 
     prob = model.predict_proba(x_test)[:, 1]
     pred = (prob >= 0.5).astype(int)
     auc = float(roc_auc_score(y_test, prob)) if len(np.unique(y_test)) > 1 else float("nan")
     acc = float(accuracy_score(y_test, pred))
+    watch.lap("evaluate", rows=len(x_test))
 
     joblib.dump(model, os.path.join(out_dir, "propensity_ml.joblib"))
     meta = {
@@ -84,10 +99,12 @@ def train(
         "features": FEATURES,
         "test_ratio": test_ratio,
         "seed": seed,
+        "hyperparams": {"c": c},
         "metrics": {"auc": auc, "accuracy": acc},
     }
     with open(os.path.join(out_dir, "propensity_ml.meta.json"), "w", encoding="utf-8") as f:
         json.dump(meta, f, ensure_ascii=False, indent=2)
+    watch.lap("write")
 
     return {"auc": auc, "accuracy": acc}
 
@@ -98,14 +115,19 @@ def main() -> None:
     parser.add_argument("--out_dir", default="services/data-mining/artifacts/propensity_ml")
     parser.add_argument("--test_ratio", type=float, default=0.2)
     parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--c", type=float, default=0.1)
+    instrument.add_args(parser)
     args = parser.parse_args()
 
-    train(
-        dataset_csv=args.dataset_csv,
-        out_dir=args.out_dir,
-        test_ratio=args.test_ratio,
-        seed=args.seed,
-    )
+    profile_json = os.path.join(args.out_dir, "propensity_ml.profile.json")
+    with instrument.session("train_propensity_ml", profile_json, args.profile, args.profile_interval_ms):
+        train(
+            dataset_csv=args.dataset_csv,
+            out_dir=args.out_dir,
+            test_ratio=args.test_ratio,
+            seed=args.seed,
+            c=args.c,
+        )
 
 
 if __name__ == "__main__":
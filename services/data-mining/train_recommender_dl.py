@@ -2,12 +2,18 @@ import argparse
 import json
 import os
 import random
-from collections import defaultdict
+import time
+from collections.abc import Callable, Sequence
+from typing import Optional
 
 import numpy as np
-import pandas as pd
 import torch
 
+import instrument
+from evaluate_recommender import evaluate_split
+from interactions import CACHE_MAX_MB, Interactions, load_interactions
+from mf_artifact import EMB_DTYPES, IdIndex, load_mf, save_mf
+
 
 def _stable_hash_u64(value: str) -> int:
     x = 1469598103934665603
@@ -17,14 +23,89 @@ def _stable_hash_u64(value: str) -> int:
     return x
 
 
-def _read_interactions(order_items_csv: str, orders_csv: str) -> pd.DataFrame:
-    items = pd.read_csv(order_items_csv)
-    orders = pd.read_csv(orders_csv, usecols=["order_id", "user_id"])
-    df = items.merge(orders, on="order_id", how="inner")
-    df["quantity"] = df["quantity"].astype(float)
-    df = df.groupby(["user_id", "product_id"], as_index=False)["quantity"].sum()
-    df.rename(columns={"quantity": "weight"}, inplace=True)
-    return df
+class NegativeSampler:
+    # Positives come as CSR (sorted, de-duplicated columns per row), which is
+    # exactly the cached interaction matrix, so no extra sort is needed.
+    def __init__(
+        self,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        n_items: int,
+        rng: np.random.Generator,
+        popularity_alpha: float = 0.0,
+        max_rounds: int = 10,
+    ):
+        self.n_items = int(n_items)
+        self.rng = rng
+        self.max_rounds = max_rounds
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        rows = np.repeat(np.arange(self.indptr.size - 1, dtype=np.int64), np.diff(self.indptr))
+        self._keys = rows * self.n_items + self.indices
+
+        self._cdf = None
+        if popularity_alpha > 0:
+            counts = np.bincount(self.indices, minlength=self.n_items).astype(np.float64)
+            weights = counts**popularity_alpha
+            if weights.sum() > 0:
+                self._cdf = np.cumsum(weights) / weights.sum()
+
+    @classmethod
+    def from_pairs(
+        cls, user_idx: np.ndarray, item_idx: np.ndarray, n_users: int, n_items: int, rng: np.random.Generator, **kwargs
+    ) -> "NegativeSampler":
+        keys = np.unique(user_idx.astype(np.int64) * int(n_items) + item_idx.astype(np.int64))
+        indptr = np.zeros(int(n_users) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys // int(n_items), minlength=int(n_users)), out=indptr[1:])
+        return cls(indptr, keys % int(n_items), n_items, rng, **kwargs)
+
+    def _draw(self, n: int) -> np.ndarray:
+        if self._cdf is None:
+            return self.rng.integers(0, self.n_items, size=n)
+        picked = np.searchsorted(self._cdf, self.rng.random(n), side="right")
+        return np.minimum(picked, self.n_items - 1)
+
+    def _is_positive(self, users: np.ndarray, items: np.ndarray) -> np.ndarray:
+        if self._keys.size == 0:
+            return np.zeros(users.shape, dtype=bool)
+        query = users * self.n_items + items
+        pos = np.minimum(np.searchsorted(self._keys, query), self._keys.size - 1)
+        return self._keys[pos] == query
+
+    def _draw_complement(self, users: np.ndarray) -> np.ndarray:
+        # Uniform draw from each user's non-positive items: the r-th free item
+        # is r plus the number of positives at or below it. -1 marks users who
+        # have bought every item.
+        out = np.full(users.size, -1, dtype=np.int64)
+        for j, u in enumerate(users):
+            pos = self.indices[self.indptr[u] : self.indptr[u + 1]]
+            free = self.n_items - pos.size
+            if free > 0:
+                r = int(self.rng.integers(0, free))
+                out[j] = r + np.searchsorted(pos - np.arange(pos.size), r, side="right")
+        return out
+
+    def sample(self, users: np.ndarray, k: int) -> np.ndarray:
+        rep = np.repeat(users.astype(np.int64), k)
+        cand = self._draw(rep.size)
+        todo = np.arange(rep.size)
+        for _ in range(self.max_rounds):
+            hit = self._is_positive(rep[todo], cand[todo])
+            todo = todo[hit]
+            if todo.size == 0:
+                break
+            cand[todo] = self._draw(todo.size)
+        else:
+            todo = todo[self._is_positive(rep[todo], cand[todo])]
+            if todo.size:
+                cand[todo] = self._draw_complement(rep[todo])
+        return cand.reshape(-1, k)
+
+
+def _extend_ids(known: IdIndex, ids: np.ndarray) -> IdIndex:
+    # Existing rows keep their position; unseen ids (already sorted) are appended.
+    fresh = ids[known.lookup(ids) < 0]
+    return IdIndex.from_list(np.concatenate([np.asarray(known.ids), fresh]))
 
 
 class MF(torch.nn.Module):
@@ -41,73 +122,84 @@ class MF(torch.nn.Module):
         return (ue * ie).sum(dim=-1)
 
 
-def train(
+def _fit(
     orders_csv: str,
     order_items_csv: str,
-    out_dir: str,
+    split: dict[str, object],
+    init: Optional[tuple[np.ndarray, np.ndarray, IdIndex, IdIndex]],
     dim: int,
     epochs: int,
     batch_size: int,
     lr: float,
     seed: int,
     neg_per_pos: int,
-) -> dict[str, int]:
-    os.makedirs(out_dir, exist_ok=True)
+    popularity_alpha: float,
+    since_days: Optional[float],
+    watch: instrument.Stopwatch,
+    test: Optional[Interactions] = None,
+    eval_k: Sequence[int] = (10, 20),
+    on_epoch: Optional[Callable[[int, dict[str, float]], bool]] = None,
+) -> tuple[MF, IdIndex, IdIndex, Interactions, int]:
     np_rng = np.random.default_rng(seed)
     random.seed(seed)
     torch.manual_seed(seed)
 
-    df = _read_interactions(order_items_csv=order_items_csv, orders_csv=orders_csv)
-    user_ids = df["user_id"].astype(str).tolist()
-    item_ids = df["product_id"].astype(str).tolist()
+    inter = load_interactions(orders_csv, order_items_csv, **split)
+    watch.lap("read", rows=len(inter.indices))
 
-    uniq_users = sorted(set(user_ids))
-    uniq_items = sorted(set(item_ids))
-    user_to_idx = {u: i for i, u in enumerate(uniq_users)}
-    item_to_idx = {p: i for i, p in enumerate(uniq_items)}
+    if init is not None:
+        users = _extend_ids(init[2], inter.user_ids)
+        items = _extend_ids(init[3], inter.item_ids)
+        u_idx, i_idx, w = inter.remap(users, items)
+    else:
+        users, items = inter.users(), inter.items()
+        u_idx, i_idx, w = inter.rows(), np.array(inter.indices), np.array(inter.weights)
 
-    u_idx = np.array([user_to_idx[u] for u in user_ids], dtype=np.int64)
-    i_idx = np.array([item_to_idx[p] for p in item_ids], dtype=np.int64)
-    w = df["weight"].astype(float).to_numpy()
+    if init is None:
+        sampler = NegativeSampler(inter.indptr, inter.indices, len(items), np_rng, popularity_alpha=popularity_alpha)
+    else:
+        sampler = NegativeSampler.from_pairs(
+            u_idx, i_idx, len(users), len(items), np_rng, popularity_alpha=popularity_alpha
+        )
 
-    user_pos: dict[int, set[int]] = defaultdict(set)
-    for uu, ii in zip(u_idx.tolist(), i_idx.tolist()):
-        user_pos[uu].add(ii)
+    if since_days is not None:
+        # Negatives are still rejected against the full history above; only
+        # the positives being fitted are restricted to the recent window.
+        recent = load_interactions(orders_csv, order_items_csv, since_days=since_days, **split)
+        u_idx, i_idx, w = recent.remap(users, items)
 
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = MF(users=len(uniq_users), items=len(uniq_items), dim=dim).to(device)
+    model = MF(users=len(users), items=len(items), dim=dim)
+    if init is not None:
+        with torch.no_grad():
+            model.user.weight[: init[0].shape[0]] = torch.from_numpy(np.asarray(init[0], dtype=np.float32))
+            model.item.weight[: init[1].shape[0]] = torch.from_numpy(np.asarray(init[1], dtype=np.float32))
+    model = model.to(device)
     opt = torch.optim.AdamW(model.parameters(), lr=lr)
 
-    def sample_neg(u: int) -> int:
-        pos = user_pos.get(u, set())
-        while True:
-            cand = int(np_rng.integers(0, len(uniq_items)))
-            if cand not in pos:
-                return cand
+    tu_all = torch.from_numpy(u_idx).to(device)
+    ti_all = torch.from_numpy(i_idx).to(device)
+    tw_all = torch.from_numpy(w.astype(np.float32)).to(device)
 
     n = len(u_idx)
-    for _ in range(epochs):
+    watch.lap("transform", rows=n)
+
+    for epoch in range(epochs):
         perm = np_rng.permutation(n)
         for start in range(0, n, batch_size):
             batch_ids = perm[start : start + batch_size]
-            bu = u_idx[batch_ids]
-            bi = i_idx[batch_ids]
-            bw = w[batch_ids]
-
-            negs = []
-            for uu in bu.tolist():
-                for _ in range(neg_per_pos):
-                    negs.append(sample_neg(uu))
-            negs = np.array(negs, dtype=np.int64).reshape(-1, neg_per_pos)
-
-            u_rep = np.repeat(bu, neg_per_pos)
-            i_pos_rep = np.repeat(bi, neg_per_pos)
-            i_neg_rep = negs.reshape(-1)
+            with instrument.phase("sample", rows=len(batch_ids) * neg_per_pos):
+                negs = sampler.sample(u_idx[batch_ids], neg_per_pos)
 
-            tu = torch.from_numpy(u_rep).to(device)
-            ti_pos = torch.from_numpy(i_pos_rep).to(device)
-            ti_neg = torch.from_numpy(i_neg_rep).to(device)
-            tw = torch.from_numpy(np.repeat(bw, neg_per_pos)).float().to(device)
+            tb = torch.from_numpy(batch_ids).to(device)
+            tu = tu_all[tb].repeat_interleave(neg_per_pos)
+            ti_pos = ti_all[tb].repeat_interleave(neg_per_pos)
+            negs = negs.reshape(-1)
+            ti_neg = torch.from_numpy(np.maximum(negs, 0)).to(device)
+            tw = tw_all[tb].repeat_interleave(neg_per_pos)
+            if (negs < 0).any():
+                # Users who bought every item have no negative to contrast with.
+                tw = tw * torch.from_numpy(negs >= 0).to(device)
 
             s_pos = model.score(tu, ti_pos)
             s_neg = model.score(tu, ti_neg)
@@ -117,19 +209,134 @@ def train(
             opt.zero_grad(set_to_none=True)
             loss.backward()
             opt.step()
+        # Rows are training pairs (one positive against one sampled negative).
+        watch.lap("train_epoch", rows=n * neg_per_pos)
+
+        if on_epoch is not None and test is not None and epoch + 1 < epochs:
+            user_emb = model.user.weight.detach().cpu().numpy()
+            item_emb = model.item.weight.detach().cpu().numpy()
+            stop = on_epoch(epoch + 1, evaluate_split(user_emb, item_emb, users, items, inter, test, eval_k))
+            watch.lap("evaluate")
+            if stop:
+                break
+
+    return model, users, items, inter, n
+
+
+def train(
+    orders_csv: str,
+    order_items_csv: str,
+    out_dir: str,
+    dim: int,
+    epochs: int,
+    batch_size: int,
+    lr: float,
+    seed: int,
+    neg_per_pos: int,
+    neg_sampling: str = "uniform",
+    neg_alpha: float = 0.75,
+    emb_dtype: str = "float32",
+    init_from: Optional[str] = None,
+    since_days: Optional[float] = None,
+    cache_dir: Optional[str] = None,
+    cache_max_mb: int = CACHE_MAX_MB,
+    holdout_orders: int = 1,
+    holdout_offset: int = 0,
+    eval_k: Sequence[int] = (10, 20),
+    refit: bool = True,
+    on_epoch: Optional[Callable[[int, dict[str, float]], bool]] = None,
+) -> dict[str, float]:
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Each user's last `holdout_orders` orders are kept out of training and
+    # scored afterwards; with `refit` the saved model is then fitted again on
+    # the full history. 0 (--no_eval) only does the full fit.
+    # `holdout_offset` drops each user's last orders first (see hparam_search).
+    split = {
+        "holdout_orders": holdout_orders,
+        "holdout_offset": holdout_offset,
+        "cache_dir": cache_dir,
+        "cache_max_mb": cache_max_mb,
+    }
+    watch = instrument.stopwatch()
+
+    init = None
+    if init_from:
+        init = load_mf(init_from, mmap_mode=None)
+        if init[0].shape[1] != dim:
+            raise ValueError(f"dim={dim} does not match the warm-start artifact (dim={init[0].shape[1]})")
+
+    fit_args = {
+        "orders_csv": orders_csv,
+        "order_items_csv": order_items_csv,
+        "init": init,
+        "dim": dim,
+        "epochs": epochs,
+        "batch_size": batch_size,
+        "lr": lr,
+        "seed": seed,
+        "neg_per_pos": neg_per_pos,
+        "popularity_alpha": neg_alpha if neg_sampling == "popularity" else 0.0,
+        "since_days": since_days,
+        "watch": watch,
+    }
+
+    def save(model: MF, users: IdIndex, items: IdIndex) -> None:
+        torch.save(
+            {"state_dict": model.state_dict(), "dim": dim},
+            os.path.join(out_dir, "recommender_mf.pt"),
+        )
+        save_mf(
+            out_dir,
+            user_emb=model.user.weight.detach().cpu().numpy(),
+            item_emb=model.item.weight.detach().cpu().numpy(),
+            user_ids=users.ids,
+            item_ids=items.ids,
+            emb_dtype=emb_dtype,
+        )
+        watch.lap("write", rows=len(users) + len(items))
+
+    metrics = None
+    evaluation = None
+    full_history = holdout_orders <= 0
+    if not full_history:
+        test = load_interactions(orders_csv, order_items_csv, test=True, **split)
+        watch.lap("read", rows=len(test.indices))
+        model, users, items, inter, n_train = _fit(
+            split=split, test=test, eval_k=eval_k, on_epoch=on_epoch, **fit_args
+        )
+        # Scored from the saved artifact so metrics reflect emb_dtype.
+        save(model, users, items)
+        started = time.perf_counter()
+        saved = load_mf(out_dir)
+        metrics = evaluate_split(saved[0], saved[1], users, items, inter, test, eval_k)
+        evaluation = {
+            "holdout_orders": holdout_orders,
+            "holdout_offset": holdout_offset,
+            "seconds": time.perf_counter() - started,
+        }
+        watch.lap("evaluate", rows=len(test.indices))
+        full_history = refit
+
+    if full_history:
+        model, users, items, _, n_train = _fit(split={**split, "holdout_orders": 0}, **fit_args)
+        save(model, users, items)
 
-    torch.save(
-        {"state_dict": model.state_dict(), "dim": dim},
-        os.path.join(out_dir, "recommender_mf.pt"),
-    )
-    with open(os.path.join(out_dir, "recommender_mf.users.json"), "w", encoding="utf-8") as f:
-        json.dump(uniq_users, f, ensure_ascii=False)
-    with open(os.path.join(out_dir, "recommender_mf.items.json"), "w", encoding="utf-8") as f:
-        json.dump(uniq_items, f, ensure_ascii=False)
+    warm_start = None
+    if init is not None:
+        warm_start = {
+            "init_from": os.path.abspath(init_from),
+            "new_users": len(users) - len(init[2]),
+            "new_items": len(items) - len(init[3]),
+            "since_days": since_days,
+            "train_interactions": n_train,
+        }
     meta = {
         "model_type": "matrix_factorization",
-        "users": len(uniq_users),
-        "items": len(uniq_items),
+        "users": len(users),
+        "items": len(items),
+        "emb_dtype": emb_dtype,
+        "warm_start": warm_start,
         "hyperparams": {
             "dim": dim,
             "epochs": epochs,
@@ -137,12 +344,19 @@ def train(
             "lr": lr,
             "seed": seed,
             "neg_per_pos": neg_per_pos,
+            "neg_sampling": neg_sampling,
+            "neg_alpha": neg_alpha,
         },
+        "metrics": metrics,
+        "evaluation": evaluation,
+        # The saved embeddings have seen the held-out orders when true, so
+        # evaluate_recommender will not re-score them against the same split.
+        "full_history": full_history,
     }
     with open(os.path.join(out_dir, "recommender_mf.meta.json"), "w", encoding="utf-8") as f:
         json.dump(meta, f, ensure_ascii=False, indent=2)
 
-    return {"users": len(uniq_users), "items": len(uniq_items)}
+    return {"users": float(len(users)), "items": float(len(items)), **(metrics or {})}
 
 
 def main() -> None:
@@ -156,19 +370,41 @@ def main() -> None:
     parser.add_argument("--lr", type=float, default=0.003)
     parser.add_argument("--seed", type=int, default=7)
     parser.add_argument("--neg_per_pos", type=int, default=3)
+    parser.add_argument("--neg_sampling", choices=["uniform", "popularity"], default="uniform")
+    parser.add_argument("--neg_alpha", type=float, default=0.75)
+    parser.add_argument("--emb_dtype", choices=list(EMB_DTYPES), default="float32")
+    parser.add_argument("--init_from", default=None)
+    parser.add_argument("--since_days", type=float, default=None)
+    parser.add_argument("--cache_dir", default="services/data-mining/data/cache/interactions")
+    parser.add_argument("--cache_max_mb", type=int, default=CACHE_MAX_MB)
+    parser.add_argument("--holdout_orders", type=int, default=1)
+    parser.add_argument("--no_eval", action="store_true")
+    parser.add_argument("--eval_k", type=int, nargs="+", default=[10, 20])
+    instrument.add_args(parser)
     args = parser.parse_args()
 
-    train(
-        orders_csv=args.orders_csv,
-        order_items_csv=args.order_items_csv,
-        out_dir=args.out_dir,
-        dim=args.dim,
-        epochs=args.epochs,
-        batch_size=args.batch_size,
-        lr=args.lr,
-        seed=args.seed,
-        neg_per_pos=args.neg_per_pos,
-    )
+    profile_json = os.path.join(args.out_dir, "recommender_mf.profile.json")
+    with instrument.session("train_recommender_dl", profile_json, args.profile, args.profile_interval_ms):
+        train(
+            orders_csv=args.orders_csv,
+            order_items_csv=args.order_items_csv,
+            out_dir=args.out_dir,
+            dim=args.dim,
+            epochs=args.epochs,
+            batch_size=args.batch_size,
+            lr=args.lr,
+            seed=args.seed,
+            neg_per_pos=args.neg_per_pos,
+            neg_sampling=args.neg_sampling,
+            neg_alpha=args.neg_alpha,
+            emb_dtype=args.emb_dtype,
+            init_from=args.init_from,
+            since_days=args.since_days,
+            cache_dir=args.cache_dir,
+            cache_max_mb=args.cache_max_mb,
+            holdout_orders=0 if args.no_eval else args.holdout_orders,
+            eval_k=args.eval_k,
+        )
 
 
 if __name__ == "__main__":